@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 from grpc import Status
@@ -14,10 +15,13 @@ from app.models.user_model import User
 from app.services.admin_service import admin_service
 from app.schemas.admin_schema import UserOut, UsersOut, MessageOut, ErrorOut
 from app.services.config_service import config_service
+from app.metrics import metrics
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.settings import Settings
-from app.api.chat.engine.vectordb import get_vector_store
+from app.api.chat.engine.vectordb import ensure_payload_indexes, get_vector_store
+from app.api.chat.engine.index import bump_ingestion_version
+from app.concurrent_embedding import get_ingestion_embed_model
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.schema import Document
 from phoenix.trace import using_project
@@ -134,6 +138,11 @@ async def delete_user(user_id: str, admin: User = Depends(verify_admin)) -> Mess
     return MessageOut(message="User deleted successfully")
 
 
+@admin_router.get("/metrics")
+async def get_metrics(admin: User = Depends(verify_admin)) -> Dict[str, float]:
+    return metrics.snapshot()
+
+
 @admin_router.get("/system-prompt")
 async def get_system_prompt(admin: User = Depends(verify_admin)):
     system_prompt = await config_service.get_system_prompt()
@@ -260,18 +269,24 @@ async def upload_and_ingest_data(
 
                 vector_store = get_vector_store()
 
+                splitter = SentenceSplitter(
+                    chunk_size=Settings.chunk_size,
+                    chunk_overlap=Settings.chunk_overlap,
+                )
+                embed_model = get_ingestion_embed_model([splitter])
                 pipeline = IngestionPipeline(
-                    transformations=[
-                        SentenceSplitter(
-                            chunk_size=Settings.chunk_size,
-                            chunk_overlap=Settings.chunk_overlap,
-                        ),
-                        Settings.embed_model,
-                    ],
+                    transformations=[splitter, embed_model],
                     vector_store=vector_store,
                 )
 
-                nodes = pipeline.run(documents=documents, show_progress=True)
+                # Off the event loop, the embedding batches run concurrently
+                nodes = await asyncio.to_thread(
+                    pipeline.run, documents=documents, show_progress=True
+                )
+                embed_model.cache_stats.log()
+                # Blocking Qdrant and MongoDB calls
+                await asyncio.to_thread(ensure_payload_indexes)
+                await asyncio.to_thread(bump_ingestion_version)
 
             return JSONResponse(
                 status_code=200,
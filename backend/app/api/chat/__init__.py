@@ -1,5 +1,5 @@
 from .route import chat_router
 from .chat_config import config_router
-from .upload import file_upload_router
+from .upload import file_upload_router, private_file_router
 
-__all__ = ["chat_router", "config_router", "file_upload_router"]
\ No newline at end of file
+__all__ = ["chat_router", "config_router", "file_upload_router", "private_file_router"]
\ No newline at end of file
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Optional, Set, Tuple
+
+from fastapi import Request
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+
+from app.metrics import metrics
+
+logger = logging.getLogger("uvicorn")
+
+# Keep a reference to the detached tasks, so they are not garbage collected
+_detached_tasks: Set[asyncio.Task] = set()
+
+
+def spawn_detached(coro: Awaitable[Any]) -> asyncio.Task:
+    """
+    Run a coroutine outside of the current task, e.g. to finish work of a cancelled request
+    """
+    task = asyncio.ensure_future(coro)
+    _detached_tasks.add(task)
+    task.add_done_callback(_detached_tasks.discard)
+    return task
+
+
+class DisconnectWatcher:
+    """
+    Watch the client connection of a streaming chat request.
+    As soon as the client goes away, the retrieval, the LLM generation and the
+    follow-up tasks (e.g. suggestions) of the request are cancelled.
+    The LLM stream is stopped cleanly, so the partial answer can still be persisted.
+    """
+
+    # Running average of the answer length (in streamed tokens), used to estimate the saved tokens
+    _avg_answer_tokens: float = 0.0
+
+    def __init__(self, request: Request):
+        self.request = request
+        self.poll_interval = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+        self.disconnected = False
+        self.streamed_tokens = 0
+        self._watcher: Optional[asyncio.Task] = None
+        self._tasks: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = set()
+
+    def start(self):
+        self._watcher = asyncio.create_task(self._watch())
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def _watch(self):
+        while not self.disconnected:
+            if await self.request.is_disconnected():
+                logger.info("Client disconnected, cancelling the chat generation")
+                self.cancel()
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    def track_task(self, task: asyncio.Task):
+        entry = (task.get_loop(), task)
+        self._tasks.add(entry)
+        task.add_done_callback(lambda _: self._tasks.discard(entry))
+
+    def cancel(self):
+        if self.disconnected:
+            return
+        self.disconnected = True
+        self.stop()
+        for loop, task in list(self._tasks):
+            # The LLM stream might be consumed by a thread running its own loop
+            loop.call_soon_threadsafe(task.cancel)
+
+        metrics.incr("chat.cancelled_streams")
+        metrics.incr("chat.cancelled_tokens_streamed", self.streamed_tokens)
+        saved = max(0.0, DisconnectWatcher._avg_answer_tokens - self.streamed_tokens)
+        metrics.incr("chat.tokens_saved_estimate", saved)
+
+    def record_completion(self):
+        # Exponential moving average over the completed answers
+        avg = DisconnectWatcher._avg_answer_tokens
+        DisconnectWatcher._avg_answer_tokens = (
+            self.streamed_tokens if avg == 0 else 0.9 * avg + 0.1 * self.streamed_tokens
+        )
+
+    async def run(self, coro: Awaitable[Any]) -> Any:
+        """
+        Run a follow-up coroutine of the request, cancelled if the client disconnects
+        """
+        task = asyncio.ensure_future(coro)
+        self.track_task(task)
+        return await task
+
+    async def start_chat(
+        self, chat_coro: Awaitable[StreamingAgentChatResponse]
+    ) -> StreamingAgentChatResponse:
+        """
+        Run the retrieval and start the LLM stream of the chat engine.
+        Raises asyncio.CancelledError if the client disconnects meanwhile.
+        """
+
+        async def _start():
+            response = await chat_coro
+            # The chat engine starts consuming the LLM stream in a new task,
+            # wrap the stream before that task gets the chance to run
+            self.track_response(response)
+            return response
+
+        return await self.run(_start())
+
+    def track_response(self, response: StreamingAgentChatResponse):
+        if response.achat_stream is not None:
+            response.achat_stream = self._cancellable_stream(response.achat_stream)
+
+    async def _cancellable_stream(self, stream):
+        task = asyncio.current_task()
+        entry = (task.get_loop(), task)
+        self._tasks.add(entry)
+        try:
+            async for chunk in stream:
+                self.streamed_tokens += 1
+                yield chunk
+        except asyncio.CancelledError:
+            if not self.disconnected:
+                raise
+            # End the stream as if the LLM was done, this closes the upstream
+            # request and keeps the answer generated so far
+            task.uncancel()
+        finally:
+            self._tasks.discard(entry)
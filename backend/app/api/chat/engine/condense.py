@@ -0,0 +1,77 @@
+import hashlib
+import os
+import re
+import threading
+from typing import List, Optional
+
+from cachetools import TTLCache
+from llama_index.core.llms import ChatMessage
+
+CONDENSE_POLICIES = ("always", "auto")
+
+# Words referring to earlier turns, a question containing one of them needs the chat history
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|him|his|she|her|there|"
+    r"above|previous|earlier|former|latter|same|else|more|again|also|one|ones)\b",
+    re.IGNORECASE,
+)
+FOLLOW_UP_STARTS = ("and ", "but ", "or ", "so ", "then ", "what about", "how about")
+MIN_SELF_CONTAINED_WORDS = 4
+
+
+def get_condense_policy() -> str:
+    """
+    "always" condenses every follow-up question with the chat history,
+    "auto" also skips the questions that look self-contained
+    """
+    policy = os.getenv("CONDENSE_POLICY", "always").lower()
+    if policy not in CONDENSE_POLICIES:
+        raise ValueError(f"Invalid condense policy: {policy}")
+    return policy
+
+
+def is_self_contained(message: str) -> bool:
+    """
+    Cheap heuristic: long enough, not starting like a follow-up and without references to earlier turns
+    """
+    text = message.strip().lower()
+    if len(text.split()) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    if text.startswith(FOLLOW_UP_STARTS):
+        return False
+    return FOLLOW_UP_PATTERN.search(text) is None
+
+
+class CondenseCache:
+    """
+    Condensed questions by conversation, history and message,
+    so regenerating or retrying an answer doesn't condense the question again
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = TTLCache(
+            maxsize=int(os.getenv("CONDENSE_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("CONDENSE_CACHE_TTL", "3600")),
+        )
+
+    @staticmethod
+    def key(
+        conversation_id: Optional[str], chat_history: List[ChatMessage], message: str
+    ) -> str:
+        digest = hashlib.sha256((conversation_id or "").encode())
+        for chat_message in chat_history:
+            digest.update(f"\n{chat_message.role}:{chat_message.content}".encode())
+        digest.update(f"\n{message}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: str, condensed_question: str):
+        with self._lock:
+            self._cache[key] = condensed_question
+
+
+condense_cache = CondenseCache()
@@ -1,50 +1,251 @@
+import asyncio
 import os
+import logging
+import threading
+from typing import List, Optional, Tuple
 
-from app.api.chat.engine.index import get_index
-from app.api.chat.engine.node_postprocessors import NodeCitationProcessor
+from app.api.chat.engine.condense import (
+    condense_cache,
+    get_condense_policy,
+    is_self_contained,
+)
+from app.api.chat.engine.index import get_index, get_ingestion_version
+from app.api.chat.engine.node_postprocessors import (
+    NodeCitationProcessor,
+    get_context_packer,
+    get_rerank_candidates,
+    get_reranker,
+)
+from app.api.chat.engine.query_filter import generate_routed_filters
+from app.api.chat.engine.routing import (
+    TenantRoutedRetriever,
+    get_tenant_index,
+    is_tenant_routing_enabled,
+)
+from app.api.chat.engine.sparse import is_hybrid_enabled
 from fastapi import HTTPException
 from llama_index.core.chat_engine import CondensePlusContextChatEngine
+from llama_index.core import QueryBundle
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.llms import ChatMessage
+from llama_index.core.schema import MetadataMode, NodeWithScore
 
-from app.db import sync_mongodb
-from motor.motor_asyncio import AsyncIOMotorClient
+from app.metrics import metrics
 
+logger = logging.getLogger("uvicorn")
 
-def get_system_prompt_from_db():
-    config_collection = sync_mongodb.db.config
-    config = config_collection.find_one({"_id": "app_config"})
-    if config and "SYSTEM_PROMPT" in config:
-        return config["SYSTEM_PROMPT"]
-    return None
 
+class RAGChatEngine(CondensePlusContextChatEngine):
+    """
+    Condense plus context chat engine that avoids the condense LLM call when possible:
+    the condensed question is remembered, so it can be computed ahead of the chat
+    (e.g. for the answer cache), and cached per conversation for regenerations and retries.
+    With the "auto" policy, self-contained questions are used as they are.
+    """
 
-def get_chat_engine(filters=None, params=None):
-    system_prompt = get_system_prompt_from_db()
-    if system_prompt is None:
-        system_prompt = os.getenv("SYSTEM_PROMPT", "")
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condensed_question: Optional[Tuple[str, str]] = None
+        self.conversation_id: Optional[str] = None
+        self.condense_policy = get_condense_policy()
 
-    citation_prompt = os.getenv("SYSTEM_CITATION_PROMPT", None)
-    top_k = int(os.getenv("TOP_K", 0))
+    @property
+    def retriever(self):
+        return self._retriever
 
-    # node_postprocessors = []
-    # if citation_prompt:
-    #     node_postprocessors = [NodeCitationProcessor()]
-    #     system_prompt = f"{system_prompt}\n{citation_prompt}"
+    async def acondense_question(
+        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+    ) -> str:
+        if chat_history is not None:
+            self._memory.set(chat_history)
+        return await self._acondense_question(self._memory.get(input=message), message)
 
-    index = get_index(params)
-    if index is None:
-        raise HTTPException(
-            status_code=500,
-            detail=str(
-                "StorageContext is empty - call 'poetry run generate' to generate the storage first"
+    async def _acondense_question(
+        self, chat_history: List[ChatMessage], latest_message: str
+    ) -> str:
+        if self._condensed_question is not None:
+            message, condensed_question = self._condensed_question
+            if message == latest_message:
+                return condensed_question
+
+        condensed_question = await self._condense_with_policy(
+            chat_history, latest_message
+        )
+        self._condensed_question = (latest_message, condensed_question)
+        return condensed_question
+
+    async def _condense_with_policy(
+        self, chat_history: List[ChatMessage], latest_message: str
+    ) -> str:
+        if len(chat_history) == 0:
+            metrics.incr("condense.skipped_first_turn")
+            return latest_message
+        if self.condense_policy == "auto" and is_self_contained(latest_message):
+            metrics.incr("condense.skipped_self_contained")
+            return latest_message
+
+        cache_key = condense_cache.key(
+            self.conversation_id, chat_history, latest_message
+        )
+        condensed_question = condense_cache.get(cache_key)
+        if condensed_question is not None:
+            metrics.incr("condense.cache_hits")
+            return condensed_question
+
+        metrics.incr("condense.calls")
+        condensed_question = await super()._acondense_question(
+            chat_history, latest_message
+        )
+        condense_cache.set(cache_key, condensed_question)
+        return condensed_question
+
+    async def _aretrieve_context(self, message: str) -> Tuple[str, List[NodeWithScore]]:
+        nodes = await self._retriever.aretrieve(message)
+        for postprocessor in self._node_postprocessors:
+            # The postprocessors are sync (e.g. a reranker model), keep them off the event loop
+            nodes = await asyncio.to_thread(
+                postprocessor.postprocess_nodes,
+                nodes,
+                query_bundle=QueryBundle(message),
+            )
+
+        context_str = "\n\n".join(
+            [n.node.get_content(metadata_mode=MetadataMode.LLM).strip() for n in nodes]
+        )
+        return context_str, nodes
+
+
+class ChatEngineFactory:
+    """
+    Long-lived factory for the chat engine.
+    The index (and the vector store clients behind it) is created once and reused,
+    only the per-request parts (retriever filters and chat memory) are built per chat.
+    The index is rebuilt when the ingestion version changes, the version is shared with
+    generate and the other workers through MongoDB. The system prompt is per chat engine.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._version = None
+
+    def get_index(self, params=None):
+        version = get_ingestion_version()
+        index = self._index
+        if index is not None and self._version == version:
+            return index
+        with self._lock:
+            # Another request might have rebuilt the index while we were waiting
+            if self._index is None or self._version != version:
+                logger.info("Chat engine cache is stale, reloading the index")
+                self._index = get_index(params)
+                self._version = version
+            return self._index
+
+    def get_retriever(self, index, filters, retriever_kwargs, tenant_id, doc_ids):
+        if not (is_tenant_routing_enabled() and tenant_id):
+            return index.as_retriever(filters=filters, **retriever_kwargs)
+
+        # The private documents live in the tenant's collection, query both concurrently
+        public_filters, private_filters = generate_routed_filters(doc_ids or [])
+        private_retriever = (
+            get_tenant_index(tenant_id).as_retriever(
+                filters=private_filters, **retriever_kwargs
+            )
+            if private_filters is not None
+            else None
+        )
+        return TenantRoutedRetriever(
+            public_retriever=index.as_retriever(
+                filters=public_filters, **retriever_kwargs
             ),
+            private_retriever=private_retriever,
+            top_k=retriever_kwargs.get("similarity_top_k", DEFAULT_SIMILARITY_TOP_K),
         )
 
-    retriever = index.as_retriever(
-        filters=filters, **({"similarity_top_k": top_k} if top_k != 0 else {})
-    )
+    def get_chat_engine(
+        self,
+        filters=None,
+        params=None,
+        system_prompt=None,
+        conversation_id=None,
+        tenant_id=None,
+        doc_ids=None,
+    ):
+        # The system prompt is read from the cached app config by the caller
+        if system_prompt is None:
+            system_prompt = os.getenv("SYSTEM_PROMPT", "")
+
+        citation_prompt = os.getenv("SYSTEM_CITATION_PROMPT", None)
+        top_k = int(os.getenv("TOP_K", 0))
+
+        node_postprocessors = []
+        # if citation_prompt:
+        #     node_postprocessors = [NodeCitationProcessor()]
+        #     system_prompt = f"{system_prompt}\n{citation_prompt}"
+
+        reranker = get_reranker()
+        if reranker is not None:
+            # Over-fetch the candidates, only the reranked top_n reach the LLM
+            top_k = get_rerank_candidates()
+            node_postprocessors.append(reranker)
+
+        context_packer = get_context_packer()
+        if context_packer is not None:
+            node_postprocessors.append(context_packer)
+
+        index = self.get_index(params)
+        if index is None:
+            raise HTTPException(
+                status_code=500,
+                detail=str(
+                    "StorageContext is empty - call 'poetry run generate' to generate the storage first"
+                ),
+            )
+
+        retriever_kwargs = {"similarity_top_k": top_k} if top_k != 0 else {}
+        if is_hybrid_enabled():
+            # Keyword matches are ranked by the sparse vectors and fused with the dense results
+            retriever_kwargs.update(
+                vector_store_query_mode="hybrid",
+                sparse_top_k=int(os.getenv("SPARSE_TOP_K", "10")),
+                alpha=float(os.getenv("HYBRID_ALPHA", "0.5")),
+            )
+        retriever = self.get_retriever(
+            index, filters, retriever_kwargs, tenant_id, doc_ids
+        )
+
+        # The chat engine holds the chat memory, so it must not be shared between requests
+        chat_engine = RAGChatEngine.from_defaults(
+            system_prompt=system_prompt,
+            retriever=retriever,
+            node_postprocessors=node_postprocessors,
+        )
+        chat_engine.conversation_id = conversation_id
+        return chat_engine
+
+
+chat_engine_factory = ChatEngineFactory()
+
 
-    return CondensePlusContextChatEngine.from_defaults(
+def get_chat_engine(
+    filters=None,
+    params=None,
+    system_prompt=None,
+    conversation_id=None,
+    tenant_id=None,
+    doc_ids=None,
+):
+    return chat_engine_factory.get_chat_engine(
+        filters=filters,
+        params=params,
         system_prompt=system_prompt,
-        retriever=retriever,
-        # node_postprocessors=node_postprocessors,
+        conversation_id=conversation_id,
+        tenant_id=tenant_id,
+        doc_ids=doc_ids,
     )
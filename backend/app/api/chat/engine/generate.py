@@ -5,9 +5,14 @@ load_dotenv()
 
 import logging
 import os
-
-from app.api.chat.engine.loaders import get_documents
-from app.api.chat.engine.vectordb import get_vector_store
+import time
+from itertools import islice
+
+from app.api.chat.engine.index import bump_ingestion_version
+from app.api.chat.engine.loaders import LoadResult, iter_documents, load_documents
+from app.api.chat.engine.loaders.manifest import FileManifest
+from app.api.chat.engine.vectordb import ensure_payload_indexes, get_vector_store
+from app.concurrent_embedding import IngestionCacheStats, get_ingestion_embed_model
 from app.settings import init_settings
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
@@ -19,6 +24,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
 STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
+MANIFEST_FILE = "file_manifest.json"
 
 
 def get_doc_store():
@@ -30,22 +36,36 @@ def get_doc_store():
         return SimpleDocumentStore()
 
 
-def run_pipeline(docstore, vector_store, documents):
+def run_pipeline(
+    docstore,
+    vector_store,
+    documents,
+    docstore_strategy="upserts_and_delete",
+    store_doc_text=True,
+    cache_stats=None,
+):
+    """
+    Without `cache_stats`, the ingestion cache summary of this run is logged at the end,
+    generate passes its own to log one summary for all the windows
+    """
+    splitter = SentenceSplitter(
+        chunk_size=Settings.chunk_size,
+        chunk_overlap=Settings.chunk_overlap,
+    )
+    embed_model = get_ingestion_embed_model([splitter], cache_stats)
     pipeline = IngestionPipeline(
-        transformations=[
-            SentenceSplitter(
-                chunk_size=Settings.chunk_size,
-                chunk_overlap=Settings.chunk_overlap,
-            ),
-            Settings.embed_model,
-        ],
+        transformations=[splitter, embed_model],
         docstore=docstore,
-        docstore_strategy="upserts_and_delete",
+        docstore_strategy=docstore_strategy,
         vector_store=vector_store,
     )
 
     # Run the ingestion pipeline and store the results
-    nodes = pipeline.run(show_progress=True, documents=documents)
+    nodes = pipeline.run(
+        show_progress=True, documents=documents, store_doc_text=store_doc_text
+    )
+    if cache_stats is None:
+        embed_model.cache_stats.log()
 
     return nodes
 
@@ -58,24 +78,130 @@ def persist_storage(docstore, vector_store):
     storage_context.persist(STORAGE_DIR)
 
 
+def is_incremental_enabled() -> bool:
+    return os.getenv("GENERATE_INCREMENTAL", "true").lower() == "true"
+
+
+def delete_documents(docstore, vector_store, doc_ids):
+    for doc_id in doc_ids:
+        docstore.delete_document(doc_id, raise_error=False)
+        vector_store.delete(doc_id)
+
+
+def get_window_size() -> int:
+    return int(os.getenv("GENERATE_WINDOW_SIZE", "0"))
+
+
+def mark_public(documents):
+    # Set private=false to mark the document as public (required for filtering)
+    for doc in documents:
+        doc.metadata["private"] = "false"
+
+
+def ingest_windows(docstore, vector_store, manifest, window_size: int, cache_stats):
+    """
+    Stream the documents through the pipeline in windows of `window_size` documents,
+    the memory used doesn't depend on the size of the corpus.
+    The docstore only keeps the document hashes, not their text.
+    """
+    result = LoadResult()
+    documents = iter_documents(result, manifest)
+    loaded_doc_ids = set()
+    ingest_s = 0.0
+    while window := list(islice(documents, window_size)):
+        mark_public(window)
+        loaded_doc_ids.update(doc.doc_id for doc in window)
+        start = time.perf_counter()
+        run_pipeline(
+            docstore,
+            vector_store,
+            window,
+            "upserts",
+            store_doc_text=False,
+            cache_stats=cache_stats,
+        )
+        ingest_s += time.perf_counter() - start
+        logger.info(f"Ingested {len(loaded_doc_ids)} documents")
+    return result, loaded_doc_ids, ingest_s
+
+
 def generate_datasource():
     init_settings()
     logger.info("Generate index for the provided data")
+    start = time.perf_counter()
 
     # Get the stores and documents or create new ones
-    documents = get_documents()
-    # Set private=false to mark the document as public (required for filtering)
-    for doc in documents:
-        doc.metadata["private"] = "false"
     docstore = get_doc_store()
     vector_store = get_vector_store()
+    manifest = None
+    if is_incremental_enabled():
+        manifest = FileManifest.load(os.path.join(STORAGE_DIR, MANIFEST_FILE))
+        manifest.discard_missing(
+            lambda doc_id: docstore.get_document_hash(doc_id) is not None
+        )
+
+    cache_stats = IngestionCacheStats()
+    window_size = get_window_size()
+    if window_size > 0:
+        result, loaded_doc_ids, ingest_s = ingest_windows(
+            docstore, vector_store, manifest, window_size, cache_stats
+        )
+    else:
+        result = load_documents(manifest)
+        mark_public(result.documents)
+        loaded_doc_ids = {doc.doc_id for doc in result.documents}
+        # Run the ingestion pipeline
+        pipeline_start = time.perf_counter()
+        run_pipeline(
+            docstore,
+            vector_store,
+            result.documents,
+            "upserts",
+            cache_stats=cache_stats,
+        )
+        ingest_s = time.perf_counter() - pipeline_start
+    load_s = time.perf_counter() - start - ingest_s
+
+    # Delete the documents that are neither loaded nor from an unchanged file.
+    # A failed loader returns no documents, deleting the missing documents would
+    # remove its source from the index
+    stale_doc_ids = set()
+    if result.failures:
+        logger.warning(
+            f"Loaders failed: {', '.join(result.failures)}, keeping the existing documents"
+        )
+    else:
+        kept_doc_ids = set(loaded_doc_ids)
+        if manifest is not None:
+            kept_doc_ids |= manifest.unchanged_doc_ids()
+        stale_doc_ids = set(docstore.get_all_document_hashes().values()) - kept_doc_ids
+    delete_start = time.perf_counter()
+    delete_documents(docstore, vector_store, stale_doc_ids)
+    delete_s = time.perf_counter() - delete_start
 
-    # Run the ingestion pipeline
-    _ = run_pipeline(docstore, vector_store, documents)
+    # Index the filtered payload fields (the collection exists after the first ingestion)
+    ensure_payload_indexes()
 
     # Build the index and persist storage
     persist_storage(docstore, vector_store)
-
+    # The manifest is only valid if the file loader read the whole data directory
+    if manifest is not None and "file" not in result.failures:
+        manifest.save()
+    # The running servers drop their cached index and answers
+    bump_ingestion_version()
+
+    if manifest is not None:
+        logger.info(
+            f"Files: {len(manifest.unchanged)} unchanged (skipped), "
+            f"{len(manifest.new)} new, {len(manifest.updated)} updated, "
+            f"{len(manifest.deleted)} deleted"
+        )
+    cache_stats.log()
+    logger.info(
+        f"Documents: {len(loaded_doc_ids)} loaded, {len(stale_doc_ids)} deleted "
+        f"in {load_s:.1f}s loading, {delete_s:.1f}s deleting, "
+        f"{ingest_s:.1f}s ingesting, {time.perf_counter() - start:.1f}s total"
+    )
     logger.info("Finished generating the index")
 
 
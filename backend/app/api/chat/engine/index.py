@@ -1,11 +1,130 @@
 import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional
 from llama_index.core.indices import VectorStoreIndex
+from pymongo.errors import PyMongoError
 from app.api.chat.engine.vectordb import get_vector_store
 
 
 logger = logging.getLogger("uvicorn")
 
 
+class IngestionVersion:
+    """
+    Version of the indexed data, incremented every time new data is ingested into the
+    vector store and used to invalidate anything cached on top of the index.
+    The counter is a MongoDB document, so `poetry run generate` and every worker bump the
+    same version. Each process polls it every INGESTION_VERSION_POLL_INTERVAL seconds in a
+    background thread, the requests only read the last polled value.
+    """
+
+    DOCUMENT_ID = "ingestion_version"
+
+    def __init__(self):
+        self._version = 0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[int], None]] = []
+        self._collection = None
+        self._poller: Optional[threading.Thread] = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from pymongo import MongoClient
+
+            client = MongoClient(
+                os.getenv("MONGODB_URI"), serverSelectionTimeoutMS=5000
+            )
+            self._collection = client[os.getenv("MONGODB_NAME", "RAGSAAS")].config
+        return self._collection
+
+    @property
+    def poll_interval(self) -> float:
+        return float(os.getenv("INGESTION_VERSION_POLL_INTERVAL", "5"))
+
+    def get(self) -> int:
+        return self._version
+
+    def on_change(self, listener: Callable[[int], None]):
+        self._listeners.append(listener)
+
+    def _set(self, version: int):
+        with self._lock:
+            if version == self._version:
+                return
+            self._version = version
+        for listener in self._listeners:
+            try:
+                listener(version)
+            except Exception as e:
+                logger.error(f"Error in ingestion listener: {e}")
+
+    def refresh(self):
+        try:
+            document = self.collection.find_one({"_id": self.DOCUMENT_ID})
+        except PyMongoError as e:
+            logger.warning(f"Couldn't read the ingestion version: {e}")
+            return
+        self._set(document["version"] if document else 0)
+
+    def bump(self) -> int:
+        from pymongo import ReturnDocument
+
+        try:
+            document = self.collection.find_one_and_update(
+                {"_id": self.DOCUMENT_ID},
+                {"$inc": {"version": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            version = document["version"]
+        except PyMongoError as e:
+            # The other processes only see the new data after their caches expire
+            logger.warning(f"Couldn't bump the shared ingestion version: {e}")
+            version = self._version + 1
+        self._set(version)
+        return version
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.refresh()
+
+    def start_polling(self):
+        """
+        Load the current version and follow the ingestions of the other processes,
+        an interval of 0 keeps the version local to this process
+        """
+        if self.poll_interval <= 0 or self._poller is not None:
+            return
+        self.refresh()
+        self._poller = threading.Thread(
+            target=self._poll, name="ingestion-version", daemon=True
+        )
+        self._poller.start()
+
+
+ingestion_version = IngestionVersion()
+
+
+def get_ingestion_version() -> int:
+    return ingestion_version.get()
+
+
+def on_ingestion(listener: Callable[[int], None]):
+    """
+    Register a function called with the new ingestion version after every ingestion,
+    including the ingestions of the other processes
+    """
+    ingestion_version.on_change(listener)
+
+
+def bump_ingestion_version() -> int:
+    return ingestion_version.bump()
+
+
 def get_index(params=None):
     logger.info("Connecting vector store...")
     store = get_vector_store()
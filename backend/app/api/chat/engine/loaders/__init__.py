@@ -1,37 +1,213 @@
 import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
 
 import yaml
+from llama_index.core.schema import Document
+
 from app.api.chat.engine.loaders.db import DBLoaderConfig, get_db_documents
-from app.api.chat.engine.loaders.file import FileLoaderConfig, get_file_documents
+from app.api.chat.engine.loaders.file import (
+    FileLoaderConfig,
+    get_file_documents,
+    iter_file_documents,
+)
+from app.api.chat.engine.loaders.manifest import FileManifest
 from app.api.chat.engine.loaders.web import WebLoaderConfig, get_web_documents
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class LoadResult:
+    documents: List[Document] = field(default_factory=list)
+    # Loader type -> error message of the loaders that failed or timed out
+    failures: Dict[str, str] = field(default_factory=dict)
+
+
 def load_configs():
     with open("config/loaders.yaml") as f:
         configs = yaml.safe_load(f)
     return configs
 
 
-def get_documents():
-    documents = []
-    config = load_configs()
-    for loader_type, loader_config in config.items():
-        logger.info(
-            f"Loading documents from loader: {loader_type}, config: {loader_config}"
+def _get_loader(
+    loader_type: str, loader_config, manifest: Optional[FileManifest] = None
+) -> Callable[[], List[Document]]:
+    match loader_type:
+        case "file":
+            config = FileLoaderConfig(**loader_config)
+            return lambda: get_file_documents(config, manifest)
+        case "web":
+            config = WebLoaderConfig(**loader_config)
+            return lambda: get_web_documents(config)
+        case "db":
+            configs = [DBLoaderConfig(**cfg) for cfg in loader_config]
+            return lambda: get_db_documents(configs=configs)
+        case _:
+            raise ValueError(f"Invalid loader type: {loader_type}")
+
+
+def _get_timeout(loader_type: str) -> Optional[float]:
+    # LOADER_TIMEOUT_<TYPE> overrides LOADER_TIMEOUT for one loader
+    timeout = os.getenv(f"LOADER_TIMEOUT_{loader_type.upper()}") or os.getenv(
+        "LOADER_TIMEOUT"
+    )
+    return float(timeout) if timeout else None
+
+
+def _timed(loader: Callable[[], List[Document]]) -> Callable[[], tuple]:
+    def run():
+        start = time.perf_counter()
+        documents = loader()
+        return documents, time.perf_counter() - start
+
+    return run
+
+
+def _submit_daemon(
+    loader: Callable[[], tuple], slots: threading.Semaphore, name: str
+) -> Future:
+    """
+    Run the loader on a daemon thread once a slot is free. Unlike the workers of a
+    ThreadPoolExecutor, the thread of a timed out loader doesn't keep the process alive
+    """
+    future: Future = Future()
+
+    def run():
+        with slots:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(loader())
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, name=f"loader-{name}", daemon=True).start()
+    return future
+
+
+def load_documents(
+    manifest: Optional[FileManifest] = None, config: Optional[dict] = None
+) -> LoadResult:
+    """
+    Run the configured loaders concurrently, at most LOADER_WORKERS at a time.
+    Every loader has its own timeout, a loader failing or timing out is reported
+    in the result without discarding the documents of the others.
+    A timed out loader can't be interrupted: it keeps running on its daemon thread,
+    its documents are ignored and it doesn't delay the exit of the process.
+    With a manifest, the file loader only loads the new and changed files.
+    """
+    if config is None:
+        config = load_configs() or {}
+    loaders = {
+        loader_type: _get_loader(loader_type, loader_config, manifest)
+        for loader_type, loader_config in config.items()
+    }
+    result = LoadResult()
+    if not loaders:
+        return result
+
+    workers = int(os.getenv("LOADER_WORKERS", "0")) or len(loaders)
+    progress_interval = float(os.getenv("LOADER_PROGRESS_INTERVAL", "30"))
+    slots = threading.Semaphore(workers)
+    start = time.monotonic()
+    pending: Dict[Future, str] = {}
+    deadlines: Dict[str, Optional[float]] = {}
+    for loader_type, loader in loaders.items():
+        logger.info(f"Loading documents from loader: {loader_type}")
+        pending[_submit_daemon(_timed(loader), slots, loader_type)] = loader_type
+        timeout = _get_timeout(loader_type)
+        # The timeouts start with the loading, a queued loader may have less time to run
+        deadlines[loader_type] = start + timeout if timeout else None
+
+    while pending:
+        now = time.monotonic()
+        next_deadline = min(
+            (deadlines[t] for t in pending.values() if deadlines[t] is not None),
+            default=None,
         )
-        match loader_type:
-            case "file":
-                document = get_file_documents(FileLoaderConfig(**loader_config))
-            case "web":
-                document = get_web_documents(WebLoaderConfig(**loader_config))
-            case "db":
-                document = get_db_documents(
-                    configs=[DBLoaderConfig(**cfg) for cfg in loader_config]
+        wait_for = progress_interval
+        if next_deadline is not None:
+            wait_for = max(0.0, min(wait_for, next_deadline - now))
+        done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            loader_type = pending.pop(future)
+            try:
+                documents, elapsed = future.result()
+            except Exception as e:
+                logger.exception(f"Loader {loader_type} failed")
+                result.failures[loader_type] = str(e)
+                continue
+            logger.info(
+                f"Loader {loader_type} loaded {len(documents)} documents in {elapsed:.1f}s"
+            )
+            result.documents.extend(documents)
+
+        now = time.monotonic()
+        for future, loader_type in list(pending.items()):
+            deadline = deadlines[loader_type]
+            if deadline is not None and now >= deadline:
+                # Cancels a loader still waiting for a slot, a running one is abandoned
+                future.cancel()
+                del pending[future]
+                logger.error(
+                    f"Loader {loader_type} timed out after {now - start:.0f}s"
+                )
+                result.failures[loader_type] = "timeout"
+        if pending and not done:
+            logger.info(
+                f"Still loading after {now - start:.0f}s: "
+                f"{', '.join(sorted(pending.values()))}"
+            )
+
+    return result
+
+
+def get_documents() -> List[Document]:
+    return load_documents().documents
+
+
+def iter_documents(
+    result: LoadResult, manifest: Optional[FileManifest] = None
+) -> Iterator[Document]:
+    """
+    Stream the documents of the loaders. Only the file loader is streamed, file by file.
+    The web and db loaders run concurrently in the background with `load_documents` and
+    return all their documents at once: they are held in memory, then yielded last.
+    The failed loaders are reported in `result`, its documents list stays empty.
+    There is no timeout for the file loader, it runs as fast as the documents are consumed.
+    """
+    config = dict(load_configs() or {})
+    file_config = config.pop("file", None)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="loaders")
+    others = executor.submit(load_documents, manifest, config) if config else None
+    try:
+        if file_config is not None:
+            logger.info("Streaming documents from loader: file")
+            start = time.perf_counter()
+            count = 0
+            try:
+                for document in iter_file_documents(
+                    FileLoaderConfig(**file_config), manifest
+                ):
+                    count += 1
+                    yield document
+            except Exception as e:
+                logger.exception("Loader file failed")
+                result.failures["file"] = str(e)
+            else:
+                logger.info(
+                    f"Loader file streamed {count} documents in {time.perf_counter() - start:.1f}s"
                 )
-            case _:
-                raise ValueError(f"Invalid loader type: {loader_type}")
-        documents.extend(document)
 
-    return documents
+        if others is not None:
+            other_result = others.result()
+            result.failures.update(other_result.failures)
+            yield from other_result.documents
+    finally:
+        executor.shutdown(wait=False)
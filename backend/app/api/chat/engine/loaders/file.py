@@ -1,9 +1,11 @@
 import os
 import logging
-from typing import Dict
+from typing import Dict, Iterator, List, Optional
+from llama_index.core.schema import Document
 from llama_parse import LlamaParse
 from pydantic import BaseModel
 
+from app.api.chat.engine.loaders.manifest import FileManifest
 from app.config import DATA_DIR
 
 logger = logging.getLogger(__name__)
@@ -35,7 +37,10 @@ def llama_parse_extractor() -> Dict[str, LlamaParse]:
     return {file_type: parser for file_type in SUPPORTED_FILE_TYPES}
 
 
-def get_file_documents(config: FileLoaderConfig):
+def get_file_reader(config: FileLoaderConfig):
+    """
+    Reader of the data directory, None if the directory is empty
+    """
     from llama_index.core.readers import SimpleDirectoryReader
 
     try:
@@ -48,14 +53,13 @@ def get_file_documents(config: FileLoaderConfig):
             nest_asyncio.apply()
 
             file_extractor = llama_parse_extractor()
-        reader = SimpleDirectoryReader(
+        return SimpleDirectoryReader(
             DATA_DIR,
             recursive=True,
             filename_as_id=True,
             raise_on_error=True,
             file_extractor=file_extractor,
         )
-        return reader.load_data()
     except Exception as e:
         import sys
         import traceback
@@ -68,7 +72,42 @@ def get_file_documents(config: FileLoaderConfig):
             logger.warning(
                 f"Failed to load file documents, error message: {e} . Return as empty document list."
             )
-            return []
+            return None
         else:
             # Raise the error if it is not the case of empty data dir
             raise e
+
+
+def get_file_documents(
+    config: FileLoaderConfig, manifest: Optional[FileManifest] = None
+) -> List[Document]:
+    reader = get_file_reader(config)
+    if reader is None:
+        return []
+    if manifest is None:
+        return reader.load_data()
+
+    # Only parse the new and changed files
+    reader.input_files = manifest.changed_files(reader.input_files)
+    if not reader.input_files:
+        return []
+    documents = reader.load_data()
+    manifest.add_documents(documents)
+    return documents
+
+
+def iter_file_documents(
+    config: FileLoaderConfig, manifest: Optional[FileManifest] = None
+) -> Iterator[Document]:
+    """
+    Yield the documents file by file, only one file is parsed in memory at a time
+    """
+    reader = get_file_reader(config)
+    if reader is None:
+        return
+    if manifest is not None:
+        reader.input_files = manifest.changed_files(reader.input_files)
+    for documents in reader.iter_data():
+        if manifest is not None:
+            manifest.add_documents(documents)
+        yield from documents
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Set
+
+from llama_index.core.schema import Document
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+@dataclass
+class FileEntry:
+    size: int
+    mtime_ns: int
+    sha256: str
+    # Documents loaded from the file (one per page for PDFs)
+    doc_ids: List[str] = field(default_factory=list)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """
+    Size, mtime and content hash of the files of the data directory at the last generate,
+    used to load only the new and changed files.
+    A file is unchanged if its size and mtime are the same, or else if its content hash is.
+    """
+
+    def __init__(self, path: str, entries: Dict[str, FileEntry] = None):
+        self.path = path
+        self.previous: Dict[str, FileEntry] = entries or {}
+        self.entries: Dict[str, FileEntry] = {}
+        self.unchanged: Set[str] = set()
+        self.new: Set[str] = set()
+        self.updated: Set[str] = set()
+
+    @classmethod
+    def load(cls, path: str) -> "FileManifest":
+        if not os.path.exists(path):
+            return cls(path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"unsupported version {data.get('version')}")
+            entries = {
+                file_path: FileEntry(**entry)
+                for file_path, entry in data["files"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring the file manifest {path}: {e}")
+            return cls(path)
+        return cls(path, entries)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "files": {
+                        file_path: asdict(entry)
+                        for file_path, entry in sorted(self.entries.items())
+                    },
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    def discard_missing(self, is_indexed: Callable[[str], bool]):
+        """
+        Forget the files whose documents are not in the docstore anymore (e.g. a deleted
+        storage directory or an interrupted run), so that they are loaded again
+        """
+        self.previous = {
+            file_path: entry
+            for file_path, entry in self.previous.items()
+            if all(is_indexed(doc_id) for doc_id in entry.doc_ids)
+        }
+
+    def changed_files(self, files: Iterable[Path]) -> List[Path]:
+        """
+        Compare the files with the manifest and return the new and changed ones
+        """
+        changed = []
+        for path in files:
+            file_path = str(path)
+            stat = os.stat(file_path)
+            previous = self.previous.get(file_path)
+            if (
+                previous is not None
+                and previous.size == stat.st_size
+                and previous.mtime_ns == stat.st_mtime_ns
+            ):
+                self.entries[file_path] = previous
+                self.unchanged.add(file_path)
+                continue
+
+            sha256 = file_sha256(file_path)
+            entry = FileEntry(
+                size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256
+            )
+            if previous is not None and previous.sha256 == sha256:
+                # Touched or copied without changes
+                entry.doc_ids = previous.doc_ids
+                self.entries[file_path] = entry
+                self.unchanged.add(file_path)
+                continue
+
+            self.entries[file_path] = entry
+            (self.updated if previous is not None else self.new).add(file_path)
+            changed.append(path)
+        return changed
+
+    def add_documents(self, documents: List[Document]):
+        for doc in documents:
+            entry = self.entries.get(doc.metadata.get("file_path"))
+            if entry is not None:
+                entry.doc_ids.append(doc.doc_id)
+
+    @property
+    def deleted(self) -> Set[str]:
+        return set(self.previous) - set(self.entries)
+
+    def unchanged_doc_ids(self) -> Set[str]:
+        return {
+            doc_id
+            for file_path in self.unchanged
+            for doc_id in self.entries[file_path].doc_ids
+        }
@@ -1,8 +1,28 @@
-from typing import List, Optional
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
 
 from llama_index.core import QueryBundle
+from llama_index.core.bridge.pydantic import PrivateAttr
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
-from llama_index.core.schema import NodeWithScore
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
+from llama_index.core.settings import Settings
+
+from app.api.chat.engine.sparse import BM25_K1, token_index, tokenize
+from app.metrics import metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_CROSS_ENCODER = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 
 class NodeCitationProcessor(BaseNodePostprocessor):
@@ -19,3 +39,325 @@ class NodeCitationProcessor(BaseNodePostprocessor):
         for node_score in nodes:
             node_score.node.metadata["node_id"] = node_score.node.node_id
         return nodes
+
+
+class RerankScorer(ABC):
+    """
+    Score the relevance of texts to a query in one batch, higher is more relevant
+    """
+
+    @abstractmethod
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        ...
+
+
+class LexicalScorer(RerankScorer):
+    """
+    Cheap BM25-like term overlap, no model needed (e.g. for tests and benchmarks)
+    """
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        query_tokens = set(tokenize(query))
+        scores = []
+        for text in texts:
+            counts = Counter(tokenize(text))
+            scores.append(
+                sum(
+                    counts[token] * (BM25_K1 + 1) / (counts[token] + BM25_K1)
+                    for token in query_tokens
+                )
+            )
+        return scores
+
+
+class CrossEncoderScorer(RerankScorer):
+    """
+    Local cross-encoder model running on CPU, requires sentence-transformers
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError(
+                "RERANKER=cross-encoder requires sentence-transformers, "
+                "install it with `poetry add sentence-transformers`"
+            ) from e
+
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        return self.model.predict(
+            [(query, text) for text in texts],
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+        ).tolist()
+
+
+@lru_cache(maxsize=None)
+def get_scorer(name: str, model_name: Optional[str] = None) -> RerankScorer:
+    # The scorers (and their models) are loaded once per process
+    match name:
+        case "lexical":
+            return LexicalScorer()
+        case "cross-encoder":
+            return CrossEncoderScorer(model_name or DEFAULT_CROSS_ENCODER)
+        case _:
+            raise ValueError(f"Invalid reranker: {name}")
+
+
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+_rerank_executor = ThreadPoolExecutor(
+    max_workers=RERANK_WORKERS, thread_name_prefix="rerank"
+)
+# One slot per worker, held until the scoring finishes (even past the budget):
+# no reranking is queued behind the calls that overran their budget
+_rerank_slots = threading.BoundedSemaphore(RERANK_WORKERS)
+
+
+def _score_in_slot(scorer: "RerankScorer", query: str, texts: List[str]):
+    try:
+        return scorer.score(query, texts)
+    finally:
+        _rerank_slots.release()
+
+
+class RerankPostprocessor(BaseNodePostprocessor):
+    """
+    Rerank the over-fetched candidates of the retriever and keep the top_n ones.
+    The candidates are scored in a single batch within the latency budget,
+    if the scorer is too slow (or fails) the retrieval order is kept.
+    The budget caps the latency of the request, it doesn't cancel the scoring: an overrun
+    call keeps its worker until it finishes. When all the workers are busy, the reranking
+    is skipped instead of queued.
+    """
+
+    top_n: int = 4
+    budget_ms: float = 500
+    _scorer: RerankScorer = PrivateAttr()
+
+    def __init__(self, scorer: RerankScorer, **kwargs):
+        super().__init__(**kwargs)
+        self._scorer = scorer
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RerankPostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if query_bundle is None or len(nodes) <= 1:
+            return nodes[: self.top_n]
+
+        texts = [
+            node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes
+        ]
+        if not _rerank_slots.acquire(blocking=False):
+            metrics.incr("rerank.skipped_busy")
+            logger.warning("All the rerank workers are busy, keeping the retrieval order")
+            return nodes[: self.top_n]
+
+        start = time.perf_counter()
+        try:
+            future = _rerank_executor.submit(
+                _score_in_slot, self._scorer, query_bundle.query_str, texts
+            )
+        except Exception:
+            _rerank_slots.release()
+            raise
+        try:
+            scores = future.result(timeout=self.budget_ms / 1000)
+        except FutureTimeoutError:
+            metrics.incr("rerank.timeouts")
+            logger.warning(
+                f"Reranking exceeded its budget of {self.budget_ms}ms, keeping the retrieval order"
+            )
+            return nodes[: self.top_n]
+        except Exception as e:
+            metrics.incr("rerank.errors")
+            logger.error(f"Error reranking the nodes: {e}")
+            return nodes[: self.top_n]
+
+        metrics.incr("rerank.calls")
+        metrics.incr("rerank.dropped_nodes", max(0, len(nodes) - self.top_n))
+        logger.debug(
+            f"Reranked {len(nodes)} nodes in {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+        ranked = sorted(zip(scores, nodes), key=lambda item: item[0], reverse=True)
+        return [
+            NodeWithScore(node=node.node, score=float(score))
+            for score, node in ranked[: self.top_n]
+        ]
+
+
+def get_reranker() -> Optional[RerankPostprocessor]:
+    """
+    Build the reranker configured by RERANKER (lexical or cross-encoder), None if disabled
+    """
+    name = os.getenv("RERANKER", "").lower()
+    if not name or name == "none":
+        return None
+    return RerankPostprocessor(
+        scorer=get_scorer(name, os.getenv("RERANK_MODEL")),
+        top_n=int(os.getenv("RERANK_TOP_N", "4")),
+        budget_ms=float(os.getenv("RERANK_BUDGET_MS", "500")),
+    )
+
+
+def get_rerank_candidates() -> int:
+    return int(os.getenv("RERANK_CANDIDATES", "20"))
+
+
+class ContextPackerPostprocessor(BaseNodePostprocessor):
+    """
+    Assemble the context sent to the LLM: merge the overlapping or adjacent chunks of
+    the same document, drop the near-duplicates (cosine similarity of the term vectors)
+    and keep the most relevant chunks fitting in the token budget.
+    """
+
+    token_budget: int
+    dedup_threshold: float = 0.9
+    # Maximum number of characters between two chunks to merge them
+    merge_gap: int = 200
+    # Marks the text of the document skipped between two merged chunks
+    gap_separator: str = "\n…\n"
+    term_dim: int = 4096
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPackerPostprocessor"
+
+    @staticmethod
+    def _count_tokens(node: NodeWithScore) -> int:
+        return len(Settings.tokenizer(node.node.get_content(MetadataMode.LLM)))
+
+    def _merge_adjacent(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        by_document: Dict[str, List[NodeWithScore]] = {}
+        merged: List[NodeWithScore] = []
+        for node in nodes:
+            if (
+                isinstance(node.node, TextNode)
+                and node.node.ref_doc_id is not None
+                and node.node.start_char_idx is not None
+                and node.node.end_char_idx is not None
+            ):
+                by_document.setdefault(node.node.ref_doc_id, []).append(node)
+            else:
+                merged.append(node)
+
+        for chunks in by_document.values():
+            chunks.sort(key=lambda node: node.node.start_char_idx)
+            current = chunks[0]
+            for chunk in chunks[1:]:
+                if (
+                    chunk.node.start_char_idx
+                    > current.node.end_char_idx + self.merge_gap
+                ):
+                    merged.append(current)
+                    current = chunk
+                    continue
+                gap = chunk.node.start_char_idx - current.node.end_char_idx
+                overlap = max(0, -gap)
+                if overlap > 0:
+                    separator = ""
+                elif gap > 0:
+                    # The text between the chunks was not retrieved, don't present
+                    # the merged chunk as a contiguous passage
+                    separator = self.gap_separator
+                else:
+                    separator = "\n"
+                if chunk.node.end_char_idx <= current.node.end_char_idx:
+                    # Fully contained in the current chunk
+                    text = current.node.text
+                else:
+                    text = current.node.text + separator + chunk.node.text[overlap:]
+                node = current.node.copy()
+                node.text = text
+                node.end_char_idx = max(
+                    current.node.end_char_idx, chunk.node.end_char_idx
+                )
+                current = NodeWithScore(
+                    node=node, score=max(current.score or 0.0, chunk.score or 0.0)
+                )
+            merged.append(current)
+
+        merged.sort(key=lambda node: node.score or 0.0, reverse=True)
+        return merged
+
+    def _term_vectors(self, nodes: List[NodeWithScore]) -> np.ndarray:
+        vectors = np.zeros((len(nodes), self.term_dim), dtype=np.float32)
+        for i, node in enumerate(nodes):
+            for token in tokenize(node.node.get_content(MetadataMode.NONE)):
+                vectors[i, token_index(token) % self.term_dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    def _drop_near_duplicates(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        if len(nodes) <= 1:
+            return nodes
+        vectors = self._term_vectors(nodes)
+        similarities = vectors @ vectors.T
+        selected: List[int] = []
+        for i in range(len(nodes)):
+            # The nodes are sorted by score, keep the best of the near-duplicates
+            if not selected or similarities[i, selected].max() < self.dedup_threshold:
+                selected.append(i)
+        return [nodes[i] for i in selected]
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+        tokens_before = sum(self._count_tokens(node) for node in nodes)
+
+        candidates = self._drop_near_duplicates(self._merge_adjacent(nodes))
+        packed: List[NodeWithScore] = []
+        tokens_after = 0
+        for node in candidates:
+            tokens = self._count_tokens(node)
+            # The most relevant node is always kept, even over the budget
+            if packed and tokens_after + tokens > self.token_budget:
+                continue
+            packed.append(node)
+            tokens_after += tokens
+
+        saved = tokens_before - tokens_after
+        metrics.incr("context.requests")
+        metrics.incr("context.tokens_saved", saved)
+        logger.info(
+            f"Packed {len(nodes)} retrieved chunks into {len(packed)}: "
+            f"{tokens_after} context tokens, {saved} saved"
+        )
+        return packed
+
+
+def get_context_packer() -> Optional[ContextPackerPostprocessor]:
+    """
+    Build the context packer if CONTEXT_PACKER is enabled. The token budget defaults to the
+    context window of Settings.llm minus its output and CONTEXT_RESERVED_TOKENS
+    (system prompt, chat history and question).
+    """
+    if os.getenv("CONTEXT_PACKER", "false").lower() != "true":
+        return None
+    budget = os.getenv("CONTEXT_TOKEN_BUDGET")
+    if budget:
+        token_budget = int(budget)
+    else:
+        llm_metadata = Settings.llm.metadata
+        token_budget = (
+            llm_metadata.context_window
+            - (llm_metadata.num_output or 0)
+            - int(os.getenv("CONTEXT_RESERVED_TOKENS", "2048"))
+        )
+    return ContextPackerPostprocessor(
+        token_budget=max(1, token_budget),
+        dedup_threshold=float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9")),
+        merge_gap=int(os.getenv("CONTEXT_MERGE_GAP", "200")),
+    )
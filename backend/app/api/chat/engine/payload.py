@@ -0,0 +1,110 @@
+import os
+from typing import Any, Dict, List
+
+from llama_index.core.schema import (
+    BaseNode,
+    MetadataMode,
+    NodeRelationship,
+    RelatedNodeInfo,
+    TextNode,
+)
+
+COMPACT_FORMAT = "compact"
+
+# Payload keys of the compact format, everything else is the node metadata
+FORMAT_KEY = "_format"
+TEXT_KEY = "text"
+DOC_ID_KEY = "doc_id"
+EXCLUDED_LLM_KEY = "_excluded_llm"
+EXCLUDED_EMBED_KEY = "_excluded_embed"
+# Position of the chunk in its document, used to merge the neighbouring chunks
+START_KEY = "_start"
+END_KEY = "_end"
+RESERVED_KEYS = (
+    FORMAT_KEY,
+    TEXT_KEY,
+    DOC_ID_KEY,
+    EXCLUDED_LLM_KEY,
+    EXCLUDED_EMBED_KEY,
+    START_KEY,
+    END_KEY,
+)
+
+# Serialized node of the full (LlamaIndex default) format, absent from the compact points.
+# Fetched too, so the points written before switching to the compact format still parse
+FULL_FORMAT_KEYS = ("_node_content", "_node_type")
+
+# Metadata read by the chat: source links (SourceNodes), filters and the LLM context
+DEFAULT_PAYLOAD_FIELDS = (
+    "file_name",
+    "file_path",
+    "page_label",
+    "private",
+    "private_file",
+    "pipeline_id",
+    "URL",
+    "url",
+)
+
+
+def is_compact_payload_enabled() -> bool:
+    return os.getenv("QDRANT_PAYLOAD_FORMAT", "full").lower() == COMPACT_FORMAT
+
+
+def get_payload_fields() -> List[str]:
+    """
+    Payload fields fetched by the retrieval, QDRANT_PAYLOAD_FIELDS overrides the metadata keys.
+    The full format keys are included: a collection can hold points of both formats
+    """
+    fields = os.getenv("QDRANT_PAYLOAD_FIELDS")
+    metadata_fields = (
+        [field.strip() for field in fields.split(",") if field.strip()]
+        if fields
+        else list(DEFAULT_PAYLOAD_FIELDS)
+    )
+    return list(RESERVED_KEYS) + list(FULL_FORMAT_KEYS) + metadata_fields
+
+
+def to_compact_payload(node: BaseNode) -> Dict[str, Any]:
+    """
+    Store the text and the metadata once, without the serialized node
+    (which repeats the metadata, the relationships and the hashes)
+    """
+    payload: Dict[str, Any] = {
+        key: value for key, value in node.metadata.items() if value is not None
+    }
+    payload[FORMAT_KEY] = COMPACT_FORMAT
+    payload[TEXT_KEY] = node.get_content(metadata_mode=MetadataMode.NONE)
+    # Used by the filters and to delete the nodes of a document
+    payload[DOC_ID_KEY] = node.ref_doc_id or "None"
+    if node.excluded_llm_metadata_keys:
+        payload[EXCLUDED_LLM_KEY] = node.excluded_llm_metadata_keys
+    if node.excluded_embed_metadata_keys:
+        payload[EXCLUDED_EMBED_KEY] = node.excluded_embed_metadata_keys
+    if isinstance(node, TextNode) and node.start_char_idx is not None:
+        payload[START_KEY] = node.start_char_idx
+        payload[END_KEY] = node.end_char_idx
+    return payload
+
+
+def is_compact_payload(payload: Dict[str, Any]) -> bool:
+    return payload.get(FORMAT_KEY) == COMPACT_FORMAT
+
+
+def from_compact_payload(node_id: str, payload: Dict[str, Any]) -> TextNode:
+    metadata = {
+        key: value for key, value in payload.items() if key not in RESERVED_KEYS
+    }
+    node = TextNode(
+        id_=node_id,
+        text=payload.get(TEXT_KEY, ""),
+        metadata=metadata,
+        excluded_llm_metadata_keys=payload.get(EXCLUDED_LLM_KEY, []),
+        excluded_embed_metadata_keys=payload.get(EXCLUDED_EMBED_KEY, []),
+        start_char_idx=payload.get(START_KEY),
+        end_char_idx=payload.get(END_KEY),
+    )
+    doc_id = payload.get(DOC_ID_KEY)
+    if doc_id and doc_id != "None":
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+    return node
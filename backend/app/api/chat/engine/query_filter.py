@@ -1,20 +1,32 @@
 from llama_index.core.vector_stores.types import MetadataFilter, MetadataFilters
 
+# Payload fields used in the retrieval filters, they are indexed in Qdrant
+# (see QdrantClientManager.ensure_payload_indexes)
+FILTER_FIELDS = ("private", "doc_id", "file_id", "user_id")
 
-def generate_filters(doc_ids):
-    """
-    Generate public/private document filters based on the doc_ids and the vector store.
-    """
-    public_doc_filter = MetadataFilter(
+
+def _public_doc_filter() -> MetadataFilter:
+    return MetadataFilter(
         key="private",
         value="true",
         operator="!=",  # type: ignore
     )
-    selected_doc_filter = MetadataFilter(
+
+
+def _selected_doc_filter(doc_ids) -> MetadataFilter:
+    return MetadataFilter(
         key="doc_id",
         value=doc_ids,
         operator="in",  # type: ignore
     )
+
+
+def generate_filters(doc_ids):
+    """
+    Generate public/private document filters based on the doc_ids and the vector store.
+    """
+    public_doc_filter = _public_doc_filter()
+    selected_doc_filter = _selected_doc_filter(doc_ids)
     if len(doc_ids) > 0:
         # If doc_ids are provided, we will select both public and selected documents
         filters = MetadataFilters(
@@ -32,3 +44,20 @@ def generate_filters(doc_ids):
         )
 
     return filters
+
+
+def generate_routed_filters(doc_ids):
+    """
+    Generate the filters of the public collection and of the tenant's private collection
+    when the private documents are stored in per-tenant collections.
+    The public collection keeps the selected documents filter: the private documents
+    uploaded before enabling the routing are still in the shared collection.
+    The private filters are None if no document is selected (the private collection is not queried).
+    """
+    public_filters = generate_filters(doc_ids)
+    private_filters = (
+        MetadataFilters(filters=[_selected_doc_filter(doc_ids)])
+        if len(doc_ids) > 0
+        else None
+    )
+    return public_filters, private_filters
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from llama_index.core import QueryBundle
+from llama_index.core.indices import VectorStoreIndex
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+from app.api.chat.engine.vectordb import get_qdrant_config, get_vector_store
+
+logger = logging.getLogger("uvicorn")
+
+
+def is_tenant_routing_enabled() -> bool:
+    return os.getenv("QDRANT_TENANT_ROUTING", "false").lower() == "true"
+
+
+def get_tenant_collection(tenant_id: str) -> str:
+    """
+    Name of the collection holding the private documents of a tenant (user)
+    """
+    _, public_collection = get_qdrant_config()
+    slug = re.sub(r"[^a-zA-Z0-9_-]+", "_", tenant_id)[:32]
+    # The slug alone could collide (e.g. "a.b@c" and "a_b@c")
+    digest = hashlib.sha1(tenant_id.encode()).hexdigest()[:8]
+    return f"{public_collection}_private_{slug}_{digest}"
+
+
+def get_tenant_vector_store(tenant_id: str) -> QdrantVectorStore:
+    return get_vector_store(get_tenant_collection(tenant_id))
+
+
+_tenant_indexes: OrderedDict[str, Tuple[QdrantVectorStore, VectorStoreIndex]] = (
+    OrderedDict()
+)
+_tenant_indexes_lock = threading.Lock()
+
+
+def get_tenant_index(tenant_id: str) -> VectorStoreIndex:
+    """
+    Index of the tenant's collection, the indexes of the QDRANT_STORE_CACHE_SIZE most
+    recently used tenants are reused between requests
+    """
+    store = get_tenant_vector_store(tenant_id)
+    with _tenant_indexes_lock:
+        cached = _tenant_indexes.get(tenant_id)
+        # The store is recreated after it was evicted or the clients were closed
+        if cached is not None and cached[0] is store:
+            _tenant_indexes.move_to_end(tenant_id)
+            return cached[1]
+        index = VectorStoreIndex.from_vector_store(store)
+        _tenant_indexes[tenant_id] = (store, index)
+        while len(_tenant_indexes) > max(
+            1, int(os.getenv("QDRANT_STORE_CACHE_SIZE", "128"))
+        ):
+            _tenant_indexes.popitem(last=False)
+        return index
+
+
+class TenantRoutedRetriever(BaseRetriever):
+    """
+    Retrieve from the shared public collection and from the tenant's private collection
+    at the same time, then merge both results by score.
+    The public queries don't pay for filtering over everyone's private vectors, only the
+    private documents uploaded before the routing (if selected) are read from the shared one.
+    """
+
+    def __init__(
+        self,
+        public_retriever: BaseRetriever,
+        private_retriever: Optional[BaseRetriever],
+        top_k: int,
+        **kwargs,
+    ):
+        self._public_retriever = public_retriever
+        self._private_retriever = private_retriever
+        self._top_k = top_k
+        super().__init__(**kwargs)
+
+    def _merge(
+        self, public_nodes: List[NodeWithScore], private_nodes: List[NodeWithScore]
+    ) -> List[NodeWithScore]:
+        nodes = sorted(
+            public_nodes + private_nodes,
+            key=lambda node: node.score or 0.0,
+            reverse=True,
+        )
+        return nodes[: self._top_k]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        public_nodes = self._public_retriever.retrieve(query_bundle)
+        private_nodes = []
+        if self._private_retriever is not None:
+            try:
+                private_nodes = self._private_retriever.retrieve(query_bundle)
+            except Exception as e:
+                logger.warning(f"Error retrieving from the private collection: {e}")
+        return self._merge(public_nodes, private_nodes)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if self._private_retriever is None:
+            return self._merge(await self._public_retriever.aretrieve(query_bundle), [])
+        public_nodes, private_nodes = await asyncio.gather(
+            self._public_retriever.aretrieve(query_bundle),
+            self._private_retriever.aretrieve(query_bundle),
+            return_exceptions=True,
+        )
+        if isinstance(public_nodes, BaseException):
+            raise public_nodes
+        if isinstance(private_nodes, BaseException):
+            # e.g. the tenant has not uploaded any document yet
+            logger.warning(
+                f"Error retrieving from the private collection: {private_nodes}"
+            )
+            private_nodes = []
+        return self._merge(public_nodes, private_nodes)
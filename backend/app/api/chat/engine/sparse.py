@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Most frequent English words, they would match every chunk without an IDF weighting
+STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from had has have how i if in into is it
+    its me my no not of on or our so that the their them then there these they this to
+    was we were what when where which who why will with you your
+    """.split())
+
+# BM25 parameters, the average chunk length is estimated from the chunk size
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens without the stopwords, codes like "AB-1234" are kept as "ab" and "1234"
+    """
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS
+    ]
+
+
+def token_index(token: str) -> int:
+    # Stable across processes (unlike hash()), Qdrant sparse indices are uint32
+    return int.from_bytes(
+        hashlib.blake2b(token.encode(), digest_size=4).digest(), "big"
+    )
+
+
+def _avg_doc_length() -> float:
+    # Roughly 0.75 words per token
+    return float(
+        os.getenv("SPARSE_AVG_DOC_LENGTH", int(os.getenv("CHUNK_SIZE", "1024")) * 0.75)
+    )
+
+
+def _to_sparse(weights: Dict[int, float]) -> Tuple[List[int], List[float]]:
+    indices = sorted(weights)
+    return indices, [weights[index] for index in indices]
+
+
+def sparse_doc_encoder(texts: List[str]) -> Tuple[List[List[int]], List[List[float]]]:
+    """
+    Encode the chunks as hashed BM25 term-frequency vectors (without IDF)
+    """
+    avg_length = _avg_doc_length()
+    batch_indices, batch_values = [], []
+    for text in texts:
+        tokens = tokenize(text)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avg_length)
+        weights: Dict[int, float] = {}
+        for token, tf in Counter(tokens).items():
+            index = token_index(token)
+            weights[index] = weights.get(index, 0.0) + tf * (BM25_K1 + 1) / (tf + norm)
+        indices, values = _to_sparse(weights)
+        batch_indices.append(indices)
+        batch_values.append(values)
+    return batch_indices, batch_values
+
+
+def sparse_query_encoder(texts: List[str]) -> Tuple[List[List[int]], List[List[float]]]:
+    """
+    Encode the queries as binary vectors, so the score is the sum of the matched term weights
+    """
+    batch_indices, batch_values = [], []
+    for text in texts:
+        indices, values = _to_sparse({token_index(t): 1.0 for t in tokenize(text)})
+        batch_indices.append(indices)
+        batch_values.append(values)
+    return batch_indices, batch_values
+
+
+def reciprocal_rank_fusion(
+    dense_result: VectorStoreQueryResult,
+    sparse_result: VectorStoreQueryResult,
+    # NOTE: weight of the dense ranking (0 for sparse only, 1 for dense only)
+    alpha: float = 0.5,
+    top_k: int = 2,
+    k: int = 60,
+) -> VectorStoreQueryResult:
+    """
+    Fuse the dense and sparse results by their ranks, which, unlike the scores,
+    are comparable between both searches
+    """
+    scores: Dict[str, float] = {}
+    nodes = {}
+    for weight, result in ((alpha, dense_result), (1 - alpha, sparse_result)):
+        for rank, node in enumerate(result.nodes or []):
+            nodes.setdefault(node.node_id, node)
+            scores[node.node_id] = scores.get(node.node_id, 0.0) + weight / (
+                k + rank + 1
+            )
+
+    if not scores:
+        return VectorStoreQueryResult(nodes=None, similarities=None, ids=None)
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return VectorStoreQueryResult(
+        nodes=[nodes[node_id] for node_id, _ in ranked],
+        similarities=[score for _, score in ranked],
+        ids=[node_id for node_id, _ in ranked],
+    )
+
+
+def is_hybrid_enabled() -> bool:
+    return os.getenv("QDRANT_HYBRID", "false").lower() == "true"
@@ -0,0 +1,206 @@
+import argparse
+import logging
+import os
+from typing import Dict, Literal, Optional
+
+from pydantic import BaseModel
+from qdrant_client.http import models as rest
+
+logger = logging.getLogger("uvicorn")
+
+
+class StorageProfile(BaseModel):
+    name: str
+    description: str
+    # None keeps the Qdrant server defaults
+    on_disk_vectors: Optional[bool] = None
+    on_disk_payload: Optional[bool] = None
+    quantization: Literal["none", "scalar", "binary"] = "none"
+    # Keep the quantized vectors in RAM for the HNSW search
+    quantized_in_ram: bool = True
+    # Candidates fetched with the quantized vectors per result, then rescored with the
+    # original vectors: 1-bit vectors need 2-3x more candidates to keep the recall
+    oversampling: float = 1.0
+    rescore: bool = True
+    hnsw_m: Optional[int] = None
+    hnsw_ef_construct: Optional[int] = None
+    hnsw_on_disk: Optional[bool] = None
+
+    def hnsw_config(self) -> Optional[rest.HnswConfigDiff]:
+        if (
+            self.hnsw_m is None
+            and self.hnsw_ef_construct is None
+            and self.hnsw_on_disk is None
+        ):
+            return None
+        return rest.HnswConfigDiff(
+            m=self.hnsw_m,
+            ef_construct=self.hnsw_ef_construct,
+            on_disk=self.hnsw_on_disk,
+        )
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return rest.ScalarQuantization(
+                scalar=rest.ScalarQuantizationConfig(
+                    type=rest.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=self.quantized_in_ram,
+                )
+            )
+        if self.quantization == "binary":
+            return rest.BinaryQuantization(
+                binary=rest.BinaryQuantizationConfig(always_ram=self.quantized_in_ram)
+            )
+        return None
+
+    def search_params(self) -> Optional[rest.SearchParams]:
+        if self.quantization == "none":
+            return None
+        return rest.SearchParams(
+            quantization=rest.QuantizationSearchParams(
+                rescore=self.rescore, oversampling=self.oversampling
+            )
+        )
+
+    def dense_params(self, size: int) -> rest.VectorParams:
+        return rest.VectorParams(
+            size=size,
+            distance=rest.Distance.COSINE,
+            on_disk=self.on_disk_vectors,
+            hnsw_config=self.hnsw_config(),
+        )
+
+    def sparse_params(self) -> rest.SparseVectorParams:
+        return rest.SparseVectorParams(
+            index=rest.SparseIndexParams(on_disk=self.on_disk_vectors)
+        )
+
+    def estimate_ram_bytes(self, dim: int, payload_bytes: int = 0) -> float:
+        """
+        Rough RAM used per point: vectors, quantized vectors, HNSW links and payload
+        """
+        ram = 0.0
+        if not self.on_disk_vectors:
+            ram += dim * 4
+        if self.quantization != "none" and self.quantized_in_ram:
+            ram += dim if self.quantization == "scalar" else dim / 8
+        if not self.hnsw_on_disk:
+            # The level 0 of the graph has up to 2 * m links of 4 bytes per point
+            ram += 2 * (self.hnsw_m or 16) * 4
+        if self.on_disk_payload is False:
+            ram += payload_bytes
+        return ram
+
+
+STORAGE_PROFILES: Dict[str, StorageProfile] = {
+    profile.name: profile
+    for profile in [
+        StorageProfile(
+            name="default",
+            description="Qdrant defaults, full float32 vectors in RAM",
+        ),
+        StorageProfile(
+            name="fast",
+            description="Vectors and int8 copies in RAM, denser HNSW graph for the recall",
+            on_disk_vectors=False,
+            quantization="scalar",
+            hnsw_m=32,
+            hnsw_ef_construct=256,
+        ),
+        StorageProfile(
+            name="balanced",
+            description="int8 vectors in RAM, original vectors and payload on disk",
+            on_disk_vectors=True,
+            on_disk_payload=True,
+            quantization="scalar",
+            hnsw_m=16,
+            hnsw_ef_construct=128,
+        ),
+        StorageProfile(
+            name="compact",
+            description="1-bit vectors in RAM, everything else on disk (for 1024+ dimensions)",
+            on_disk_vectors=True,
+            on_disk_payload=True,
+            quantization="binary",
+            oversampling=3.0,
+            hnsw_m=16,
+            hnsw_ef_construct=100,
+            hnsw_on_disk=True,
+        ),
+    ]
+}
+
+
+def get_storage_profile(name: Optional[str] = None) -> StorageProfile:
+    name = name or os.getenv("QDRANT_STORAGE_PROFILE", "default")
+    if name not in STORAGE_PROFILES:
+        raise ValueError(
+            f"Unknown Qdrant storage profile {name}, "
+            f"choose one of {', '.join(STORAGE_PROFILES)}"
+        )
+    return STORAGE_PROFILES[name]
+
+
+def migrate_collection(client, collection_name: str, profile: StorageProfile):
+    """
+    Apply a profile to an existing collection. Qdrant rebuilds the segments in the background,
+    the collection stays searchable meanwhile.
+    """
+    info = client.get_collection(collection_name)
+    # Hybrid collections have named vectors, the dense-only ones a single unnamed vector
+    vectors = info.config.params.vectors
+    vector_names = list(vectors.keys()) if isinstance(vectors, dict) else [""]
+    sparse_vectors = info.config.params.sparse_vectors or {}
+
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={
+            name: rest.VectorParamsDiff(
+                on_disk=profile.on_disk_vectors, hnsw_config=profile.hnsw_config()
+            )
+            for name in vector_names
+        },
+        sparse_vectors_config=(
+            {name: profile.sparse_params() for name in sparse_vectors}
+            if sparse_vectors
+            else None
+        ),
+        hnsw_config=profile.hnsw_config(),
+        quantization_config=profile.quantization_config() or rest.Disabled.DISABLED,
+        collection_params=(
+            rest.CollectionParamsDiff(on_disk_payload=profile.on_disk_payload)
+            if profile.on_disk_payload is not None
+            else None
+        ),
+    )
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from app.api.chat.engine.vectordb import get_qdrant_config, qdrant_manager
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Apply a storage profile to an existing Qdrant collection"
+    )
+    parser.add_argument("--profile", choices=list(STORAGE_PROFILES), required=True)
+    parser.add_argument("--collection", help="Defaults to QDRANT_COLLECTION")
+    args = parser.parse_args()
+
+    url, default_collection = get_qdrant_config()
+    collection_name = args.collection or default_collection
+    profile = get_storage_profile(args.profile)
+    client, _ = qdrant_manager.get_clients(url)
+    migrate_collection(client, collection_name, profile)
+    logger.info(
+        f"Applied the {profile.name} profile to {collection_name}, "
+        "Qdrant is optimizing the collection in the background"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,437 @@
+import asyncio
 import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
 import qdrant_client
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
 from llama_index.vector_stores.qdrant import QdrantVectorStore
+from llama_index.vector_stores.qdrant.base import DENSE_VECTOR_NAME
+from qdrant_client.http import models as rest
+
+from app.api.chat.engine.payload import (
+    from_compact_payload,
+    get_payload_fields,
+    is_compact_payload,
+    is_compact_payload_enabled,
+    to_compact_payload,
+)
+from app.api.chat.engine.query_filter import FILTER_FIELDS
+from app.api.chat.engine.sparse import (
+    is_hybrid_enabled,
+    reciprocal_rank_fusion,
+    sparse_doc_encoder,
+    sparse_query_encoder,
+)
+from app.api.chat.engine.storage_profiles import StorageProfile, get_storage_profile
+
+logger = logging.getLogger("uvicorn")
 
+IN_MEMORY_URL = ":memory:"
 
-def get_vector_store():
+
+def get_qdrant_config() -> Tuple[str, str]:
     collection_name = os.getenv("QDRANT_COLLECTION", "ragsaas")
     QDRANT_URL = os.getenv("QDRANT_URL")
-    QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
     if not collection_name or not QDRANT_URL:
         raise ValueError(
             "Please set QDRANT_COLLECTION, QDRANT_URL"
             " to your environment variables or config them in the .env file"
         )
-    if QDRANT_API_KEY:
-        # creating a qdrant client instance
-        client = qdrant_client.QdrantClient(
-            url=QDRANT_URL,
-            api_key=QDRANT_API_KEY,
-        )
+    return QDRANT_URL, collection_name
 
-        aclient = qdrant_client.AsyncQdrantClient(
-            url=QDRANT_URL,
-            api_key=QDRANT_API_KEY,
+
+class RAGQdrantVectorStore(QdrantVectorStore):
+    """
+    Qdrant store creating its collection with the configured storage profile
+    (quantization, on-disk vectors and payload, HNSW parameters).
+    With the compact payload format, the points only store the text and the metadata once
+    and the searches only fetch the payload fields read by the chat.
+    """
+
+    _storage_profile: StorageProfile = PrivateAttr()
+    _compact_payload: bool = PrivateAttr()
+
+    def __init__(
+        self,
+        *args,
+        storage_profile: StorageProfile,
+        compact_payload: bool = False,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._storage_profile = storage_profile
+        self._compact_payload = compact_payload
+
+    def _apply_storage_profile(self, vector_size: int):
+        profile = self._storage_profile
+        self._dense_config = profile.dense_params(vector_size)
+        self._sparse_config = profile.sparse_params()
+        self._quantization_config = profile.quantization_config()
+        logger.info(
+            f"Creating Qdrant collection {self.collection_name} "
+            f"with the {profile.name} storage profile"
         )
 
-        store = QdrantVectorStore(
-            client=client, aclient=aclient, collection_name=collection_name
+    def _payload_params(self) -> Optional[rest.CollectionParamsDiff]:
+        on_disk_payload = self._storage_profile.on_disk_payload
+        if on_disk_payload is None:
+            return None
+        return rest.CollectionParamsDiff(on_disk_payload=on_disk_payload)
+
+    def _create_collection(self, collection_name: str, vector_size: int) -> None:
+        self._apply_storage_profile(vector_size)
+        super()._create_collection(collection_name, vector_size)
+        # The store doesn't pass the payload storage, the collection is still empty
+        payload_params = self._payload_params()
+        if payload_params is not None:
+            self._client.update_collection(
+                collection_name=collection_name, collection_params=payload_params
+            )
+
+    async def _acreate_collection(self, collection_name: str, vector_size: int) -> None:
+        self._apply_storage_profile(vector_size)
+        await super()._acreate_collection(collection_name, vector_size)
+        payload_params = self._payload_params()
+        if payload_params is not None:
+            await self._aclient.update_collection(
+                collection_name=collection_name, collection_params=payload_params
+            )
+
+    def _build_points(
+        self, nodes: List[BaseNode], sparse_vector_name: str
+    ) -> Tuple[List[Any], List[str]]:
+        points, ids = super()._build_points(nodes, sparse_vector_name)
+        if self._compact_payload:
+            for point, node in zip(points, nodes):
+                point.payload = to_compact_payload(node)
+        return points, ids
+
+    def parse_to_query_result(self, response: List[Any]) -> VectorStoreQueryResult:
+        if not any(is_compact_payload(point.payload or {}) for point in response):
+            return super().parse_to_query_result(response)
+        nodes, similarities, ids = [], [], []
+        for point in response:
+            payload = point.payload or {}
+            if is_compact_payload(payload):
+                node = from_compact_payload(str(point.id), payload)
+            else:
+                node = super().parse_to_query_result([point]).nodes[0]
+            nodes.append(node)
+            similarities.append(getattr(point, "score", 1.0))
+            ids.append(str(point.id))
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def _use_own_search(self, query: VectorStoreQuery) -> bool:
+        if not self._compact_payload and self._storage_profile.search_params() is None:
+            return False
+        if query.mode == VectorStoreQueryMode.HYBRID:
+            return self.enable_hybrid and query.query_str is not None
+        return query.mode == VectorStoreQueryMode.DEFAULT
+
+    def _search_requests(
+        self, query: VectorStoreQuery, query_filter, sparse_vector_name: str
+    ) -> List[rest.SearchRequest]:
+        """
+        Same searches as the store, with the quantization search params of the storage
+        profile and, for the compact payload, only the payload fields read by the chat
+        """
+        with_payload = (
+            rest.PayloadSelectorInclude(include=get_payload_fields())
+            if self._compact_payload
+            else True
         )
-    else:
-        client = qdrant_client.QdrantClient(
-            url=QDRANT_URL,
+        requests = [
+            rest.SearchRequest(
+                vector=(
+                    rest.NamedVector(
+                        name=DENSE_VECTOR_NAME, vector=query.query_embedding
+                    )
+                    if self.enable_hybrid
+                    else query.query_embedding
+                ),
+                limit=query.similarity_top_k,
+                filter=query_filter,
+                with_payload=with_payload,
+                params=self._storage_profile.search_params(),
+            )
+        ]
+        if query.mode == VectorStoreQueryMode.HYBRID:
+            sparse_indices, sparse_values = self._sparse_query_fn([query.query_str])
+            requests.append(
+                rest.SearchRequest(
+                    vector=rest.NamedSparseVector(
+                        name=sparse_vector_name,
+                        vector=rest.SparseVector(
+                            indices=sparse_indices[0], values=sparse_values[0]
+                        ),
+                    ),
+                    limit=query.sparse_top_k or query.similarity_top_k,
+                    filter=query_filter,
+                    with_payload=with_payload,
+                )
+            )
+        return requests
+
+    def _search_result(
+        self, query: VectorStoreQuery, responses: List[Any]
+    ) -> VectorStoreQueryResult:
+        if len(responses) == 1:
+            return self.parse_to_query_result(responses[0])
+        return self._hybrid_fusion_fn(
+            self.parse_to_query_result(responses[0]),
+            self.parse_to_query_result(responses[1]),
+            alpha=query.alpha or 0.5,
+            top_k=query.hybrid_top_k or query.similarity_top_k,
         )
 
-        aclient = qdrant_client.AsyncQdrantClient(
-            url=QDRANT_URL,
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if not self._use_own_search(query):
+            return super().query(query, **kwargs)
+        query_filter = kwargs.get("qdrant_filters") or self._build_query_filter(query)
+        sparse_vector_name = (
+            self.sparse_vector_name()
+            if query.mode == VectorStoreQueryMode.HYBRID
+            else ""
+        )
+        responses = self._client.search_batch(
+            collection_name=self.collection_name,
+            requests=self._search_requests(query, query_filter, sparse_vector_name),
         )
+        return self._search_result(query, responses)
 
-        store = QdrantVectorStore(
-            client=client, aclient=aclient, collection_name=collection_name
+    async def aquery(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        if not self._use_own_search(query):
+            return await super().aquery(query, **kwargs)
+        query_filter = kwargs.get("qdrant_filters") or self._build_query_filter(query)
+        sparse_vector_name = (
+            await self.asparse_vector_name()
+            if query.mode == VectorStoreQueryMode.HYBRID
+            else ""
+        )
+        responses = await self._aclient.search_batch(
+            collection_name=self.collection_name,
+            requests=self._search_requests(query, query_filter, sparse_vector_name),
         )
-    return store
+        return self._search_result(query, responses)
+
+
+class QdrantClientManager:
+    """
+    Registry of the Qdrant clients shared by the whole process.
+    Keeps one sync and one async client per URL, shared by all the collections (e.g. the
+    per-tenant ones), so every request reuses the pooled keep-alive connections instead
+    of opening new ones. The stores of the least recently used collections are dropped
+    over QDRANT_STORE_CACHE_SIZE collections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[
+            str,
+            Tuple[
+                qdrant_client.QdrantClient, Optional[qdrant_client.AsyncQdrantClient]
+            ],
+        ] = {}
+        self._stores: OrderedDict[Tuple[str, str], QdrantVectorStore] = OrderedDict()
+        # Collections whose filter fields are known to be indexed
+        self._indexed: Set[Tuple[str, str]] = set()
+
+    @staticmethod
+    def _client_kwargs(url: str) -> dict:
+        if url == IN_MEMORY_URL:
+            return {"location": IN_MEMORY_URL}
+
+        kwargs = {
+            "url": url,
+            "api_key": os.getenv("QDRANT_API_KEY") or None,
+            "timeout": int(os.getenv("QDRANT_TIMEOUT", "30")),
+            "limits": httpx.Limits(
+                max_connections=int(os.getenv("QDRANT_POOL_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(
+                    os.getenv("QDRANT_POOL_MAX_KEEPALIVE", "20")
+                ),
+                keepalive_expiry=float(os.getenv("QDRANT_POOL_KEEPALIVE_EXPIRY", "30")),
+            ),
+        }
+        if os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true":
+            kwargs["prefer_grpc"] = True
+            kwargs["grpc_port"] = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+        return kwargs
+
+    @property
+    def store_cache_size(self) -> int:
+        return int(os.getenv("QDRANT_STORE_CACHE_SIZE", "128"))
+
+    def get_clients(
+        self, url: str
+    ) -> Tuple[qdrant_client.QdrantClient, Optional[qdrant_client.AsyncQdrantClient]]:
+        key = url
+        clients = self._clients.get(key)
+        if clients is not None:
+            return clients
+        with self._lock:
+            if key not in self._clients:
+                logger.info(f"Creating Qdrant clients for {url}")
+                kwargs = self._client_kwargs(url)
+                client = qdrant_client.QdrantClient(**kwargs)
+                # An in-memory async client would not share the data of the sync one
+                aclient = (
+                    None
+                    if url == IN_MEMORY_URL
+                    else qdrant_client.AsyncQdrantClient(**kwargs)
+                )
+                self._clients[key] = (client, aclient)
+            return self._clients[key]
+
+    def get_vector_store(self, url: str, collection_name: str) -> QdrantVectorStore:
+        key = (url, collection_name)
+        client, aclient = self.get_clients(url)
+        with self._lock:
+            store = self._stores.get(key)
+            if store is not None:
+                self._stores.move_to_end(key)
+                return store
+            hybrid_kwargs = (
+                {
+                    "enable_hybrid": True,
+                    "sparse_doc_fn": sparse_doc_encoder,
+                    "sparse_query_fn": sparse_query_encoder,
+                    "hybrid_fusion_fn": reciprocal_rank_fusion,
+                }
+                if is_hybrid_enabled()
+                else {}
+            )
+            store = RAGQdrantVectorStore(
+                client=client,
+                aclient=aclient,
+                collection_name=collection_name,
+                storage_profile=get_storage_profile(),
+                compact_payload=is_compact_payload_enabled(),
+                **hybrid_kwargs,
+            )
+            self._stores[key] = store
+            # The clients are shared, dropping a store doesn't close any connection
+            while len(self._stores) > max(1, self.store_cache_size):
+                self._stores.popitem(last=False)
+            return store
+
+    def ensure_payload_indexes(self, url: str, collection_name: str) -> List[str]:
+        """
+        Create the missing keyword indexes on the payload fields used by the retrieval
+        filters, returns the created fields.
+        Does nothing if the collection doesn't exist yet (it is created by the first ingestion).
+        """
+        key = (url, collection_name)
+        if key in self._indexed or not is_payload_indexing_enabled():
+            return []
+        if url == IN_MEMORY_URL:
+            # The local Qdrant ignores payload indexes
+            return []
+        client, _ = self.get_clients(url)
+        if not client.collection_exists(collection_name):
+            logger.info(
+                f"Qdrant collection {collection_name} doesn't exist yet, skipping payload indexes"
+            )
+            return []
+
+        existing = client.get_collection(collection_name).payload_schema or {}
+        created = []
+        for field_name in FILTER_FIELDS:
+            if field_name in existing:
+                continue
+            logger.info(
+                f"Creating Qdrant payload index on {collection_name}.{field_name}"
+            )
+            # Don't wait for the indexing of the existing points, Qdrant uses the index once built
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=rest.PayloadSchemaType.KEYWORD,
+                wait=False,
+            )
+            created.append(field_name)
+        self._indexed.add(key)
+        return created
+
+    async def health_check(self) -> Dict[str, bool]:
+        """
+        Probe every registered client, returns the health status per URL
+        """
+        status = {}
+        for url, (client, aclient) in list(self._clients.items()):
+            try:
+                if aclient is not None:
+                    await aclient.get_collections()
+                else:
+                    client.get_collections()
+                status[url] = True
+            except Exception as e:
+                logger.warning(f"Qdrant health check failed for {url}: {e}")
+                status[url] = False
+        return status
+
+    async def startup(self):
+        """
+        Create the clients for the configured collection and check that Qdrant is reachable
+        """
+        try:
+            url, collection_name = get_qdrant_config()
+        except ValueError as e:
+            logger.warning(f"Skipping Qdrant startup: {e}")
+            return
+        self.get_clients(url)
+        status = await self.health_check()
+        if all(status.values()):
+            logger.info("Connected to Qdrant")
+            try:
+                await asyncio.to_thread(
+                    self.ensure_payload_indexes, url, collection_name
+                )
+            except Exception as e:
+                logger.warning(f"Could not create the Qdrant payload indexes: {e}")
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._stores.clear()
+            self._indexed.clear()
+        for client, aclient in clients:
+            try:
+                client.close()
+                if aclient is not None:
+                    await aclient.close()
+            except Exception as e:
+                logger.warning(f"Error closing Qdrant client: {e}")
+        logger.info("Closed Qdrant clients")
+
+
+def is_payload_indexing_enabled() -> bool:
+    return os.getenv("QDRANT_PAYLOAD_INDEXES", "true").lower() == "true"
+
+
+qdrant_manager = QdrantClientManager()
+
+
+def get_vector_store(collection_name: Optional[str] = None) -> QdrantVectorStore:
+    url, default_collection = get_qdrant_config()
+    return qdrant_manager.get_vector_store(url, collection_name or default_collection)
+
+
+def ensure_payload_indexes(collection_name: Optional[str] = None) -> List[str]:
+    url, default_collection = get_qdrant_config()
+    return qdrant_manager.ensure_payload_indexes(
+        url, collection_name or default_collection
+    )
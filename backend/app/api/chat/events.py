@@ -1,12 +1,15 @@
 import json
 import asyncio
 import logging
+import threading
 from typing import AsyncGenerator, Dict, Any, List, Optional
 from llama_index.core.callbacks.base import BaseCallbackHandler
 from llama_index.core.callbacks.schema import CBEventType
 from llama_index.core.tools.types import ToolOutput
 from pydantic import BaseModel
 
+from app.api.chat.stream_events import DataEvent
+
 
 logger = logging.getLogger(__name__)
 
@@ -91,23 +94,72 @@ class CallbackEvent(BaseModel):
             return None
 
 
+# Only these events can be converted to a response for the client
+STREAMED_EVENT_STARTS = {CBEventType.RETRIEVE, CBEventType.FUNCTION_CALL}
+STREAMED_EVENT_ENDS = {CBEventType.RETRIEVE, CBEventType.AGENT_STEP}
+
+# Marks the end of the event stream
+_DONE = object()
+
+
 class EventCallbackHandler(BaseCallbackHandler):
+    """
+    Forward the callback events to the chat stream.
+    The events are converted to data events once and pushed to a channel that
+    is consumed without polling until `is_done` is set.
+    """
+
     _aqueue: asyncio.Queue
-    is_done: bool = False
 
     def __init__(
         self,
     ):
         """Initialize the base callback handler."""
-        ignored_events = [
-            CBEventType.CHUNKING,
-            CBEventType.NODE_PARSING,
-            CBEventType.EMBEDDING,
-            CBEventType.LLM,
-            CBEventType.TEMPLATING,
-        ]
-        super().__init__(ignored_events, ignored_events)
+        super().__init__(
+            event_starts_to_ignore=[
+                e for e in CBEventType if e not in STREAMED_EVENT_STARTS
+            ],
+            event_ends_to_ignore=[e for e in CBEventType if e not in STREAMED_EVENT_ENDS],
+        )
         self._aqueue = asyncio.Queue()
+        self._is_done = False
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        self._loop_thread = threading.get_ident()
+
+    @property
+    def is_done(self) -> bool:
+        return self._is_done
+
+    @is_done.setter
+    def is_done(self, value: bool):
+        if value and not self._is_done:
+            self._put(_DONE)
+        self._is_done = value
+
+    def _put(self, item: Any):
+        # Callbacks might be fired from a worker thread, wake up the loop safely then
+        if self._loop is None or threading.get_ident() == self._loop_thread:
+            self._aqueue.put_nowait(item)
+        else:
+            self._loop.call_soon_threadsafe(self._aqueue.put_nowait, item)
+
+    def _handle_event(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]],
+        event_id: str,
+    ):
+        if self._is_done:
+            return
+        event = CallbackEvent.model_construct(
+            event_id=event_id, event_type=event_type, payload=payload
+        )
+        response = event.to_response()
+        if response is not None:
+            self._put(DataEvent.from_dict(response))
 
     def on_event_start(
         self,
@@ -116,9 +168,9 @@ class EventCallbackHandler(BaseCallbackHandler):
         event_id: str = "",
         **kwargs: Any,
     ) -> str:
-        event = CallbackEvent(event_id=event_id, event_type=event_type, payload=payload)
-        if event.to_response() is not None:
-            self._aqueue.put_nowait(event)
+        if event_type in STREAMED_EVENT_STARTS:
+            self._handle_event(event_type, payload, event_id)
+        return event_id
 
     def on_event_end(
         self,
@@ -127,9 +179,8 @@ class EventCallbackHandler(BaseCallbackHandler):
         event_id: str = "",
         **kwargs: Any,
     ) -> None:
-        event = CallbackEvent(event_id=event_id, event_type=event_type, payload=payload)
-        if event.to_response() is not None:
-            self._aqueue.put_nowait(event)
+        if event_type in STREAMED_EVENT_ENDS:
+            self._handle_event(event_type, payload, event_id)
 
     def start_trace(self, trace_id: Optional[str] = None) -> None:
         """No-op."""
@@ -141,9 +192,9 @@ class EventCallbackHandler(BaseCallbackHandler):
     ) -> None:
         """No-op."""
 
-    async def async_event_gen(self) -> AsyncGenerator[CallbackEvent, None]:
-        while not self._aqueue.empty() or not self.is_done:
-            try:
-                yield await asyncio.wait_for(self._aqueue.get(), timeout=0.1)
-            except asyncio.TimeoutError:
-                pass
+    async def async_event_gen(self) -> AsyncGenerator[DataEvent, None]:
+        while True:
+            item = await self._aqueue.get()
+            if item is _DONE:
+                return
+            yield item
@@ -187,7 +187,10 @@ class SourceNodes(BaseModel):
                 return f"{url_prefix}/output/llamacloud/{file_name}"
             is_private = metadata.get("private", "false") == "true"
             if is_private:
-                # file is a private upload
+                # file is a private upload, served to its owner only
+                private_file = metadata.get("private_file")
+                if private_file:
+                    return f"{url_prefix}/private/{private_file}"
                 return f"{url_prefix}/output/uploaded/{file_name}"
             # file is from calling the 'generate' script
             # Get the relative path of file_path to data_dir
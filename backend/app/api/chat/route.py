@@ -1,4 +1,4 @@
-import json
+import asyncio
 import logging
 from typing import List, Dict, Any, Optional
 from fastapi import (
@@ -8,10 +8,13 @@ from fastapi import (
     Request,
     status,
     Query,
+    Response,
 )
 from llama_index.core.chat_engine.types import BaseChatEngine, NodeWithScore
 from llama_index.core.llms import MessageRole
+from starlette.background import BackgroundTask
 
+from app.api.chat.cancellation import DisconnectWatcher, spawn_detached
 from app.api.chat.events import EventCallbackHandler
 from app.api.chat.models import (
     ChatData,
@@ -19,13 +22,16 @@ from app.api.chat.models import (
     Result,
     SourceNodes,
 )
+from app.api.chat.services.semantic_cache import semantic_cache
+from app.api.chat.services.suggestion import NextQuestionSuggestion
+from app.api.chat.stream_events import StreamCollector, TitleEvent
 from app.api.chat.vercel_response import VercelStreamResponse
 from app.api.chat.engine import get_chat_engine
 from app.api.chat.engine.query_filter import generate_filters
 from app.models.user_model import User
 from app.core.user import get_current_user
-from app.api.chat.summary import summary_generator
-from app.services import conversation_service
+from app.api.chat.summary import title_generator
+from app.services import conversation_service, config_service
 from phoenix.trace import using_project
 
 chat_router = r = APIRouter()
@@ -47,6 +53,7 @@ async def chat(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Conversation ID is required for authenticated requests.",
             )
+        watcher = None
         try:
             USER_ID = current_user.email
             conversation = await conversation_service.get_or_create_conversation(
@@ -60,93 +67,152 @@ async def chat(
                         conversation_id, len(incoming_messages), USER_ID
                     )
 
-            if conversation.get("summary") == "New Chat":
-                if len(data.messages) <= 2:
-                    summary = await summary_generator(data.messages)
-            else:
-                try:
-                    summary = conversation.get("summary")
-                except Exception as e:
-                    summary = "New Chat"
             last_message_content = data.get_last_message_content()
             messages = data.get_history_messages()
 
+            # The owner is set with the first message, the title is only saved on the
+            # conversations of the user
             await conversation_service.update_conversation(
                 conversation_id,
                 {"role": MessageRole.USER, "content": last_message_content},
+                user_id=USER_ID,
             )
 
+            title_task = None
+            if conversation.get("summary") == "New Chat" and len(data.messages) <= 2:
+                # The title is generated in the background and sent once it's ready
+                title_task = await title_generator.generate(
+                    conversation_id, USER_ID, data.messages
+                )
+
             doc_ids = data.get_chat_document_ids()
             filters = generate_filters(doc_ids)
             params = data.data or {}
             logger.info(
                 f"Creating chat engine with filters: {str(filters)}",
             )
-            chat_engine = get_chat_engine(filters=filters, params=params)
+            system_prompt = await config_service.get_system_prompt()
+            chat_engine = get_chat_engine(
+                filters=filters,
+                params=params,
+                system_prompt=system_prompt,
+                conversation_id=conversation_id,
+                tenant_id=USER_ID,
+                doc_ids=doc_ids,
+            )
 
             event_handler = EventCallbackHandler()
             chat_engine.callback_manager.handlers.append(event_handler)  # type: ignore
 
-            response = await chat_engine.astream_chat(last_message_content, messages)
-            # process_response_nodes(response.source_nodes, background_tasks)
+            watcher = DisconnectWatcher(request)
+            watcher.start()
+
+            cached_answer = None
+            if semantic_cache.enabled:
+                # The condensed question is memoized by the chat engine,
+                # so a cache miss doesn't condense it twice
+                standalone_question = await watcher.run(
+                    chat_engine.acondense_question(last_message_content, messages)
+                )
+                cache_namespace = semantic_cache.get_namespace(
+                    filters, system_prompt, tenant_id=USER_ID
+                )
+                cached_answer, question_embedding = await semantic_cache.lookup(
+                    standalone_question, cache_namespace
+                )
 
-            final_response = ""
-            suggested_questions = []
-            source_nodes = []
-            event = []
-            tools = []
+            response = None
+            if cached_answer is None:
+                response = await watcher.start_chat(
+                    chat_engine.astream_chat(last_message_content, messages)
+                )
+            # process_response_nodes(response.source_nodes, background_tasks)
 
-            async def enhanced_content_generator():
-                nonlocal final_response, suggested_questions, source_nodes, event, tools
-                async for chunk in VercelStreamResponse.content_generator(
-                    request, event_handler, response, data
-                ):
-                    # print(chunk, end="", flush=True)  # Print each chunk in the backend
-                    yield chunk
-
-                    if chunk.startswith(VercelStreamResponse.TEXT_PREFIX):
-                        final_response += json.loads(chunk[2:].strip())
-                    elif chunk.startswith(VercelStreamResponse.DATA_PREFIX):
-                        data_chunk = json.loads(chunk[2:].strip())[0]
-                        if data_chunk["type"] == "suggested_questions":
-                            suggested_questions = data_chunk["data"]
-                        elif data_chunk["type"] == "sources":
-                            try:
-                                source_nodes = data_chunk[
-                                    "data"
-                                ]  # might have chidlen key value pair
-                            except Exception:
-                                source_nodes = []
-                        elif data_chunk["type"] == "events":
-                            try:
-                                event = data_chunk[
-                                    "data"
-                                ]  # might have chidlen key value pair
-                            except Exception:
-                                event = []  # might have chidlen key value pair
-                        elif data_chunk["type"] == "tools":
-                            try:
-                                tools = data_chunk["data"]
-                            except Exception:
-                                tools = []
+            collector = StreamCollector()
+            suggestions_mode = (
+                NextQuestionSuggestion.get_mode() if cached_answer is None else "inline"
+            )
 
+            async def persist_answer():
+                extra_fields = None
+                if suggestions_mode == "deferred":
+                    # No suggestions are generated for an interrupted answer
+                    extra_fields = {
+                        "suggested_questions": {
+                            "status": "skipped" if watcher.disconnected else "pending",
+                            "questions": [],
+                        }
+                    }
                 await conversation_service.update_conversation(
                     conversation_id,
-                    {
-                        "role": MessageRole.ASSISTANT,
-                        "content": final_response,
-                        "annotations": [
-                            {"type": "sources", "data": source_nodes},
-                            {
-                                "type": "suggested_questions",
-                                "data": suggested_questions,
-                            },
-                            {"type": "events", "data": event},
-                            {"type": "tools", "data": tools},
-                        ],
-                    },
-                    summary=summary,
+                    collector.to_message(),
                     user_id=USER_ID,
+                    extra_fields=extra_fields,
+                )
+
+            async def enhanced_content_generator():
+                nonlocal title_task
+                if cached_answer is not None:
+                    events = VercelStreamResponse.replay_generator(cached_answer)
+                else:
+                    events = VercelStreamResponse.content_generator(
+                        request,
+                        event_handler,
+                        response,
+                        data,
+                        suggestions_mode,
+                        watcher,
+                    )
+                try:
+                    async for event in events:
+                        collector.add(event)
+                        yield event
+
+                        if title_task is not None and title_task.done():
+                            if not title_task.cancelled() and not title_task.exception():
+                                yield TitleEvent({"summary": title_task.result()})
+                            title_task = None
+                except asyncio.CancelledError:
+                    # The server cancels the response once the client is gone:
+                    # stop the generation and persist the partial answer outside of this task
+                    watcher.cancel()
+                    spawn_detached(persist_answer())
+                    raise
+                finally:
+                    watcher.stop()
+
+                if not watcher.disconnected:
+                    watcher.record_completion()
+                    if semantic_cache.enabled and cached_answer is None:
+                        semantic_cache.put(
+                            cache_namespace,
+                            standalone_question,
+                            question_embedding,
+                            collector.content,
+                            collector.sources,
+                            collector.suggested_questions,
+                        )
+                await persist_answer()
+
+            async def generate_deferred_suggestions():
+                if watcher.disconnected:
+                    # persist_answer already marked the suggestions as skipped
+                    return
+                conversation = data.messages + [
+                    Message(role=MessageRole.ASSISTANT, content=collector.content)
+                ]
+                try:
+                    questions = await NextQuestionSuggestion.suggest_next_questions(
+                        conversation
+                    )
+                except Exception:
+                    logger.exception("Error when generating the deferred suggestions")
+                    await conversation_service.set_suggested_questions(
+                        conversation_id, [], status="failed"
+                    )
+                    return
+                await conversation_service.set_suggested_questions(
+                    conversation_id, questions
                 )
 
             return VercelStreamResponse(
@@ -155,8 +221,20 @@ async def chat(
                 response,
                 data,
                 content=enhanced_content_generator(),
+                background=(
+                    BackgroundTask(generate_deferred_suggestions)
+                    if suggestions_mode == "deferred"
+                    else None
+                ),
             )
+        except asyncio.CancelledError:
+            if watcher is None or not watcher.disconnected:
+                raise
+            # The client disconnected during the retrieval, nobody is waiting for the answer
+            return Response(status_code=499)
         except Exception as e:
+            if watcher is not None:
+                watcher.stop()
             logger.exception("Error in chat engine", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
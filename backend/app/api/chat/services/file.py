@@ -1,14 +1,24 @@
 import base64
+import hashlib
 import mimetypes
 import os
+import uuid
 from io import BytesIO
 from pathlib import Path
 from typing import Any, List, Tuple
 
 
-from app.api.chat.engine.index import get_index
+from app.api.chat.engine.index import bump_ingestion_version, get_index
+from app.api.chat.engine.routing import (
+    get_tenant_collection,
+    get_tenant_index,
+    is_tenant_routing_enabled,
+)
+from app.api.chat.engine.vectordb import ensure_payload_indexes
+from app.concurrent_embedding import get_ingestion_embed_model
 from llama_index.core import VectorStoreIndex
 from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.readers.file.base import (
     _try_loading_included_file_formats as get_file_loaders_map,
 )
@@ -36,7 +46,9 @@ def default_file_loaders_map():
 
 
 class PrivateFileService:
-    PRIVATE_STORE_PATH = "output/uploaded"
+    # Outside of the "output" directory served as static files,
+    # the uploads are served to their owner only (see upload.py)
+    PRIVATE_STORE_PATH = "private/uploaded"
 
     @staticmethod
     def preprocess_base64_file(base64_content: str) -> Tuple[bytes, str | None]:
@@ -47,10 +59,43 @@ class PrivateFileService:
         return base64.b64decode(data), extension
 
     @staticmethod
-    def store_and_parse_file(file_name, file_data, extension) -> List[Document]:
-        # Store file to the private directory
-        os.makedirs(PrivateFileService.PRIVATE_STORE_PATH, exist_ok=True)
-        file_path = Path(os.path.join(PrivateFileService.PRIVATE_STORE_PATH, file_name))
+    def sanitize_file_name(file_name: str) -> str:
+        # Only the base name of the client's file name, never a path
+        name = Path(file_name.replace("\\", "/")).name
+        if name in ("", ".", ".."):
+            raise ValueError(f"Invalid file name: {file_name!r}")
+        return name
+
+    @staticmethod
+    def get_tenant_dir(tenant_id: str | None) -> Path:
+        tenant = (
+            hashlib.sha256(tenant_id.encode()).hexdigest()[:16]
+            if tenant_id is not None
+            else "shared"
+        )
+        return Path(PrivateFileService.PRIVATE_STORE_PATH) / tenant
+
+    @staticmethod
+    def get_stored_file(tenant_id: str | None, stored_name: str) -> Path | None:
+        """
+        Path of a file uploaded by the tenant, None if it doesn't exist
+        """
+        tenant_dir = PrivateFileService.get_tenant_dir(tenant_id).resolve()
+        file_path = (tenant_dir / stored_name).resolve()
+        if file_path.parent != tenant_dir or not file_path.is_file():
+            return None
+        return file_path
+
+    @staticmethod
+    def store_and_parse_file(
+        file_name, file_data, extension, tenant_id: str | None = None
+    ) -> List[Document]:
+        # Store file to the tenant's private directory, with a unique name
+        file_name = PrivateFileService.sanitize_file_name(file_name)
+        stored_name = f"{uuid.uuid4().hex}_{file_name}"
+        tenant_dir = PrivateFileService.get_tenant_dir(tenant_id)
+        os.makedirs(tenant_dir, exist_ok=True)
+        file_path = tenant_dir / stored_name
 
         # write file
         with open(file_path, "wb") as f:
@@ -70,14 +115,22 @@ class PrivateFileService:
         for doc in documents:
             doc.metadata["file_name"] = file_name
             doc.metadata["private"] = "true"
+            # Used to build the authenticated download URL of the source
+            doc.metadata["private_file"] = stored_name
+            doc.excluded_embed_metadata_keys.append("private_file")
+            doc.excluded_llm_metadata_keys.append("private_file")
         return documents
 
     @staticmethod
-    def process_file(file_name: str, base64_content: str, params: Any) -> List[str]:
+    def process_file(
+        file_name: str, base64_content: str, params: Any, tenant_id: str | None = None
+    ) -> List[str]:
         file_data, extension = PrivateFileService.preprocess_base64_file(base64_content)
+        file_name = PrivateFileService.sanitize_file_name(file_name)
 
-        # Add the nodes to the index and persist it
-        current_index = get_index(params)
+        # With tenant routing, the private documents go to the tenant's own collection
+        routed = is_tenant_routing_enabled() and tenant_id is not None
+        current_index = get_tenant_index(tenant_id) if routed else get_index(params)
 
         # Insert the documents into the index
         if isinstance(current_index, LlamaCloudIndex):
@@ -101,10 +154,16 @@ class PrivateFileService:
         else:
             # First process documents into nodes
             documents = PrivateFileService.store_and_parse_file(
-                file_name, file_data, extension
+                file_name, file_data, extension, tenant_id
             )
-            pipeline = IngestionPipeline()
+            if tenant_id is not None:
+                for doc in documents:
+                    doc.metadata["user_id"] = tenant_id
+            splitter = SentenceSplitter()
+            embed_model = get_ingestion_embed_model([splitter])
+            pipeline = IngestionPipeline(transformations=[splitter, embed_model])
             nodes = pipeline.run(documents=documents)
+            embed_model.cache_stats.log()
 
             # Add the nodes to the index and persist it
             if current_index is None:
@@ -114,6 +173,10 @@ class PrivateFileService:
             current_index.storage_context.persist(
                 persist_dir=os.environ.get("STORAGE_DIR", "storage")
             )
+            ensure_payload_indexes(
+                get_tenant_collection(tenant_id) if routed else None
+            )
+            bump_ingestion_version()
 
             # Return the document ids
             return [doc.doc_id for doc in documents]
@@ -0,0 +1,225 @@
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.settings import Settings
+from llama_index.core.vector_stores.types import MetadataFilters
+
+from app.api.chat.engine.index import get_ingestion_version, on_ingestion
+from app.api.chat.engine.routing import get_tenant_collection, is_tenant_routing_enabled
+from app.api.chat.engine.vectordb import get_qdrant_config
+from app.metrics import metrics
+
+logger = logging.getLogger("uvicorn")
+
+
+@dataclass
+class SemanticCacheEntry:
+    question: str
+    embedding: np.ndarray
+    answer: str
+    sources: Any = None
+    suggested_questions: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+
+
+class SemanticCacheStore(ABC):
+    """
+    Backing store of the semantic cache.
+    Subclass it to keep the cache in another store (e.g. Redis or a Qdrant collection)
+    and set SEMANTIC_CACHE_STORE to `module.path:ClassName`.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    @abstractmethod
+    def search(
+        self, namespace: str, embedding: np.ndarray, threshold: float
+    ) -> Optional[SemanticCacheEntry]:
+        """
+        Return the most similar entry of the namespace if its cosine similarity reaches the threshold
+        """
+
+    @abstractmethod
+    def put(self, namespace: str, entry: SemanticCacheEntry):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+
+class InMemorySemanticCacheStore(SemanticCacheStore):
+    """
+    In-process store with LRU and TTL eviction, the entries of a namespace
+    are scored with a single matrix product
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Tuple[str, int], SemanticCacheEntry] = OrderedDict()
+        self._matrices: Dict[str, Tuple[List[Tuple[str, int]], np.ndarray]] = {}
+        self._next_id = 0
+
+    def _evict(self, key: Tuple[str, int]):
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+
+    def _get_matrix(self, namespace: str) -> Tuple[List[Tuple[str, int]], np.ndarray]:
+        if namespace not in self._matrices:
+            keys = [key for key in self._entries if key[0] == namespace]
+            matrix = (
+                np.vstack([self._entries[key].embedding for key in keys])
+                if keys
+                else np.empty((0, 0))
+            )
+            self._matrices[namespace] = (keys, matrix)
+        return self._matrices[namespace]
+
+    def search(
+        self, namespace: str, embedding: np.ndarray, threshold: float
+    ) -> Optional[SemanticCacheEntry]:
+        with self._lock:
+            keys, matrix = self._get_matrix(namespace)
+            if not keys:
+                return None
+            scores = matrix @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            key = keys[best]
+            entry = self._entries[key]
+            if time.time() - entry.created_at > self.ttl:
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, namespace: str, entry: SemanticCacheEntry):
+        with self._lock:
+            key = (namespace, self._next_id)
+            self._next_id += 1
+            self._entries[key] = entry
+            self._matrices.pop(namespace, None)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+
+class SemanticCache:
+    """
+    Cache of the answers keyed by the embedding of the standalone question.
+    The entries are partitioned by namespace (filters, system prompt and ingestion version),
+    so a cached answer is only replayed for the same documents and instructions.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+        self.threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        self._store: Optional[SemanticCacheStore] = None
+        on_ingestion(lambda _: self.clear())
+
+    @property
+    def store(self) -> SemanticCacheStore:
+        if self._store is None:
+            max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+            ttl = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+            store_path = os.getenv("SEMANTIC_CACHE_STORE", "memory")
+            if store_path == "memory":
+                store_cls = InMemorySemanticCacheStore
+            else:
+                module_name, class_name = store_path.split(":")
+                store_cls = getattr(importlib.import_module(module_name), class_name)
+            self._store = store_cls(max_entries=max_entries, ttl=ttl)
+        return self._store
+
+    @staticmethod
+    def get_namespace(
+        filters: Optional[MetadataFilters],
+        system_prompt: Optional[str],
+        tenant_id: Optional[str] = None,
+    ) -> str:
+        """
+        Answers are only shared between chats that retrieve from the same collections,
+        with the same embedding model, filters, system prompt and ingestion version
+        """
+        _, collection = get_qdrant_config()
+        collections = [collection]
+        if tenant_id and is_tenant_routing_enabled():
+            collections.append(get_tenant_collection(tenant_id))
+        embed_model = Settings.embed_model
+        signature = "\n".join(
+            [
+                filters.json() if filters is not None else "",
+                system_prompt or "",
+                str(get_ingestion_version()),
+                ",".join(collections),
+                f"{type(embed_model).__name__}:{embed_model.model_name}",
+            ]
+        )
+        return hashlib.sha256(signature.encode()).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    async def lookup(
+        self, question: str, namespace: str
+    ) -> Tuple[Optional[SemanticCacheEntry], np.ndarray]:
+        """
+        Find a cached answer for the question, also returns the question embedding to store the answer
+        """
+        embedding = self._normalize(
+            await Settings.embed_model.aget_query_embedding(question)
+        )
+        entry = self.store.search(namespace, embedding, self.threshold)
+        metrics.incr("semantic_cache.hits" if entry else "semantic_cache.misses")
+        return entry, embedding
+
+    def put(
+        self,
+        namespace: str,
+        question: str,
+        embedding: np.ndarray,
+        answer: str,
+        sources: Any,
+        suggested_questions: List[str],
+    ):
+        if not answer:
+            return
+        self.store.put(
+            namespace,
+            SemanticCacheEntry(
+                question=question,
+                embedding=embedding,
+                answer=answer,
+                sources=sources,
+                suggested_questions=suggested_questions,
+            ),
+        )
+        metrics.incr("semantic_cache.stores")
+
+    def clear(self):
+        if self._store is not None:
+            logger.info("Clearing the semantic answer cache")
+            self._store.clear()
+
+
+semantic_cache = SemanticCache()
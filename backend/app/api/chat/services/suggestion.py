@@ -1,4 +1,5 @@
 import logging
+import os
 from typing import List
 
 from app.api.chat.models import Message
@@ -14,6 +15,11 @@ NEXT_QUESTIONS_SUGGESTION_PROMPT = PromptTemplate(
 )
 N_QUESTION_TO_GENERATE = 3
 
+# inline: generate the suggestions after the answer, before sending the sources (default)
+# concurrent: send the sources right away, generate the suggestions within SUGGESTIONS_TIMEOUT
+# deferred: generate the suggestions in the background and store them on the conversation
+SUGGESTIONS_MODES = ("inline", "concurrent", "deferred")
+
 
 logger = logging.getLogger("uvicorn")
 
@@ -25,6 +31,18 @@ class NextQuestions(BaseModel):
 
 
 class NextQuestionSuggestion:
+    @staticmethod
+    def get_mode() -> str:
+        mode = os.getenv("SUGGESTIONS_MODE", "inline")
+        if mode not in SUGGESTIONS_MODES:
+            logger.warning(f"Invalid SUGGESTIONS_MODE: {mode}, using 'inline'")
+            return "inline"
+        return mode
+
+    @staticmethod
+    def get_timeout() -> float:
+        return float(os.getenv("SUGGESTIONS_TIMEOUT", "3"))
+
     @staticmethod
     async def suggest_next_questions(
         messages: List[Message],
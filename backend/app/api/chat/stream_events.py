@@ -0,0 +1,188 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, ClassVar, Dict, List, Optional
+
+from llama_index.core.llms import MessageRole
+
+TEXT_PREFIX = "0:"
+DATA_PREFIX = "8:"
+
+
+class StreamEvent(ABC):
+    """
+    An event of the chat stream, encoded exactly once into the Vercel wire format
+    """
+
+    @abstractmethod
+    def encode(self) -> bytes:
+        ...
+
+
+@dataclass
+class TokenEvent(StreamEvent):
+    token: str
+
+    def encode(self) -> bytes:
+        # Escape newlines and double quotes to avoid breaking the stream
+        return f"{TEXT_PREFIX}{json.dumps(self.token)}\n".encode()
+
+
+@dataclass
+class DataEvent(StreamEvent):
+    type: ClassVar[str] = "data"
+    data: Any
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "data": self.data}
+
+    def encode(self) -> bytes:
+        return f"{DATA_PREFIX}[{json.dumps(self.to_dict())}]\n".encode()
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "DataEvent":
+        event_cls = DATA_EVENT_TYPES.get(data["type"])
+        if event_cls is None:
+            raise ValueError(f"Unknown data event type: {data['type']}")
+        return event_cls(data["data"])
+
+
+class SourcesEvent(DataEvent):
+    type = "sources"
+
+
+class SuggestionsEvent(DataEvent):
+    type = "suggested_questions"
+
+
+class AgentStepEvent(DataEvent):
+    type = "events"
+
+
+class ToolEvent(DataEvent):
+    type = "tools"
+
+
+class TitleEvent(DataEvent):
+    type = "title"
+
+
+DATA_EVENT_TYPES = {
+    event_cls.type: event_cls
+    for event_cls in (
+        SourcesEvent,
+        SuggestionsEvent,
+        AgentStepEvent,
+        ToolEvent,
+        TitleEvent,
+    )
+}
+
+
+class StreamCollector:
+    """
+    Collect the events sent to the client to persist the assistant message
+    """
+
+    def __init__(self):
+        self._tokens: List[str] = []
+        self.sources: Any = []
+        self.suggested_questions: List[str] = []
+        self.events: Any = []
+        self.tools: Any = []
+
+    def add(self, event: StreamEvent):
+        match event:
+            case TokenEvent():
+                self._tokens.append(event.token)
+            case SourcesEvent():
+                self.sources = event.data
+            case SuggestionsEvent():
+                self.suggested_questions = event.data
+            case AgentStepEvent():
+                self.events = event.data
+            case ToolEvent():
+                self.tools = event.data
+
+    @property
+    def content(self) -> str:
+        return "".join(self._tokens)
+
+    def to_message(self) -> Dict[str, Any]:
+        return {
+            "role": MessageRole.ASSISTANT,
+            "content": self.content,
+            "annotations": [
+                {"type": "sources", "data": self.sources},
+                {"type": "suggested_questions", "data": self.suggested_questions},
+                {"type": "events", "data": self.events},
+                {"type": "tools", "data": self.tools},
+            ],
+        }
+
+
+async def coalesce_tokens(
+    events: AsyncIterator[StreamEvent], interval: float, max_bytes: int
+) -> AsyncIterator[StreamEvent]:
+    """
+    Merge consecutive token events into one event per `interval` seconds or `max_bytes` bytes,
+    whichever comes first. The first token is sent right away to keep the time to first token low,
+    other events flush the buffered tokens to keep the order of the stream.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer: List[str] = []
+    buffered_bytes = 0
+    deadline = 0.0
+    first_token_sent = False
+    pending: Optional[asyncio.Future] = None
+
+    def flush() -> TokenEvent:
+        nonlocal buffer, buffered_bytes
+        event = TokenEvent("".join(buffer))
+        buffer, buffered_bytes = [], 0
+        return event
+
+    try:
+        while True:
+            if pending is None and not (buffer and interval > 0):
+                try:
+                    event = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+            else:
+                # Wait for the next event, but not longer than the flush deadline
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = max(0.0, deadline - loop.time()) if buffer else None
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    yield flush()
+                    continue
+                future, pending = pending, None
+                try:
+                    event = future.result()
+                except StopAsyncIteration:
+                    break
+
+            if not isinstance(event, TokenEvent):
+                if buffer:
+                    yield flush()
+                yield event
+            elif not first_token_sent:
+                first_token_sent = bool(event.token)
+                yield event
+            else:
+                if not buffer:
+                    deadline = loop.time() + interval
+                buffer.append(event.token)
+                buffered_bytes += len(event.token.encode())
+                if max_bytes > 0 and buffered_bytes >= max_bytes:
+                    yield flush()
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    if buffer:
+        yield flush()
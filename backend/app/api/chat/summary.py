@@ -1,5 +1,9 @@
-from typing import List
+import asyncio
+import os
+from typing import List, Optional
 from app.api.chat.models import Message
+from app.services import conversation_service
+from app.task_queue import BackgroundTaskQueue
 from llama_index.core.settings import Settings
 
 
@@ -32,3 +36,50 @@ async def summary_generator(
     )
     # print(response)
     return str(response)
+
+
+class TitleGenerator:
+    """
+    Generate the title of new conversations in the background, off the chat request path.
+    The generation is deduplicated per conversation, in-process and across workers.
+    """
+
+    def __init__(self):
+        self.queue = BackgroundTaskQueue(
+            "title",
+            max_concurrency=int(os.getenv("TITLE_GENERATION_CONCURRENCY", "4")),
+            max_retries=int(os.getenv("TITLE_GENERATION_RETRIES", "2")),
+        )
+
+    async def generate(
+        self, conversation_id: str, user_id: str, messages: List[Message]
+    ) -> Optional[asyncio.Task]:
+        """
+        Queue the title generation, returns None if it is already handled by another worker
+        """
+        task = self.queue.get(conversation_id)
+        if task is not None:
+            return task
+        if not await conversation_service.claim_title_generation(conversation_id):
+            return None
+
+        async def _generate() -> str:
+            title = (await summary_generator(messages)).strip()
+            matched = await conversation_service.edit_conversation_summary(
+                conversation_id, user_id, title
+            )
+            if matched == 0:
+                # Retried, then the claim is released for the next message
+                raise RuntimeError(
+                    f"Conversation {conversation_id} of {user_id} not found"
+                )
+            return title
+
+        async def _release():
+            # Let the next message of the conversation try again
+            await conversation_service.release_title_generation(conversation_id)
+
+        return self.queue.submit(conversation_id, _generate, on_failure=_release)
+
+
+title_generator = TitleGenerator()
@@ -1,12 +1,16 @@
 import logging
 from typing import List, Any
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 
 from app.api.chat.services.file import PrivateFileService
+from app.core.user import get_current_user
+from app.models.user_model import User
 
 file_upload_router = r = APIRouter()
+private_file_router = APIRouter()
 
 logger = logging.getLogger("uvicorn")
 
@@ -17,13 +21,30 @@ class FileUploadRequest(BaseModel):
     params: Any = None
 
 
-# @r.post("")
-# def upload_file(request: FileUploadRequest) -> List[str]:
-#     try:
-#         logger.info("Processing file")
-#         return PrivateFileService.process_file(
-#             request.filename, request.base64, request.params
-#         )
-#     except Exception as e:
-#         logger.error(f"Error processing file: {e}", exc_info=True)
-#         raise HTTPException(status_code=500, detail="Error processing file")
+@r.post("")
+def upload_file(
+    request: FileUploadRequest, current_user: User = Depends(get_current_user)
+) -> List[str]:
+    try:
+        logger.info("Processing file")
+        # The user is the tenant of the private documents (see QDRANT_TENANT_ROUTING)
+        return PrivateFileService.process_file(
+            request.filename,
+            request.base64,
+            request.params,
+            tenant_id=current_user.email,
+        )
+    except Exception as e:
+        logger.error(f"Error processing file: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error processing file")
+
+
+@private_file_router.get("/{stored_name}")
+def get_private_file(
+    stored_name: str, current_user: User = Depends(get_current_user)
+) -> FileResponse:
+    # Only the files uploaded by the current user are found
+    file_path = PrivateFileService.get_stored_file(current_user.email, stored_name)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(file_path, filename=stored_name.split("_", 1)[-1])
@@ -1,13 +1,31 @@
+import asyncio
 import json
+import logging
+import os
+from typing import AsyncIterator, Optional
 
 from aiostream import stream
 from fastapi import Request
 from fastapi.responses import StreamingResponse
 from llama_index.core.chat_engine.types import StreamingAgentChatResponse
 
+from app.api.chat.cancellation import DisconnectWatcher
 from app.api.chat.events import EventCallbackHandler
 from app.api.chat.models import ChatData, Message, SourceNodes
+from app.api.chat.services.semantic_cache import SemanticCacheEntry
 from app.api.chat.services.suggestion import NextQuestionSuggestion
+from app.api.chat.stream_events import (
+    DATA_PREFIX,
+    TEXT_PREFIX,
+    SourcesEvent,
+    StreamEvent,
+    SuggestionsEvent,
+    TokenEvent,
+    coalesce_tokens,
+)
+from app.metrics import metrics
+
+logger = logging.getLogger("uvicorn")
 
 
 class VercelStreamResponse(StreamingResponse):
@@ -15,8 +33,8 @@ class VercelStreamResponse(StreamingResponse):
     Class to convert the response from the chat engine to the streaming format expected by Vercel
     """
 
-    TEXT_PREFIX = "0:"
-    DATA_PREFIX = "8:"
+    TEXT_PREFIX = TEXT_PREFIX
+    DATA_PREFIX = DATA_PREFIX
 
     @classmethod
     def convert_text(cls, token: str):
@@ -36,12 +54,54 @@ class VercelStreamResponse(StreamingResponse):
         response: StreamingAgentChatResponse,
         chat_data: ChatData,
         content=None,
+        background=None,
     ):
         if content is None:
             content = VercelStreamResponse.content_generator(
                 request, event_handler, response, chat_data
             )
-        super().__init__(content=content)
+        super().__init__(content=self.encode_events(content), background=background)
+
+    @staticmethod
+    async def encode_events(
+        events: AsyncIterator[StreamEvent],
+        coalesce_ms: Optional[float] = None,
+        coalesce_bytes: Optional[int] = None,
+    ):
+        """
+        Encode the events to the wire format. If STREAM_COALESCE_MS or STREAM_COALESCE_BYTES
+        are set, the tokens are batched into one frame per interval or size to reduce the number of writes
+        """
+        if coalesce_ms is None:
+            coalesce_ms = float(os.getenv("STREAM_COALESCE_MS", "0"))
+        if coalesce_bytes is None:
+            coalesce_bytes = int(os.getenv("STREAM_COALESCE_BYTES", "0"))
+        if coalesce_ms > 0 or coalesce_bytes > 0:
+            events = coalesce_tokens(events, coalesce_ms / 1000, coalesce_bytes)
+        async for event in events:
+            yield event.encode()
+
+    @staticmethod
+    def get_sources_event(response: StreamingAgentChatResponse) -> SourcesEvent:
+        return SourcesEvent(
+            {
+                "nodes": [
+                    SourceNodes.from_source_node(node).model_dump()
+                    for node in response.source_nodes
+                ]
+            }
+        )
+
+    @staticmethod
+    async def replay_generator(entry: SemanticCacheEntry) -> AsyncIterator[StreamEvent]:
+        """
+        Replay a cached answer with the same events as a generated one
+        """
+        yield TokenEvent("")
+        yield TokenEvent(entry.answer)
+        if entry.suggested_questions:
+            yield SuggestionsEvent(entry.suggested_questions)
+        yield SourcesEvent(entry.sources)
 
     @classmethod
     async def content_generator(
@@ -50,51 +110,66 @@ class VercelStreamResponse(StreamingResponse):
         event_handler: EventCallbackHandler,
         response: StreamingAgentChatResponse,
         chat_data: ChatData,
-    ):
+        suggestions_mode: str = "inline",
+        watcher: Optional[DisconnectWatcher] = None,
+    ) -> AsyncIterator[StreamEvent]:
         # Yield the text response
         async def _chat_response_generator():
-            final_response = ""
+            if suggestions_mode != "inline":
+                # The sources are retrieved before the answer is generated,
+                # so they don't need to wait for the end of the stream
+                yield cls.get_sources_event(response)
+
+            tokens = []
             async for token in response.async_response_gen():
-                final_response += token
-                yield VercelStreamResponse.convert_text(token)
+                tokens.append(token)
+                yield TokenEvent(token)
+
+            if suggestions_mode == "deferred" or (
+                watcher is not None and watcher.disconnected
+            ):
+                # The suggestions are generated in the background after the stream ends,
+                # or not at all if the client is gone
+                event_handler.is_done = True
+                return
 
             # Generate questions that user might interested to
             conversation = chat_data.messages + [
-                Message(role="assistant", content=final_response)
+                Message(role="assistant", content="".join(tokens))
             ]
-            questions = await NextQuestionSuggestion.suggest_next_questions(
-                conversation
-            )
-            if len(questions) > 0:
-                yield VercelStreamResponse.convert_data(
-                    {
-                        "type": "suggested_questions",
-                        "data": questions,
-                    }
+            suggestion = NextQuestionSuggestion.suggest_next_questions(conversation)
+            if suggestions_mode == "concurrent":
+                # Let the event stream finish while the suggestions are generated
+                event_handler.is_done = True
+                suggestion = asyncio.wait_for(
+                    suggestion, timeout=NextQuestionSuggestion.get_timeout()
+                )
+            try:
+                questions = await (
+                    watcher.run(suggestion) if watcher is not None else suggestion
                 )
+            except asyncio.TimeoutError:
+                logger.warning("Next question suggestion timed out")
+                questions = []
+            except asyncio.CancelledError:
+                if watcher is None or not watcher.disconnected:
+                    raise
+                metrics.incr("chat.cancelled_followups")
+                questions = []
+            if len(questions) > 0:
+                yield SuggestionsEvent(questions)
 
-            # the text_generator is the leading stream, once it's finished, also finish the event stream
-            event_handler.is_done = True
-
-            # Yield the source nodes
-            yield cls.convert_data(
-                {
-                    "type": "sources",
-                    "data": {
-                        "nodes": [
-                            SourceNodes.from_source_node(node).model_dump()
-                            for node in response.source_nodes
-                        ]
-                    },
-                }
-            )
+            if suggestions_mode == "inline":
+                # the text_generator is the leading stream, once it's finished, also finish the event stream
+                event_handler.is_done = True
+
+                # Yield the source nodes
+                yield cls.get_sources_event(response)
 
         # Yield the events from the event handler
         async def _event_generator():
             async for event in event_handler.async_event_gen():
-                event_response = event.to_response()
-                if event_response is not None:
-                    yield VercelStreamResponse.convert_data(event_response)
+                yield event
 
         combine = stream.merge(_chat_response_generator(), _event_generator())
         is_stream_started = False
@@ -103,9 +178,6 @@ class VercelStreamResponse(StreamingResponse):
                 if not is_stream_started:
                     is_stream_started = True
                     # Stream a blank message to start the stream
-                    yield VercelStreamResponse.convert_text("")
+                    yield TokenEvent("")
 
                 yield output
-
-                if await request.is_disconnected():
-                    break
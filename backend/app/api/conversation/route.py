@@ -102,6 +102,26 @@ async def delete_conversation(
         ) from e
 
 
+@conversation_router.get("/{conversation_id}/suggestions")
+async def get_suggested_questions(
+    conversation_id: str, current_user: User = Depends(get_current_user)
+):
+    """
+    Get the suggested next questions of the last answer (used with SUGGESTIONS_MODE=deferred).
+    The status stays "pending" until the suggestions are generated, then becomes "ready",
+    "failed" if the generation failed or "skipped" if the answer was interrupted.
+    """
+    suggestions = await conversation_service.get_suggested_questions(
+        conversation_id, current_user.email
+    )
+    if suggestions is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Conversation {conversation_id} not found for the current user.",
+        )
+    return suggestions
+
+
 class ConversationSummaryUpdate(BaseModel):
     summary: str
 
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Sequence
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import TransformComponent
+from llama_index.core.settings import Settings
+
+from app.ingestion_cache import IngestionCache, get_ingestion_cache
+from app.metrics import metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 6
+MAX_BACKOFF = 60.0
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    HTTP 429 raised by the OpenAI compatible SDKs (status_code) or by httpx/requests (response)
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code == 429
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Bound the concurrent embedding requests, additive increase / multiplicative decrease:
+    a rate limit halves the concurrency and pauses every request for the backoff delay,
+    then the concurrency grows back by one after as many successes as the current limit,
+    up to just below the concurrency that was rate limited.
+    The requests already in flight when the concurrency was halved don't halve it again.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self._ceiling = max_concurrency
+        self._active = 0
+        self._successes = 0
+        self._resume_at = 0.0
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self) -> int:
+        with self._condition:
+            self._condition.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+            generation = self._generation
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return generation
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self.limit < self._ceiling and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+
+    def on_rate_limit(self, generation: int, delay: float):
+        with self._condition:
+            if generation != self._generation:
+                return
+            self._generation += 1
+            self._ceiling = max(1, self.limit - 1)
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+            self._resume_at = time.monotonic() + delay
+
+
+class IngestionCacheStats:
+    """
+    Chunks reused from the ingestion cache and embedded, accumulated over the embedding
+    calls of an ingestion (one call per pipeline run or generate window)
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.chunks = 0
+        self.embedded = 0
+        self._lock = threading.Lock()
+
+    def add(self, hits: int, chunks: int, embedded: int):
+        with self._lock:
+            self.hits += hits
+            self.chunks += chunks
+            self.embedded += embedded
+
+    def log(self):
+        if self.chunks == 0:
+            return
+        logger.info(
+            f"Ingestion cache: {self.hits}/{self.chunks} chunks reused "
+            f"({self.hits / self.chunks:.0%} hit ratio), {self.embedded} embedded"
+        )
+
+
+class ConcurrentEmbedding(BaseEmbedding):
+    """
+    Wrap an embedding model to embed the ingested texts in concurrent batches.
+    The batches run on a thread pool with the synchronous client of the model (the async
+    clients are bound to the event loop of the server), and are retried with an adaptive
+    backoff when the provider rate limits them. The query embeddings are not changed.
+    With a cache, only the chunks that are not in the cache are embedded, the hits are
+    counted in `cache_stats`.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _max_concurrency: int = PrivateAttr()
+    _max_retries: int = PrivateAttr()
+    _cache: Optional[IngestionCache] = PrivateAttr()
+    _chain_key: str = PrivateAttr()
+    _cache_stats: IngestionCacheStats = PrivateAttr()
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        embed_batch_size: Optional[int] = None,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        cache: Optional[IngestionCache] = None,
+        chain_key: str = "",
+        cache_stats: Optional[IngestionCacheStats] = None,
+    ):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_batch_size or embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+        )
+        self._embed_model = embed_model
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_retries = max_retries
+        self._cache = cache
+        self._chain_key = chain_key
+        self._cache_stats = cache_stats or IngestionCacheStats()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ConcurrentEmbedding"
+
+    @property
+    def cache_stats(self) -> IngestionCacheStats:
+        return self._cache_stats
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed_model._get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self._embed_model._aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed_model._get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed_model._get_text_embeddings(texts)
+
+    def _embed_batch(
+        self, limiter: AdaptiveLimiter, texts: List[str]
+    ) -> List[Embedding]:
+        for attempt in range(self._max_retries + 1):
+            with limiter as generation:
+                try:
+                    embeddings = self._embed_model._get_text_embeddings(texts)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self._max_retries:
+                        raise
+                    # Exponential backoff with jitter, unless the provider tells how long
+                    delay = get_retry_after(e) or min(
+                        MAX_BACKOFF, 2**attempt * random.uniform(0.5, 1.0)
+                    )
+                    limiter.on_rate_limit(generation, delay)
+                    metrics.incr("ingestion.embedding_rate_limited")
+                    logger.warning(
+                        f"Embedding rate limited, retrying in {delay:.1f}s "
+                        f"with {limiter.limit} concurrent batches"
+                    )
+                    continue
+                limiter.on_success()
+                metrics.incr("ingestion.embedding_batches")
+                return embeddings
+
+    def _embed_texts(self, texts: List[str]) -> List[Embedding]:
+        batches = [
+            texts[i : i + self.embed_batch_size]
+            for i in range(0, len(texts), self.embed_batch_size)
+        ]
+        if len(batches) <= 1 or self._max_concurrency == 1:
+            limiter = AdaptiveLimiter(1)
+            return [
+                embedding
+                for batch in batches
+                for embedding in self._embed_batch(limiter, batch)
+            ]
+
+        limiter = AdaptiveLimiter(self._max_concurrency)
+        with ThreadPoolExecutor(
+            max_workers=min(self._max_concurrency, len(batches)),
+            thread_name_prefix="embedding",
+        ) as executor:
+            results = executor.map(
+                lambda batch: self._embed_batch(limiter, batch), batches
+            )
+            return [embedding for embeddings in results for embedding in embeddings]
+
+    def _embed_texts_cached(self, texts: List[str]) -> List[Embedding]:
+        keys = [IngestionCache.chunk_key(self._chain_key, text) for text in texts]
+        try:
+            found = self._cache.get_many(list(set(keys)))
+        except Exception as e:
+            logger.warning(f"Ingestion cache lookup failed: {e}")
+            found = {}
+        hits = sum(key in found for key in keys)
+
+        # Identical chunks of the run are embedded once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            computed = dict(zip(missing, self._embed_texts(list(missing.values()))))
+            found.update(computed)
+            try:
+                self._cache.set_many(computed)
+                self._cache.evict()
+            except Exception as e:
+                logger.warning(f"Ingestion cache update failed: {e}")
+
+        metrics.incr("ingestion_cache.hits", hits)
+        metrics.incr("ingestion_cache.misses", len(texts) - hits)
+        self._cache_stats.add(hits, len(texts), len(missing))
+        return [found[key] for key in keys]
+
+    def get_text_embedding_batch(
+        self, texts: List[str], show_progress: bool = False, **kwargs: Any
+    ) -> List[Embedding]:
+        if not texts:
+            return []
+        if self._cache is None:
+            return self._embed_texts(texts)
+        return self._embed_texts_cached(texts)
+
+    async def aget_text_embedding_batch(
+        self, texts: List[str], show_progress: bool = False, **kwargs: Any
+    ) -> List[Embedding]:
+        return await asyncio.to_thread(self.get_text_embedding_batch, texts)
+
+
+def get_ingestion_embed_model(
+    transformations: Sequence[TransformComponent] = (),
+    cache_stats: Optional[IngestionCacheStats] = None,
+) -> ConcurrentEmbedding:
+    """
+    Embedding model of the ingestion pipelines: Settings.embed_model in concurrent batches
+    of EMBED_BATCH_SIZE texts (default: the provider's batch size), with at most
+    EMBED_CONCURRENCY batches in flight.
+    The transformations that run before the embedding are part of the ingestion cache key,
+    pass the same `cache_stats` to the models of one ingestion to log a single summary.
+    """
+    embed_model = Settings.embed_model
+    cache = get_ingestion_cache()
+    chain_key = ""
+    if cache is not None:
+        chain_key = IngestionCache.chain_key(
+            transformations,
+            f"{os.getenv('MODEL_PROVIDER')}:{embed_model.model_name}:"
+            f"{os.getenv('EMBEDDING_DIM')}",
+        )
+    batch_size = os.getenv("EMBED_BATCH_SIZE")
+    return ConcurrentEmbedding(
+        embed_model,
+        embed_batch_size=int(batch_size) if batch_size else None,
+        max_concurrency=int(os.getenv("EMBED_CONCURRENCY", DEFAULT_CONCURRENCY)),
+        max_retries=int(os.getenv("EMBED_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+        cache=cache,
+        chain_key=chain_key,
+        cache_stats=cache_stats,
+    )
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional
+
+from cachetools import LRUCache
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from app.metrics import metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_CACHE_SIZE = 10000
+
+
+class PersistentEmbeddingStore(ABC):
+    """
+    Second tier of the query embedding cache, shared between workers and restarts
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[List[float]]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, embedding: List[float]):
+        ...
+
+
+class SQLiteEmbeddingStore(PersistentEmbeddingStore):
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, embedding TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT embedding FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, embedding: List[float]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                (key, json.dumps(embedding), time.time()),
+            )
+            self._writes += 1
+            # Enforce the size cap from time to time, counting rows on every write is too slow
+            if self._writes % 100 == 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings "
+                    "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+
+class MongoEmbeddingStore(PersistentEmbeddingStore):
+    def __init__(self, max_entries: int):
+        from pymongo import DESCENDING, MongoClient
+
+        self.max_entries = max_entries
+        self._writes = 0
+        client = MongoClient(os.getenv("MONGODB_URI"))
+        self._collection = client[os.getenv("MONGODB_NAME", "RAGSAAS")].embedding_cache
+        self._collection.create_index([("created_at", DESCENDING)])
+
+    def get(self, key: str) -> Optional[List[float]]:
+        document = self._collection.find_one({"_id": key}, {"embedding": 1})
+        return document["embedding"] if document else None
+
+    def set(self, key: str, embedding: List[float]):
+        self._collection.replace_one(
+            {"_id": key},
+            {"_id": key, "embedding": embedding, "created_at": time.time()},
+            upsert=True,
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            oldest = self._collection.find_one(
+                {}, {"created_at": 1}, sort=[("created_at", -1)], skip=self.max_entries
+            )
+            if oldest:
+                self._collection.delete_many(
+                    {"created_at": {"$lte": oldest["created_at"]}}
+                )
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wrap an embedding model to cache the query embeddings.
+    The condensed questions (and the conversation starters) are often the same,
+    so they are looked up in an in-process LRU cache, then in an optional persistent store,
+    before calling the embedding model. The text embeddings (ingestion) are not cached.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _namespace: str = PrivateAttr()
+    _cache: LRUCache = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _store: Optional[PersistentEmbeddingStore] = PrivateAttr()
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        dimension: Optional[int] = None,
+        max_entries: int = DEFAULT_CACHE_SIZE,
+        store: Optional[PersistentEmbeddingStore] = None,
+    ):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+        )
+        self._embed_model = embed_model
+        self._namespace = (
+            f"{embed_model.class_name()}:{embed_model.model_name}:{dimension}"
+        )
+        self._cache = LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+        self._store = store
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(unicodedata.normalize("NFKC", text).split())
+
+    def cache_key(self, query: str) -> str:
+        return hashlib.sha256(
+            f"{self._namespace}\n{self.normalize(query)}".encode()
+        ).hexdigest()
+
+    def _lookup_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def _remember(self, key: str, embedding: List[float]):
+        with self._lock:
+            self._cache[key] = embedding
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        key = self.cache_key(query)
+        embedding = self._lookup_memory(key)
+        if embedding is None and self._store is not None:
+            embedding = self._store.get(key)
+            if embedding is not None:
+                metrics.incr("embedding_cache.persistent_hits")
+                self._remember(key, embedding)
+        if embedding is not None:
+            metrics.incr("embedding_cache.hits")
+            return embedding
+
+        metrics.incr("embedding_cache.misses")
+        embedding = self._embed_model._get_query_embedding(query)
+        self._remember(key, embedding)
+        if self._store is not None:
+            self._store.set(key, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        key = self.cache_key(query)
+        embedding = self._lookup_memory(key)
+        if embedding is None and self._store is not None:
+            embedding = await asyncio.to_thread(self._store.get, key)
+            if embedding is not None:
+                metrics.incr("embedding_cache.persistent_hits")
+                self._remember(key, embedding)
+        if embedding is not None:
+            metrics.incr("embedding_cache.hits")
+            return embedding
+
+        metrics.incr("embedding_cache.misses")
+        embedding = await self._embed_model._aget_query_embedding(query)
+        self._remember(key, embedding)
+        if self._store is not None:
+            await asyncio.to_thread(self._store.set, key, embedding)
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed_model._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self._embed_model._aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed_model._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._embed_model._aget_text_embeddings(texts)
+
+
+def with_embedding_cache(embed_model: BaseEmbedding) -> BaseEmbedding:
+    """
+    Wrap the embedding model with the query cache if EMBEDDING_CACHE is set
+    to "memory", "sqlite" or "mongo"
+    """
+    cache_type = os.getenv("EMBEDDING_CACHE", "").lower()
+    if not cache_type or cache_type == "none":
+        return embed_model
+
+    max_entries = int(os.getenv("EMBEDDING_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    persistent_max_entries = int(
+        os.getenv("EMBEDDING_CACHE_PERSISTENT_SIZE", max_entries * 10)
+    )
+    match cache_type:
+        case "memory":
+            store = None
+        case "sqlite":
+            path = os.getenv("EMBEDDING_CACHE_PATH", "storage/embedding_cache.db")
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            store = SQLiteEmbeddingStore(path, persistent_max_entries)
+        case "mongo":
+            store = MongoEmbeddingStore(persistent_max_entries)
+        case _:
+            raise ValueError(f"Invalid embedding cache: {cache_type}")
+
+    dimension = os.getenv("EMBEDDING_DIM")
+    logger.info(f"Caching the query embeddings ({cache_type})")
+    return CachedEmbedding(
+        embed_model,
+        dimension=int(dimension) if dimension else None,
+        max_entries=max_entries,
+        store=store,
+    )
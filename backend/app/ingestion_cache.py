@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence
+
+from llama_index.core.ingestion.pipeline import remove_unstable_values
+from llama_index.core.schema import TransformComponent
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_CACHE_SIZE = 1_000_000
+DEFAULT_MAX_AGE_DAYS = 30
+
+
+class IngestionCache(ABC):
+    """
+    Persistent cache of the chunk embeddings computed by the ingestion pipelines,
+    keyed by the transformation chain and the chunk text: the chunks of a re-ingested
+    document that are byte-identical reuse their embeddings.
+    The entries older than max_age seconds, and the oldest entries over max_entries,
+    are evicted after every run.
+    """
+
+    def __init__(self, max_entries: int, max_age: float):
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    @staticmethod
+    def chain_key(transformations: Sequence[TransformComponent], namespace: str) -> str:
+        """
+        Key of the transformations before the embedding (e.g. the splitter settings)
+        and of the embedding model
+        """
+        chain = "".join(
+            remove_unstable_values(str(transformation.to_dict()))
+            for transformation in transformations
+        )
+        return hashlib.sha256(f"{chain}\n{namespace}".encode()).hexdigest()
+
+    @staticmethod
+    def chunk_key(chain_key: str, text: str) -> str:
+        return hashlib.sha256(f"{chain_key}\n{text}".encode()).hexdigest()
+
+    @abstractmethod
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        ...
+
+    @abstractmethod
+    def set_many(self, embeddings: Dict[str, List[float]]):
+        ...
+
+    @abstractmethod
+    def evict(self):
+        ...
+
+
+class SQLiteIngestionCache(IngestionCache):
+    # Stay below the SQLite limit of variables per statement
+    QUERY_BATCH_SIZE = 500
+
+    def __init__(self, path: str, max_entries: int, max_age: float):
+        super().__init__(max_entries, max_age)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingestion_cache "
+            "(key TEXT PRIMARY KEY, embedding TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ingestion_cache_created_at "
+            "ON ingestion_cache (created_at)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.QUERY_BATCH_SIZE):
+                batch = keys[i : i + self.QUERY_BATCH_SIZE]
+                rows = self._conn.execute(
+                    "SELECT key, embedding FROM ingestion_cache WHERE key IN "
+                    f"({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update((key, json.loads(embedding)) for key, embedding in rows)
+        return found
+
+    def set_many(self, embeddings: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ingestion_cache VALUES (?, ?, ?)",
+                [
+                    (key, json.dumps(embedding), now)
+                    for key, embedding in embeddings.items()
+                ],
+            )
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM ingestion_cache WHERE created_at < ?",
+                (time.time() - self.max_age,),
+            )
+            self._conn.execute(
+                "DELETE FROM ingestion_cache WHERE key IN (SELECT key FROM ingestion_cache "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+class MongoIngestionCache(IngestionCache):
+    def __init__(self, max_entries: int, max_age: float):
+        from pymongo import DESCENDING, MongoClient
+
+        super().__init__(max_entries, max_age)
+        client = MongoClient(os.getenv("MONGODB_URI"))
+        self._collection = client[os.getenv("MONGODB_NAME", "RAGSAAS")].ingestion_cache
+        self._collection.create_index([("created_at", DESCENDING)])
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        return {
+            document["_id"]: document["embedding"]
+            for document in self._collection.find(
+                {"_id": {"$in": keys}}, {"embedding": 1}
+            )
+        }
+
+    def set_many(self, embeddings: Dict[str, List[float]]):
+        from pymongo import ReplaceOne
+
+        if not embeddings:
+            return
+        now = time.time()
+        self._collection.bulk_write(
+            [
+                ReplaceOne(
+                    {"_id": key},
+                    {"_id": key, "embedding": embedding, "created_at": now},
+                    upsert=True,
+                )
+                for key, embedding in embeddings.items()
+            ],
+            ordered=False,
+        )
+
+    def evict(self):
+        self._collection.delete_many(
+            {"created_at": {"$lt": time.time() - self.max_age}}
+        )
+        oldest = self._collection.find_one(
+            {}, {"created_at": 1}, sort=[("created_at", -1)], skip=self.max_entries
+        )
+        if oldest:
+            self._collection.delete_many({"created_at": {"$lte": oldest["created_at"]}})
+
+
+_cache: Optional[IngestionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_ingestion_cache() -> Optional[IngestionCache]:
+    """
+    The cache set by INGESTION_CACHE ("sqlite" or "mongo"), None if it's disabled
+    """
+    global _cache
+    cache_type = os.getenv("INGESTION_CACHE", "").lower()
+    if not cache_type or cache_type == "none":
+        return None
+
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+        max_entries = int(os.getenv("INGESTION_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+        max_age = (
+            float(os.getenv("INGESTION_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS))
+            * 86400
+        )
+        match cache_type:
+            case "sqlite":
+                path = os.getenv("INGESTION_CACHE_PATH", "storage/ingestion_cache.db")
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                _cache = SQLiteIngestionCache(path, max_entries, max_age)
+            case "mongo":
+                _cache = MongoIngestionCache(max_entries, max_age)
+            case _:
+                raise ValueError(f"Invalid ingestion cache: {cache_type}")
+        logger.info(f"Caching the ingested chunk embeddings ({cache_type})")
+        return _cache
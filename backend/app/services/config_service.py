@@ -1,31 +1,81 @@
+import asyncio
+import logging
+import os
+import time
 from typing import List, Dict, Any, Optional
+from pymongo.errors import OperationFailure, PyMongoError
 from app.db import async_mongodb
 from app.api.chat.models import ChatConfig
 
+logger = logging.getLogger("uvicorn")
+
 
 class ConfigService:
+    """
+    Access to the app config (system prompt, conversation starters).
+    Reads are served from an in-memory snapshot that is refreshed after
+    CONFIG_CACHE_TTL seconds, on every write of this process and, when
+    CONFIG_CHANGE_STREAM is enabled, on every change made by another worker.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._watcher: Optional[asyncio.Task] = None
+
     @property
     def config_collection(self):
         return async_mongodb.db.config
 
+    @property
+    def cache_ttl(self) -> float:
+        return float(os.getenv("CONFIG_CACHE_TTL", "60"))
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._snapshot is not None
+            and time.monotonic() - self._loaded_at < self.cache_ttl
+        )
+
+    async def get_snapshot(self) -> Dict[str, Any]:
+        if self._is_fresh():
+            return self._snapshot
+        async with self._lock:
+            # The snapshot might have been reloaded while waiting for the lock
+            if not self._is_fresh():
+                config = await self.config_collection.find_one({"_id": "app_config"})
+                self._snapshot = config or {}
+                self._loaded_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    @staticmethod
+    def _get_system_prompt(config: Dict[str, Any]) -> str:
+        # An empty prompt set in the DB is kept, the env value is only the default
+        system_prompt = config.get("SYSTEM_PROMPT")
+        if system_prompt is None:
+            return os.getenv("SYSTEM_PROMPT", "")
+        return system_prompt
+
     async def get_chat_config(self) -> ChatConfig:
-        config = await self.config_collection.find_one({"_id": "app_config"})
-        if config:
-            return ChatConfig(
-                system_prompt=config.get("SYSTEM_PROMPT", ""),
-                starter_questions=config.get("CONVERSATION_STARTERS", []),
-            )
-        return ChatConfig(system_prompt="", starter_questions=[])
+        config = await self.get_snapshot()
+        return ChatConfig(
+            system_prompt=self._get_system_prompt(config),
+            starter_questions=config.get("CONVERSATION_STARTERS", []),
+        )
 
     async def update_chat_config(self, updated_data: Dict[str, Any]) -> bool:
         result = await self.config_collection.update_one(
             {"_id": "app_config"}, {"$set": updated_data}, upsert=True
         )
+        self.invalidate()
         return result.modified_count > 0 or result.upserted_id is not None
 
     async def get_system_prompt(self) -> str:
-        config = await self.config_collection.find_one({"_id": "app_config"})
-        return config.get("SYSTEM_PROMPT", "") if config else ""
+        return self._get_system_prompt(await self.get_snapshot())
 
     async def update_system_prompt(self, new_prompt: str) -> bool:
         return await self.update_chat_config({"SYSTEM_PROMPT": new_prompt})
@@ -33,5 +83,43 @@ class ConfigService:
     async def update_conversation_starters(self, new_starters: List[str]) -> bool:
         return await self.update_chat_config({"CONVERSATION_STARTERS": new_starters})
 
+    async def _watch_changes(self):
+        retry_delay = 1
+        while True:
+            try:
+                async with self.config_collection.watch(
+                    [{"$match": {"documentKey._id": "app_config"}}]
+                ) as change_stream:
+                    logger.info("Watching app config changes")
+                    retry_delay = 1
+                    async for _ in change_stream:
+                        self.invalidate()
+            except OperationFailure as e:
+                # Change streams are only available on replica sets and sharded clusters
+                logger.warning(f"Config change stream is not supported: {e}")
+                return
+            except PyMongoError as e:
+                logger.warning(
+                    f"Config change stream failed: {e}, retrying in {retry_delay}s"
+                )
+                self.invalidate()
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+
+    def start_watcher(self):
+        if os.getenv("CONFIG_CHANGE_STREAM", "false").lower() != "true":
+            return
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_changes())
+
+    async def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
 
 config_service = ConfigService()
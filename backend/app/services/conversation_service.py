@@ -42,10 +42,11 @@ class ConversationService:
         new_message: Dict[str, Any],
         summary: Optional[str] = None,
         user_id: Optional[str] = None,
+        extra_fields: Optional[Dict[str, Any]] = None,
     ) -> None:
         update_fields = {
             "$push": {"messages": new_message},
-            "$set": {"updated_at": datetime.utcnow()},
+            "$set": {"updated_at": datetime.utcnow(), **(extra_fields or {})},
         }
 
         if summary:
@@ -138,6 +139,51 @@ class ConversationService:
         )
         return result.matched_count
 
+    async def claim_title_generation(self, conversation_id: str) -> bool:
+        """
+        Atomically mark the title of a new conversation as being generated.
+        Returns False if another request or worker already claimed it.
+        """
+        result = await self.conversation_collection.update_one(
+            {
+                "_id": ObjectId(conversation_id),
+                "summary": "New Chat",
+                "title_status": {"$exists": False},
+            },
+            {"$set": {"title_status": "pending"}},
+        )
+        return result.modified_count == 1
+
+    async def release_title_generation(self, conversation_id: str) -> None:
+        await self.conversation_collection.update_one(
+            {"_id": ObjectId(conversation_id)}, {"$unset": {"title_status": ""}}
+        )
+
+    async def set_suggested_questions(
+        self, conversation_id: str, questions: List[str], status: str = "ready"
+    ) -> None:
+        await self.conversation_collection.update_one(
+            {"_id": ObjectId(conversation_id)},
+            {
+                "$set": {
+                    "suggested_questions": {"status": status, "questions": questions}
+                }
+            },
+        )
+
+    async def get_suggested_questions(
+        self, conversation_id: str, user_id: str
+    ) -> Optional[Dict[str, Any]]:
+        conversation = await self.conversation_collection.find_one(
+            {"_id": ObjectId(conversation_id), "user_id": user_id},
+            {"suggested_questions": 1},
+        )
+        if conversation is None:
+            return None
+        return conversation.get(
+            "suggested_questions", {"status": "ready", "questions": []}
+        )
+
     async def get_sharable_conversation(
         self,
         conversation_id: str,
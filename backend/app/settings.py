@@ -3,6 +3,8 @@ from typing import Dict
 
 from llama_index.core.settings import Settings
 
+from app.embedding_cache import with_embedding_cache
+
 
 def init_settings():
     model_provider = os.getenv("MODEL_PROVIDER")
@@ -28,6 +30,9 @@ def init_settings():
         case _:
             raise ValueError(f"Invalid model provider: {model_provider}")
 
+    # Opt-in cache of the query embeddings, works with any of the providers above
+    Settings.embed_model = with_embedding_cache(Settings.embed_model)
+
     Settings.chunk_size = int(os.getenv("CHUNK_SIZE", "1024"))
     Settings.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "20"))
 
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger("uvicorn")
+
+T = TypeVar("T")
+
+
+class BackgroundTaskQueue:
+    """
+    Run coroutines in the background of the request path with bounded concurrency.
+    A task submitted with the key of a task that is still running is deduplicated,
+    failing tasks are retried with an exponential backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 4,
+        max_retries: int = 2,
+        retry_delay: float = 1.0,
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def get(self, key: str) -> Optional[asyncio.Task]:
+        task = self._tasks.get(key)
+        return task if task is not None and not task.done() else None
+
+    def submit(
+        self,
+        key: str,
+        coro_fn: Callable[[], Awaitable[T]],
+        on_failure: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> asyncio.Task:
+        """
+        Queue `coro_fn` to run in the background, `on_failure` is awaited once all retries failed
+        or if the task is cancelled
+        """
+        task = self.get(key)
+        if task is not None:
+            return task
+        task = asyncio.create_task(self._run(key, coro_fn, on_failure))
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._on_done(key, t))
+        return task
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"[{self.name}] Task {key} failed: {task.exception()}")
+
+    async def _run(
+        self,
+        key: str,
+        coro_fn: Callable[[], Awaitable[T]],
+        on_failure: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> T:
+        succeeded = False
+        try:
+            async with self._semaphore:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        result = await coro_fn()
+                        succeeded = True
+                        return result
+                    except Exception as e:
+                        if attempt == self.max_retries:
+                            raise
+                        delay = self.retry_delay * 2**attempt
+                        logger.warning(
+                            f"[{self.name}] Task {key} failed: {e}, retrying in {delay}s"
+                        )
+                        await asyncio.sleep(delay)
+        finally:
+            # Also on a cancellation (shutdown), so that the task can be picked up again
+            if not succeeded and on_failure is not None:
+                try:
+                    await on_failure()
+                except Exception as e:
+                    logger.error(f"[{self.name}] Cleanup of task {key} failed: {e}")
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,161 @@
+"""
+Measure the per-request setup time of the chat engine, original path vs cached engine.
+
+    poetry run python -m benchmarks.chat_engine_setup --iterations 200
+
+Runs against an in-memory Qdrant (or a Qdrant server with --qdrant-url) holding a small
+ingested corpus, with the app config stubbed in memory (no MongoDB needed).
+--config-latency-ms simulates the round trip to MongoDB of the config reads.
+
+- before: the original `get_chat_engine`, a blocking read of the app config,
+  new Qdrant clients and a new index on every request
+- after: the system prompt from the config snapshot and the cached index of the factory
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from unittest import mock
+
+from benchmarks.common import get_fake_embed_model, print_table, summarize, timer
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+class StubConfigCollection:
+    """
+    The `config` collection with the app config, for the sync and the async Mongo clients
+    """
+
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+        self.document = {"_id": "app_config", "SYSTEM_PROMPT": SYSTEM_PROMPT}
+
+    def find_one(self, query):
+        time.sleep(self.latency_s)
+        return self.document if query.get("_id") == "app_config" else None
+
+    async def afind_one(self, query):
+        await asyncio.sleep(self.latency_s)
+        return self.document if query.get("_id") == "app_config" else None
+
+
+class AsyncStubConfigCollection:
+    def __init__(self, collection: StubConfigCollection):
+        self.find_one = collection.afind_one
+
+
+def setup(qdrant_url: str, collection: str, n_docs: int):
+    from llama_index.core.llms import MockLLM
+    from llama_index.core.schema import Document
+    from llama_index.core.settings import Settings
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+
+    from app.api.chat.engine.generate import run_pipeline
+    from app.api.chat.engine.vectordb import get_vector_store
+
+    os.environ["QDRANT_URL"] = qdrant_url
+    os.environ["QDRANT_COLLECTION"] = collection
+    # No poller, the ingestion version stays the one of this process
+    os.environ["INGESTION_VERSION_POLL_INTERVAL"] = "0"
+    Settings.llm = MockLLM()
+    Settings.embed_model = get_fake_embed_model(64)
+
+    documents = [
+        Document(
+            id_=f"doc-{i}", text=f"document {i} " * 50, metadata={"private": "false"}
+        )
+        for i in range(n_docs)
+    ]
+    with mock.patch("app.api.chat.engine.generate.bump_ingestion_version", lambda: 0):
+        run_pipeline(SimpleDocumentStore(), get_vector_store(), documents)
+
+
+def original_get_chat_engine(config_collection):
+    """
+    get_chat_engine before the engine cache, the clients are closed outside of the timing
+    """
+    import qdrant_client
+    from llama_index.core.chat_engine import CondensePlusContextChatEngine
+    from llama_index.core.indices import VectorStoreIndex
+    from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+    config = config_collection.find_one({"_id": "app_config"})
+    system_prompt = None
+    if config and "SYSTEM_PROMPT" in config:
+        system_prompt = config["SYSTEM_PROMPT"]
+    if system_prompt is None:
+        system_prompt = os.getenv("SYSTEM_PROMPT", "")
+
+    url = os.getenv("QDRANT_URL")
+    if url == ":memory:":
+        # The original clients of an in-memory Qdrant, each one with its own empty storage
+        client = qdrant_client.QdrantClient(location=url)
+        aclient = qdrant_client.AsyncQdrantClient(location=url)
+    else:
+        api_key = os.getenv("QDRANT_API_KEY")
+        client = qdrant_client.QdrantClient(url=url, api_key=api_key)
+        aclient = qdrant_client.AsyncQdrantClient(url=url, api_key=api_key)
+    store = QdrantVectorStore(
+        client=client,
+        aclient=aclient,
+        collection_name=os.getenv("QDRANT_COLLECTION", "ragsaas"),
+    )
+    index = VectorStoreIndex.from_vector_store(store)
+    retriever = index.as_retriever()
+    chat_engine = CondensePlusContextChatEngine.from_defaults(
+        system_prompt=system_prompt, retriever=retriever
+    )
+    return chat_engine, (client, aclient)
+
+
+async def run(iterations: int, config_collection: StubConfigCollection):
+    from app.api.chat.engine.engine import chat_engine_factory
+    from app.services.config_service import ConfigService, config_service
+
+    before = []
+    for _ in range(iterations):
+        with timer(before):
+            _, (client, aclient) = original_get_chat_engine(config_collection)
+        client.close()
+        await aclient.close()
+
+    async def get_chat_engine():
+        system_prompt = await config_service.get_system_prompt()
+        return chat_engine_factory.get_chat_engine(system_prompt=system_prompt)
+
+    with mock.patch.object(
+        ConfigService,
+        "config_collection",
+        AsyncStubConfigCollection(config_collection),
+    ):
+        await get_chat_engine()  # warm up
+        after = []
+        for _ in range(iterations):
+            with timer(after):
+                await get_chat_engine()
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--config-latency-ms", type=float, default=0.0)
+    parser.add_argument("--qdrant-url", default=":memory:")
+    args = parser.parse_args()
+
+    setup(args.qdrant_url, "bench-chat-engine-setup", args.docs)
+    config_collection = StubConfigCollection(args.config_latency_ms / 1000)
+    before, after = asyncio.run(run(args.iterations, config_collection))
+    print_table(
+        [
+            {"mode": "before (original path)", **summarize(before)},
+            {"mode": "after (cached)", **summarize(after)},
+        ]
+    )
+
+
+if __name__ == "__main__":
+    main()
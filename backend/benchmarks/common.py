@@ -0,0 +1,93 @@
+import statistics
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples (in seconds) as milliseconds
+    """
+    return {
+        "n": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+    }
+
+
+@contextmanager
+def timer(samples: List[float]):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.append(time.perf_counter() - start)
+
+
+def print_table(rows: List[Dict], columns: Sequence[str] | None = None):
+    if not rows:
+        return
+    columns = list(columns or rows[0].keys())
+
+    def fmt(value):
+        return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    widths = {
+        col: max(len(col), *(len(fmt(row.get(col, ""))) for row in rows))
+        for col in columns
+    }
+    print(" | ".join(col.ljust(widths[col]) for col in columns))
+    print("-+-".join("-" * widths[col] for col in columns))
+    for row in rows:
+        print(" | ".join(fmt(row.get(col, "")).ljust(widths[col]) for col in columns))
+
+
+def get_fake_embed_model(dim: int = 256, latency: float = 0.0):
+    """
+    Deterministic hashed bag-of-words embedding model, no provider calls.
+    `latency` (seconds) is added to every call, a batch of texts counts as one call.
+    """
+    import asyncio
+    import re
+    import zlib
+
+    from llama_index.core.embeddings import BaseEmbedding
+
+    def embed(text: str) -> List[float]:
+        vector = [0.0] * dim
+        for word in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(word.encode()) % dim] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    class HashingEmbedding(BaseEmbedding):
+        def _get_query_embedding(self, query: str) -> List[float]:
+            time.sleep(latency)
+            return embed(query)
+
+        async def _aget_query_embedding(self, query: str) -> List[float]:
+            await asyncio.sleep(latency)
+            return embed(query)
+
+        def _get_text_embedding(self, text: str) -> List[float]:
+            time.sleep(latency)
+            return embed(text)
+
+        def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+            time.sleep(latency)
+            return [embed(text) for text in texts]
+
+        async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+            await asyncio.sleep(latency)
+            return [embed(text) for text in texts]
+
+    return HashingEmbedding(model_name=f"hashing-{dim}")
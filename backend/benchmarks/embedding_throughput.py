@@ -0,0 +1,128 @@
+"""
+Embedding throughput (chunks/s) of the ingestion pipelines, sequential vs concurrent batches.
+
+    poetry run python -m benchmarks.embedding_throughput --latency 0.2 --concurrency 1 4 8
+
+The chunks of a synthetic corpus are embedded by a fake model, every request (batch) takes
+`--latency` seconds. `--provider-limit` simulates a provider rate limit: a request over this
+many concurrent requests fails with HTTP 429 and is retried with the adaptive backoff.
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from benchmarks.common import get_fake_embed_model, print_table
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def get_rate_limited_model(embed_model, provider_limit: int):
+    from typing import List
+
+    from llama_index.core.embeddings import BaseEmbedding
+
+    lock = threading.Lock()
+    state = {"in_flight": 0, "rejected": 0}
+
+    class RateLimitedEmbedding(BaseEmbedding):
+        def _get_query_embedding(self, query: str) -> List[float]:
+            return embed_model._get_query_embedding(query)
+
+        async def _aget_query_embedding(self, query: str) -> List[float]:
+            return await embed_model._aget_query_embedding(query)
+
+        def _get_text_embedding(self, text: str) -> List[float]:
+            return embed_model._get_text_embedding(text)
+
+        def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+            with lock:
+                if provider_limit and state["in_flight"] >= provider_limit:
+                    state["rejected"] += 1
+                    raise RateLimitError("Too many requests")
+                state["in_flight"] += 1
+            try:
+                return embed_model._get_text_embeddings(texts)
+            finally:
+                with lock:
+                    state["in_flight"] -= 1
+
+    return RateLimitedEmbedding(model_name="rate-limited"), state
+
+
+def make_nodes(n_docs: int, words: int, chunk_size: int, seed: int):
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.schema import Document
+
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    documents = [
+        Document(text=" ".join(rng.choices(vocabulary, k=words))) for _ in range(n_docs)
+    ]
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_size // 10)
+    return splitter(documents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--words", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--provider-limit", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from app.concurrent_embedding import ConcurrentEmbedding
+
+    nodes = make_nodes(args.docs, args.words, args.chunk_size, args.seed)
+    print(f"{len(nodes)} chunks, {args.latency * 1000:.0f}ms per request")
+
+    rows = []
+    for batch_size in args.batch_size:
+        configs = [("sequential", None)] + [
+            (f"concurrent x{concurrency}", concurrency)
+            for concurrency in args.concurrency
+        ]
+        for name, concurrency in configs:
+            provider, state = get_rate_limited_model(
+                get_fake_embed_model(64, latency=args.latency), args.provider_limit
+            )
+            provider.embed_batch_size = batch_size
+            if concurrency is None:
+                # The model as the pipelines used it before: batches one after another
+                embed_model = provider
+            else:
+                embed_model = ConcurrentEmbedding(
+                    provider,
+                    max_concurrency=concurrency,
+                    # Keep retrying, the benchmark measures the throughput under the limit
+                    max_retries=100,
+                )
+            start = time.perf_counter()
+            try:
+                embed_model(nodes)
+                elapsed = time.perf_counter() - start
+                throughput = len(nodes) / elapsed
+            except RateLimitError:
+                elapsed, throughput = time.perf_counter() - start, 0.0
+            rows.append(
+                {
+                    "batch_size": batch_size,
+                    "mode": name,
+                    "seconds": elapsed,
+                    "chunks_per_s": throughput,
+                    "http_429": state["rejected"],
+                }
+            )
+
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare the event-loop wakeups and CPU time of the chat event channel with the
+previous implementation that polled the queue every 100 ms.
+
+    poetry run python -m benchmarks.event_stream --streams 500 --duration 2
+
+Every stream emits a few callback events while its answer is "generated"
+(simulated with sleeps), then marks the handler as done.
+"""
+
+import argparse
+import asyncio
+import time
+
+from llama_index.core.callbacks.schema import CBEventType
+
+from benchmarks.common import print_table
+from app.api.chat.events import EventCallbackHandler
+
+
+class LegacyEventCallbackHandler:
+    """
+    The previous implementation: poll the queue every 100 ms until done
+    """
+
+    def __init__(self):
+        self._aqueue = asyncio.Queue()
+        self.is_done = False
+
+    def on_event_end(self, event_type, payload=None, event_id=""):
+        self._aqueue.put_nowait((event_type, payload))
+
+    async def async_event_gen(self):
+        while not self._aqueue.empty() or not self.is_done:
+            try:
+                yield await asyncio.wait_for(self._aqueue.get(), timeout=0.1)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def run_stream(handler, duration: float, events: int):
+    async def produce():
+        for _ in range(events):
+            await asyncio.sleep(duration / events)
+            handler.on_event_end(CBEventType.RETRIEVE, payload={"nodes": [1, 2]})
+        handler.is_done = True
+
+    async def consume():
+        received = 0
+        async for _ in handler.async_event_gen():
+            received += 1
+        return received
+
+    _, received = await asyncio.gather(produce(), consume())
+    return received
+
+
+async def run(handler_cls, streams: int, duration: float, events: int):
+    loop = asyncio.get_running_loop()
+    wakeups = 0
+    run_once = loop._run_once
+
+    def counting_run_once():
+        nonlocal wakeups
+        wakeups += 1
+        run_once()
+
+    loop._run_once = counting_run_once
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    received = await asyncio.gather(
+        *(run_stream(handler_cls(), duration, events) for _ in range(streams))
+    )
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    loop._run_once = run_once
+    return {
+        "events": sum(received),
+        "loop_wakeups": wakeups,
+        "cpu_s": cpu,
+        "wall_s": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--events", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for name, handler_cls in (
+        ("legacy (100 ms polling)", LegacyEventCallbackHandler),
+        ("channel (sentinel)", EventCallbackHandler),
+    ):
+        result = asyncio.run(run(handler_cls, args.streams, args.duration, args.events))
+        rows.append({"handler": name, **result})
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
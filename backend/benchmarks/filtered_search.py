@@ -0,0 +1,150 @@
+"""
+Measure the latency of the filtered searches of the chat (public + selected private documents)
+before and after creating the payload indexes on the filter fields.
+
+    poetry run python -m benchmarks.filtered_search --points 1000000
+
+Requires a Qdrant server (payload indexes have no effect in the in-memory Qdrant),
+QDRANT_URL defaults to http://localhost:6333, e.g. started with:
+
+    docker run -p 6333:6333 qdrant/qdrant
+
+The points get random vectors and the payload written by the ingestion: most of them are
+public, the others belong to private documents of many users.
+The benchmark collection is dropped at the end unless --keep is set.
+"""
+
+import argparse
+import os
+import random
+import time
+import uuid
+
+from benchmarks.common import print_table, summarize, timer
+
+
+def make_payload(i: int, rng: random.Random, private_ratio: float, n_docs: int):
+    private = rng.random() < private_ratio
+    doc_id = f"doc-{rng.randrange(n_docs)}"
+    return {
+        "text": f"chunk {i}",
+        "private": "true" if private else "false",
+        "doc_id": doc_id,
+        "file_id": f"{doc_id}.pdf",
+        "user_id": f"user-{rng.randrange(n_docs // 10 or 1)}" if private else "admin",
+    }
+
+
+def populate(client, collection: str, args):
+    import numpy as np
+    from qdrant_client.http import models as rest
+
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+    client.create_collection(
+        collection_name=collection,
+        vectors_config=rest.VectorParams(size=args.dim, distance=rest.Distance.COSINE),
+    )
+
+    rng = random.Random(args.seed)
+    np_rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+    for offset in range(0, args.points, args.batch_size):
+        size = min(args.batch_size, args.points - offset)
+        client.upload_points(
+            collection_name=collection,
+            points=[
+                rest.PointStruct(
+                    id=str(uuid.UUID(int=offset + i + 1)),
+                    vector=vector.tolist(),
+                    payload=make_payload(
+                        offset + i, rng, args.private_ratio, args.docs
+                    ),
+                )
+                for i, vector in enumerate(
+                    np_rng.standard_normal((size, args.dim), dtype="float32")
+                )
+            ],
+            wait=True,
+        )
+    print(f"Uploaded {args.points} points in {time.perf_counter() - start:.1f}s")
+
+
+def wait_for_indexing(client, collection: str, timeout: float = 3600):
+    from qdrant_client.http import models as rest
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if client.get_collection(collection).status == rest.CollectionStatus.GREEN:
+            return
+        time.sleep(1)
+
+
+def run_queries(store, args, doc_ids):
+    from llama_index.core.vector_stores.types import VectorStoreQuery
+
+    from app.api.chat.engine.query_filter import generate_filters
+
+    rng = random.Random(args.seed + 1)
+    rows = []
+    shapes = {"public only": [], "public + selected docs": doc_ids}
+    for shape, selected in shapes.items():
+        filters = generate_filters(selected)
+        samples = []
+        for _ in range(args.queries):
+            query = VectorStoreQuery(
+                query_embedding=[rng.gauss(0, 1) for _ in range(args.dim)],
+                similarity_top_k=args.top_k,
+                filters=filters,
+            )
+            with timer(samples):
+                store.query(query)
+        rows.append({"filter": shape, **summarize(samples)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--docs", type=int, default=10_000)
+    parser.add_argument("--private-ratio", type=float, default=0.8)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--collection", default="bench-filtered-search")
+    parser.add_argument("--keep", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ.setdefault("QDRANT_URL", "http://localhost:6333")
+    os.environ["QDRANT_HYBRID"] = "false"
+
+    from app.api.chat.engine.vectordb import get_qdrant_config, qdrant_manager
+
+    url, _ = get_qdrant_config()
+    client, _ = qdrant_manager.get_clients(url)
+    store = qdrant_manager.get_vector_store(url, args.collection)
+    populate(client, args.collection, args)
+    wait_for_indexing(client, args.collection)
+    doc_ids = [f"doc-{i}" for i in random.Random(args.seed).sample(range(args.docs), 3)]
+
+    rows = [
+        {"indexes": "none", **row} for row in run_queries(store, args, doc_ids)
+    ]
+
+    created = qdrant_manager.ensure_payload_indexes(url, args.collection)
+    start = time.perf_counter()
+    wait_for_indexing(client, args.collection)
+    print(f"Indexed {created} in {time.perf_counter() - start:.1f}s")
+    rows += [
+        {"indexes": "filter fields", **row} for row in run_queries(store, args, doc_ids)
+    ]
+
+    print_table(rows)
+    if not args.keep:
+        client.delete_collection(args.collection)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Compare dense and hybrid (dense + sparse with rank fusion) retrieval on keyword queries.
+
+    poetry run python -m benchmarks.hybrid_retrieval --chunks 2000 --queries 200
+
+Runs on an in-memory Qdrant with a synthetic catalog: every chunk describes a part
+identified by a code (e.g. "XK-48213"), the queries ask for one of the codes.
+The dense embedding is a deterministic bag of words that ignores the codes,
+like real embedding models which don't capture arbitrary identifiers well.
+Reports recall@k (the chunk of the code is retrieved) and the prompt tokens of the retrieved chunks.
+"""
+
+import argparse
+import os
+import random
+import re
+import uuid
+import zlib
+from typing import List
+
+from benchmarks.common import print_table, summarize, timer
+
+WORDS = (
+    "valve pump bracket sensor housing seal gasket bearing shaft coupling filter "
+    "motor relay switch cable connector spring washer bolt nut flange hose clamp "
+    "steel aluminium brass rubber plastic heavy light compact industrial marine"
+).split()
+DIM = 64
+
+
+def make_corpus(n_chunks: int, seed: int):
+    rng = random.Random(seed)
+    codes = [
+        f"{rng.choice('ABCDEFGHKLMX')}{rng.choice('KLMX')}-{rng.randint(10000, 99999)}"
+        for _ in range(n_chunks)
+    ]
+    texts = [
+        f"Part {code}: {' '.join(rng.choices(WORDS, k=40))}. "
+        f"Replacement for {' '.join(rng.choices(WORDS, k=3))}."
+        for code in codes
+    ]
+    return codes, texts
+
+
+def get_embed_model():
+    from llama_index.core.embeddings import BaseEmbedding
+
+    def embed(text: str) -> List[float]:
+        vector = [0.0] * DIM
+        # Only the plain words contribute, the part codes are invisible to the dense model
+        for word in re.findall(r"[a-z]+", text.lower()):
+            vector[zlib.crc32(word.encode()) % DIM] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    class BagOfWordsEmbedding(BaseEmbedding):
+        def _get_query_embedding(self, query: str) -> List[float]:
+            return embed(query)
+
+        async def _aget_query_embedding(self, query: str) -> List[float]:
+            return embed(query)
+
+        def _get_text_embedding(self, text: str) -> List[float]:
+            return embed(text)
+
+    return BagOfWordsEmbedding(model_name="bag-of-words")
+
+
+def node_id(i: int) -> str:
+    return str(uuid.UUID(int=i + 1))
+
+
+def build_index(collection: str, hybrid: bool, texts: List[str], embed_model):
+    from llama_index.core import StorageContext, VectorStoreIndex
+    from llama_index.core.schema import TextNode
+
+    from app.api.chat.engine.vectordb import get_vector_store
+
+    os.environ["QDRANT_HYBRID"] = "true" if hybrid else "false"
+    store = get_vector_store(collection)
+    nodes = [TextNode(text=text, id_=node_id(i)) for i, text in enumerate(texts)]
+    return VectorStoreIndex(
+        nodes,
+        storage_context=StorageContext.from_defaults(vector_store=store),
+        embed_model=embed_model,
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 0.75 words per token
+    return round(len(text.split()) / 0.75)
+
+
+def evaluate(retriever, codes: List[str], query_ids: List[int]):
+    hits, tokens, samples = 0, 0, []
+    for i in query_ids:
+        with timer(samples):
+            nodes = retriever.retrieve(f"Which part has the code {codes[i]}?")
+        hits += any(node.node.node_id == node_id(i) for node in nodes)
+        tokens += sum(estimate_tokens(node.node.get_content()) for node in nodes)
+    return {
+        "recall": hits / len(query_ids),
+        "prompt_tokens": tokens / len(query_ids),
+        "p50_ms": summarize(samples)["p50_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--sparse-top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["QDRANT_URL"] = ":memory:"
+    embed_model = get_embed_model()
+    codes, texts = make_corpus(args.chunks, args.seed)
+    query_ids = random.Random(args.seed).sample(range(args.chunks), args.queries)
+
+    dense_index = build_index("bench-dense", False, texts, embed_model)
+    hybrid_index = build_index("bench-hybrid", True, texts, embed_model)
+
+    rows = []
+    for top_k in (2, 5, 20):
+        retriever = dense_index.as_retriever(similarity_top_k=top_k)
+        rows.append(
+            {"mode": "dense", "top_k": top_k, **evaluate(retriever, codes, query_ids)}
+        )
+    for top_k in (2, 5):
+        retriever = hybrid_index.as_retriever(
+            similarity_top_k=top_k,
+            vector_store_query_mode="hybrid",
+            sparse_top_k=args.sparse_top_k,
+        )
+        rows.append(
+            {"mode": "hybrid", "top_k": top_k, **evaluate(retriever, codes, query_ids)}
+        )
+
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Peak memory (RSS) of `poetry run generate`, all documents at once vs streamed in windows.
+
+    poetry run python -m benchmarks.ingestion_memory --sizes-gb 1 5 --window-size 50
+
+Writes a synthetic text corpus of each --sizes-gb into --data-dir (kept for the next runs), then
+runs generate_datasource in a fresh process per mode and corpus size and reports its peak RSS.
+The embedding model is a fake one and, unless --qdrant-url is set, the vector store only counts
+the nodes: an in-memory Qdrant would keep the whole corpus in memory and hide the difference.
+Use --sizes-gb to check that the streaming peak stays flat when the corpus grows.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import print_table
+
+WORDS = [f"word{i}" for i in range(10_000)]
+
+
+def write_corpus(data_dir: str, size_bytes: int, file_bytes: int, seed: int):
+    """
+    Write text files until the directory holds size_bytes, the existing files are kept
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    rng = random.Random(seed)
+    total = sum(
+        os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir)
+    )
+    index = len(os.listdir(data_dir))
+    while total < size_bytes:
+        path = os.path.join(data_dir, f"doc-{index:06d}.txt")
+        with open(path, "w") as f:
+            written = 0
+            target = min(file_bytes, size_bytes - total)
+            while written < target:
+                sentence = " ".join(rng.choices(WORDS, k=rng.randint(8, 30))) + ".\n"
+                f.write(sentence)
+                written += len(sentence)
+        total += written
+        index += 1
+    return total
+
+
+def get_counting_vector_store():
+    from typing import Any, List
+
+    from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+    class CountingVectorStore(BasePydanticVectorStore):
+        stores_text: bool = True
+        nodes: int = 0
+
+        @property
+        def client(self) -> Any:
+            return None
+
+        def add(self, nodes: List, **kwargs: Any) -> List[str]:
+            self.nodes += len(nodes)
+            return [node.node_id for node in nodes]
+
+        def delete(self, ref_doc_id: str, **kwargs: Any) -> None:
+            pass
+
+        def query(self, query, **kwargs: Any):
+            raise NotImplementedError
+
+    return CountingVectorStore()
+
+
+def worker(args):
+    """
+    Run generate_datasource in this process, print the peak RSS as JSON
+    """
+    # A new docstore, generate loads the docstore of an existing STORAGE_DIR
+    os.environ["STORAGE_DIR"] = os.path.join(
+        tempfile.mkdtemp(prefix="bench-ingestion-"), "storage"
+    )
+    os.environ["GENERATE_INCREMENTAL"] = "false"
+    os.environ["GENERATE_WINDOW_SIZE"] = str(args.window_size)
+    if args.qdrant_url:
+        os.environ["QDRANT_URL"] = args.qdrant_url
+        os.environ["QDRANT_COLLECTION"] = f"bench-ingestion-{args.window_size}"
+
+    from llama_index.core.settings import Settings
+
+    from app.api.chat.engine import generate
+    from app.api.chat.engine.loaders import file
+    from benchmarks.common import get_fake_embed_model
+
+    def init_settings():
+        Settings.embed_model = get_fake_embed_model(args.dim)
+        Settings.chunk_size = 1024
+        Settings.chunk_overlap = 20
+
+    file.DATA_DIR = args.data_dir
+    generate.init_settings = init_settings
+    # No MongoDB to notify, there is no server caching the index
+    generate.bump_ingestion_version = lambda: 0
+    vector_store = None
+    if not args.qdrant_url:
+        vector_store = get_counting_vector_store()
+        generate.get_vector_store = lambda: vector_store
+        generate.ensure_payload_indexes = lambda: None
+
+    start = time.perf_counter()
+    generate.generate_datasource()
+    print(
+        json.dumps(
+            {
+                "seconds": time.perf_counter() - start,
+                # KiB on Linux
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                / 1024,
+                "chunks": vector_store.nodes if vector_store is not None else None,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes-gb", type=float, nargs="+", default=[5.0])
+    parser.add_argument("--file-mb", type=float, default=10)
+    parser.add_argument("--window-size", type=int, default=50)
+    parser.add_argument("--data-dir", default="output/bench_ingestion_memory")
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--qdrant-url")
+    parser.add_argument("--skip-list", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    rows = []
+    for size_gb in sorted(args.sizes_gb):
+        data_dir = os.path.abspath(f"{args.data_dir}-{size_gb:g}gb")
+        corpus_bytes = write_corpus(
+            data_dir, int(size_gb * 1e9), int(args.file_mb * 1e6), args.seed
+        )
+        modes = {"streaming": args.window_size}
+        if not args.skip_list:
+            modes = {"all at once": 0, **modes}
+        for mode, window_size in modes.items():
+            command = [
+                sys.executable,
+                "-m",
+                "benchmarks.ingestion_memory",
+                "--worker",
+                "--data-dir",
+                data_dir,
+                "--window-size",
+                str(window_size),
+                "--dim",
+                str(args.dim),
+            ]
+            if args.qdrant_url:
+                command += ["--qdrant-url", args.qdrant_url]
+            output = subprocess.run(
+                command, capture_output=True, text=True, check=True
+            ).stdout
+            stats = json.loads(output.strip().splitlines()[-1])
+            rows.append(
+                {
+                    "corpus_mb": corpus_bytes / 1e6,
+                    "mode": mode,
+                    "window": window_size or "-",
+                    "chunks": stats["chunks"] or "-",
+                    "seconds": stats["seconds"],
+                    "peak_rss_mb": stats["peak_rss_mb"],
+                }
+            )
+
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Compare the Qdrant payload of the full (LlamaIndex default) and compact formats.
+
+    poetry run python -m benchmarks.payload_size --docs 50
+
+Ingests the same synthetic documents, with the metadata set by the file reader and the
+admin upload, in both formats into an in-memory Qdrant. Reports the payload bytes per point
+and the payload bytes returned by a top-k search (all fields vs only the fields read by the chat).
+Also checks that a collection holding points of both formats (written before and after
+switching to the compact format) is still read by the compact projected searches.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+
+from benchmarks.common import get_fake_embed_model, print_table
+
+# Excluded from the embeddings and the LLM context by SimpleDirectoryReader
+READER_EXCLUDED_KEYS = [
+    "file_name",
+    "file_type",
+    "file_size",
+    "creation_date",
+    "last_modified_date",
+    "last_accessed_date",
+]
+
+
+def make_documents(n_docs: int, words: int, seed: int):
+    from llama_index.core.schema import Document
+
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(2000)]
+    documents = []
+    for i in range(n_docs):
+        file_name = f"report-{i}.pdf"
+        file_url = f"https://bucket.s3.eu-west-1.amazonaws.com/admin_uploads/{file_name}"
+        documents.append(
+            Document(
+                id_=f"/data/reports/{file_name}_part_{i}",
+                text=" ".join(rng.choices(vocabulary, k=words)),
+                metadata={
+                    "page_label": str(i % 20 + 1),
+                    "file_name": file_name,
+                    "file_path": f"/app/data/reports/{file_name}",
+                    "file_type": "application/pdf",
+                    "file_size": rng.randint(10_000, 5_000_000),
+                    "creation_date": "2024-08-01",
+                    "last_modified_date": "2024-08-02",
+                    "private": "false",
+                    "file_id": f"admin_uploads/{file_name}",
+                    "user_id": "admin",
+                    "url": file_url,
+                    "document_id": file_url,
+                },
+                excluded_embed_metadata_keys=READER_EXCLUDED_KEYS,
+                excluded_llm_metadata_keys=READER_EXCLUDED_KEYS,
+            )
+        )
+    return documents
+
+
+def payload_bytes(payload) -> int:
+    return len(json.dumps(payload).encode())
+
+
+def ingest(documents, collection: str, payload_format: str):
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+
+    from app.api.chat.engine.generate import run_pipeline
+    from app.api.chat.engine.vectordb import get_vector_store
+
+    os.environ["QDRANT_PAYLOAD_FORMAT"] = payload_format
+    store = get_vector_store(collection)
+    run_pipeline(SimpleDocumentStore(), store, documents)
+    return store
+
+
+def check_mixed_collection(documents, query, top_k: int):
+    """
+    Query a collection of full and compact points through a compact store
+    """
+    from llama_index.core.vector_stores.types import VectorStoreQuery
+
+    from app.api.chat.engine.vectordb import qdrant_manager
+
+    collection = "bench-payload-mixed"
+    half = len(documents) // 2
+    ingest(documents[:half], collection, "full")
+    # A new store reading the format from the env, as after a restart
+    qdrant_manager._stores.clear()
+    store = ingest(documents[half:], collection, "compact")
+
+    vector_query = VectorStoreQuery(
+        query_embedding=query, similarity_top_k=max(top_k, len(documents) * 10)
+    )
+    result = store.query(vector_query)
+    missing_text = sum(not node.text for node in result.nodes)
+    if not result.nodes or missing_text:
+        raise SystemExit(
+            f"Mixed collection: {missing_text}/{len(result.nodes)} nodes without text"
+        )
+    print(f"Mixed collection: {len(result.nodes)} full and compact nodes retrieved")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--words", type=int, default=1500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from llama_index.core.settings import Settings
+    from qdrant_client.http import models as rest
+
+    from app.api.chat.engine.payload import get_payload_fields
+
+    os.environ["QDRANT_URL"] = ":memory:"
+    os.environ["QDRANT_HYBRID"] = "false"
+    embed_model = get_fake_embed_model(64)
+    Settings.embed_model = embed_model
+    documents = make_documents(args.docs, args.words, args.seed)
+    queries = [
+        embed_model.get_query_embedding(f"word{i} word{i + 1}")
+        for i in range(args.queries)
+    ]
+
+    rows = []
+    for payload_format in ("full", "compact"):
+        store = ingest(documents, f"bench-payload-{payload_format}", payload_format)
+        points, _ = store.client.scroll(
+            store.collection_name, limit=100_000, with_payload=True
+        )
+        per_point = statistics.fmean(payload_bytes(point.payload) for point in points)
+        projections = {"all fields": True}
+        if payload_format == "compact":
+            projections["chat fields"] = rest.PayloadSelectorInclude(
+                include=get_payload_fields()
+            )
+        for projection, with_payload in projections.items():
+            response_bytes = [
+                sum(
+                    payload_bytes(point.payload)
+                    for point in store.client.search(
+                        store.collection_name,
+                        query_vector=query,
+                        limit=args.top_k,
+                        with_payload=with_payload,
+                    )
+                )
+                for query in queries
+            ]
+            rows.append(
+                {
+                    "format": payload_format,
+                    "fetched": projection,
+                    "points": len(points),
+                    "bytes_per_point": per_point,
+                    f"bytes_per_top{args.top_k}": statistics.fmean(response_bytes),
+                }
+            )
+
+    print_table(rows)
+    check_mixed_collection(documents, queries[0], args.top_k)
+
+
+if __name__ == "__main__":
+    main()
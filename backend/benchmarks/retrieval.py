@@ -0,0 +1,219 @@
+"""
+Retrieval latency, recall@k and throughput of the chat engine retriever.
+
+    poetry run python -m benchmarks.retrieval --sizes 200 1000 --top-k 2 5 10
+
+For every collection size, a synthetic corpus is ingested with `run_pipeline` (like
+`poetry run generate`) into an in-memory Qdrant (or a Qdrant server with --qdrant-url),
+using a deterministic hashing embedding model. The retriever of `get_chat_engine` is then
+queried with passages of known documents, for every TOP_K and filter shape:
+
+- public: the default filter, the queries target public documents
+- public + selected: a few private documents are selected, half of the queries target them
+- none: no filter, the queries target any document
+
+recall@k is the share of queries whose document is in the top k chunks.
+The results are saved as JSON (--output) to compare them between versions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from benchmarks.common import get_fake_embed_model, print_table, summarize, timer
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+PRIVATE_EVERY = 5
+QUERY_WORDS = 6
+QUERY_NOISE = 0.3
+SYLLABLES = "ka lo mi ne ru sa ti vo be da fe gu hi jo ze wa".split()
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_corpus(n_docs: int, doc_words: int, seed: int):
+    from llama_index.core.schema import Document
+
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(5000, rng)
+    documents = []
+    for i in range(n_docs):
+        # Every document has its own topic words, mixed with common ones
+        topic = rng.sample(vocabulary, 50)
+        words = [
+            rng.choice(topic) if rng.random() < 0.6 else rng.choice(vocabulary)
+            for _ in range(doc_words)
+        ]
+        documents.append(
+            Document(
+                id_=f"doc-{i}",
+                text=" ".join(words),
+                metadata={
+                    "file_name": f"doc-{i}.txt",
+                    "private": "true" if i % PRIVATE_EVERY == 0 else "false",
+                },
+            )
+        )
+    return documents
+
+
+def make_queries(documents, doc_indexes, n_queries: int, rng: random.Random):
+    queries = []
+    for _ in range(n_queries):
+        i = rng.choice(doc_indexes)
+        words = documents[i].text.split()
+        start = rng.randrange(max(1, len(words) - QUERY_WORDS))
+        # Some words of the passage are replaced by words of other documents
+        query = [
+            (
+                word
+                if rng.random() > QUERY_NOISE
+                else rng.choice(rng.choice(documents).text.split())
+            )
+            for word in words[start : start + QUERY_WORDS]
+        ]
+        queries.append((" ".join(query), documents[i].doc_id))
+    return queries
+
+
+def ingest(documents, collection: str) -> float:
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+
+    from app.api.chat.engine.engine import chat_engine_factory
+    from app.api.chat.engine.generate import run_pipeline
+    from app.api.chat.engine.vectordb import get_vector_store
+
+    os.environ["QDRANT_COLLECTION"] = collection
+    chat_engine_factory.invalidate()
+    start = time.perf_counter()
+    run_pipeline(SimpleDocumentStore(), get_vector_store(), documents)
+    return time.perf_counter() - start
+
+
+def filter_shapes(documents, n_selected: int, n_queries: int, rng: random.Random):
+    from app.api.chat.engine.query_filter import generate_filters
+
+    public = [i for i in range(len(documents)) if i % PRIVATE_EVERY != 0]
+    selected = rng.sample(
+        [i for i in range(len(documents)) if i % PRIVATE_EVERY == 0], n_selected
+    )
+    selected_ids = [documents[i].doc_id for i in selected]
+    return {
+        "public": (
+            generate_filters([]),
+            make_queries(documents, public, n_queries, rng),
+        ),
+        "public + selected": (
+            generate_filters(selected_ids),
+            make_queries(documents, selected, n_queries // 2, rng)
+            + make_queries(documents, public, n_queries - n_queries // 2, rng),
+        ),
+        "none": (
+            None,
+            make_queries(documents, list(range(len(documents))), n_queries, rng),
+        ),
+    }
+
+
+def evaluate(filters, queries, top_k: int):
+    from app.api.chat.engine import get_chat_engine
+
+    os.environ["TOP_K"] = str(top_k)
+    retriever = get_chat_engine(filters=filters, system_prompt=SYSTEM_PROMPT).retriever
+    hits, samples = 0, []
+    start = time.perf_counter()
+    for query, doc_id in queries:
+        with timer(samples):
+            nodes = retriever.retrieve(query)
+        hits += any(node.node.ref_doc_id == doc_id for node in nodes)
+    elapsed = time.perf_counter() - start
+    stats = summarize(samples)
+    return {
+        "p50_ms": stats["p50_ms"],
+        "p95_ms": stats["p95_ms"],
+        "recall": hits / len(queries),
+        "qps": len(queries) / elapsed,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 1000])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--doc-words", type=int, default=600)
+    parser.add_argument("--selected", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--qdrant-url", default=":memory:")
+    parser.add_argument("--output", default="retrieval_results.json")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from llama_index.core.llms import MockLLM
+    from llama_index.core.settings import Settings
+
+    os.environ["QDRANT_URL"] = args.qdrant_url
+    Settings.llm = MockLLM()
+    Settings.embed_model = get_fake_embed_model(args.dim)
+    Settings.chunk_size = args.chunk_size
+    Settings.chunk_overlap = args.chunk_size // 10
+
+    rows = []
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        documents = make_corpus(size, args.doc_words, args.seed)
+        ingest_s = ingest(documents, f"bench-retrieval-{size}-{args.seed}")
+        print(f"Ingested {size} documents in {ingest_s:.1f}s")
+        shapes = filter_shapes(documents, args.selected, args.queries, rng)
+        for top_k in args.top_k:
+            for shape, (filters, queries) in shapes.items():
+                rows.append(
+                    {
+                        "docs": size,
+                        "top_k": top_k,
+                        "filter": shape,
+                        **evaluate(filters, queries, top_k),
+                    }
+                )
+
+    print_table(rows)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "revision": git_revision(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "params": vars(args),
+                "results": rows,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Saved the results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Compare the Qdrant storage profiles: estimated RAM, search latency and recall@k.
+
+    poetry run python -m benchmarks.storage_profiles --points 200000 --dim 1536
+
+Requires a Qdrant server for meaningful numbers (the in-memory Qdrant ignores quantization,
+on-disk storage and HNSW), QDRANT_URL defaults to http://localhost:6333.
+One collection per profile is filled with the same clustered random vectors.
+The recall is measured against an exact (brute force) search, with the search params of
+the profile (rescoring and oversampling of the quantized profiles) and, for the quantized
+profiles, without rescoring to show what it recovers. The RAM is estimated from
+the vectors, quantized vectors and HNSW links kept in memory for each profile.
+"""
+
+import argparse
+import os
+import time
+import uuid
+
+from benchmarks.common import print_table, summarize, timer
+
+PAYLOAD_BYTES = 2048
+
+
+def make_vectors(n: int, dim: int, seed: int):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    # Clustered like real embeddings, uniform random vectors make every search equally hard
+    centers = rng.standard_normal((max(1, n // 1000), dim), dtype="float32")
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.3 * rng.standard_normal(
+        (n, dim), dtype="float32"
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def populate(client, collection: str, profile, vectors, batch_size: int):
+    from qdrant_client.http import models as rest
+
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+    client.create_collection(
+        collection_name=collection,
+        vectors_config=profile.dense_params(vectors.shape[1]),
+        hnsw_config=profile.hnsw_config(),
+        quantization_config=profile.quantization_config(),
+        on_disk_payload=profile.on_disk_payload,
+    )
+    text = "x" * PAYLOAD_BYTES
+    for offset in range(0, len(vectors), batch_size):
+        batch = vectors[offset : offset + batch_size]
+        client.upload_points(
+            collection_name=collection,
+            points=[
+                rest.PointStruct(
+                    id=str(uuid.UUID(int=offset + i + 1)),
+                    vector=vector.tolist(),
+                    payload={"text": text},
+                )
+                for i, vector in enumerate(batch)
+            ],
+            wait=True,
+        )
+    deadline = time.monotonic() + 3600
+    while time.monotonic() < deadline:
+        if client.get_collection(collection).status == rest.CollectionStatus.GREEN:
+            break
+        time.sleep(1)
+
+
+def search_ids(client, collection: str, query, top_k: int, search_params=None):
+    points = client.search(
+        collection_name=collection,
+        query_vector=query.tolist(),
+        limit=top_k,
+        search_params=search_params,
+    )
+    return [point.id for point in points]
+
+
+def search_modes(profile):
+    """
+    The searches of the chat (the profile's search params) and, for the quantized profiles,
+    the same search without rescoring nor oversampling
+    """
+    from qdrant_client.http import models as rest
+
+    modes = {profile.name: profile.search_params()}
+    if profile.quantization != "none":
+        modes[f"{profile.name} (no rescore)"] = rest.SearchParams(
+            quantization=rest.QuantizationSearchParams(rescore=False, oversampling=1.0)
+        )
+    return modes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--profiles", nargs="*")
+    parser.add_argument("--keep", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ.setdefault("QDRANT_URL", "http://localhost:6333")
+
+    from qdrant_client.http import models as rest
+
+    from app.api.chat.engine.storage_profiles import STORAGE_PROFILES
+    from app.api.chat.engine.vectordb import get_qdrant_config, qdrant_manager
+
+    url, _ = get_qdrant_config()
+    vectors = make_vectors(args.points, args.dim, args.seed)
+    queries = make_vectors(args.queries, args.dim, args.seed + 1)
+
+    rows = []
+    for name in args.profiles or list(STORAGE_PROFILES):
+        profile = STORAGE_PROFILES[name]
+        collection = f"bench-profile-{name}"
+        client, _ = qdrant_manager.get_clients(url)
+        start = time.perf_counter()
+        populate(client, collection, profile, vectors, args.batch_size)
+        ingest_s = time.perf_counter() - start
+
+        exact = rest.SearchParams(exact=True)
+        expected = [
+            search_ids(client, collection, query, args.top_k, exact)
+            for query in queries
+        ]
+        for mode, search_params in search_modes(profile).items():
+            hits, samples = 0, []
+            for query, expected_ids in zip(queries, expected):
+                with timer(samples):
+                    found = search_ids(
+                        client, collection, query, args.top_k, search_params
+                    )
+                hits += len(set(expected_ids) & set(found))
+
+            stats = summarize(samples)
+            rows.append(
+                {
+                    "profile": mode,
+                    "est_ram_mb": profile.estimate_ram_bytes(args.dim, PAYLOAD_BYTES)
+                    * args.points
+                    / 1e6,
+                    "ingest_s": ingest_s,
+                    "p50_ms": stats["p50_ms"],
+                    "p95_ms": stats["p95_ms"],
+                    f"recall@{args.top_k}": hits / (args.top_k * len(queries)),
+                }
+            )
+        if not args.keep:
+            client.delete_collection(collection)
+
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Load benchmark of the token coalescing of VercelStreamResponse.
+
+    poetry run python -m benchmarks.stream_coalescing --streams 200 --tokens 300
+
+Runs many concurrent simulated answers (one token every --token-interval ms) through
+`VercelStreamResponse.encode_events` and writes every frame to a real socket, like the
+ASGI server does. Reports the number of frames (socket writes) and the CPU time
+with coalescing disabled and enabled.
+"""
+
+import argparse
+import asyncio
+import socket
+import time
+
+from benchmarks.common import print_table
+from app.api.chat.stream_events import SourcesEvent, TokenEvent
+from app.api.chat.vercel_response import VercelStreamResponse
+
+
+async def fake_answer(tokens: int, token_interval: float):
+    yield TokenEvent("")
+    for i in range(tokens):
+        await asyncio.sleep(token_interval)
+        yield TokenEvent(f" token{i}")
+    yield SourcesEvent({"nodes": []})
+
+
+async def run_stream(args, coalesce_ms: float, coalesce_bytes: int):
+    loop = asyncio.get_running_loop()
+    writer, reader = socket.socketpair()
+    writer.setblocking(False)
+    reader.setblocking(False)
+
+    async def drain():
+        while await loop.sock_recv(reader, 65536):
+            pass
+
+    drainer = asyncio.create_task(drain())
+    frames = 0
+    first_frame_at = None
+    started = time.perf_counter()
+    async for frame in VercelStreamResponse.encode_events(
+        fake_answer(args.tokens, args.token_interval / 1000),
+        coalesce_ms=coalesce_ms,
+        coalesce_bytes=coalesce_bytes,
+    ):
+        frames += 1
+        if first_frame_at is None and frame != b'0:""\n':
+            first_frame_at = time.perf_counter() - started
+        await loop.sock_sendall(writer, frame)
+    writer.close()
+    await drainer
+    reader.close()
+    return frames, first_frame_at
+
+
+async def run(args, coalesce_ms: float, coalesce_bytes: int):
+    cpu_start = time.process_time()
+    results = await asyncio.gather(
+        *(run_stream(args, coalesce_ms, coalesce_bytes) for _ in range(args.streams))
+    )
+    cpu = time.process_time() - cpu_start
+    return {
+        "socket_writes": sum(frames for frames, _ in results),
+        "cpu_s": cpu,
+        "ttft_ms": max(ttft for _, ttft in results) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--token-interval", type=float, default=10, help="ms")
+    parser.add_argument("--coalesce-ms", type=float, default=50)
+    parser.add_argument("--coalesce-bytes", type=int, default=512)
+    args = parser.parse_args()
+
+    rows = []
+    for name, coalesce_ms, coalesce_bytes in (
+        ("one frame per token", 0, 0),
+        (
+            f"coalesced ({args.coalesce_ms} ms / {args.coalesce_bytes} B)",
+            args.coalesce_ms,
+            args.coalesce_bytes,
+        ),
+    ):
+        rows.append({"mode": name, **asyncio.run(run(args, coalesce_ms, coalesce_bytes))})
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
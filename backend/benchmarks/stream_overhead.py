@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the per-token overhead of the chat stream, comparing the
+previous pipeline (serialize to str, json.loads it back, concatenate the answer)
+with the typed event pipeline (collect the event, encode it once to bytes).
+
+    poetry run python -m benchmarks.stream_overhead --tokens 2000 --runs 50
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.common import print_table
+from app.api.chat.stream_events import StreamCollector, TokenEvent
+
+TEXT_PREFIX = "0:"
+
+
+def legacy_pipeline(tokens):
+    final_response = ""
+    for token in tokens:
+        chunk = f"{TEXT_PREFIX}{json.dumps(token)}\n"
+        if chunk.startswith(TEXT_PREFIX):
+            final_response += json.loads(chunk[2:].strip())
+        # Starlette encodes the str chunk before sending it
+        chunk.encode()
+    return final_response
+
+
+def typed_pipeline(tokens):
+    collector = StreamCollector()
+    for token in tokens:
+        event = TokenEvent(token)
+        collector.add(event)
+        event.encode()
+    return collector.content
+
+
+def measure(fn, tokens, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(tokens)
+    elapsed = time.perf_counter() - start
+    return elapsed / (runs * len(tokens)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    words = ["retrieval", " augmented", " generation", ",", " \"quoted\"", "\n", " ok"]
+    tokens = [words[i % len(words)] for i in range(args.tokens)]
+    assert legacy_pipeline(tokens) == typed_pipeline(tokens)
+
+    print_table(
+        [
+            {
+                "pipeline": "legacy (dumps + loads + concat)",
+                "us_per_token": measure(legacy_pipeline, tokens, args.runs),
+            },
+            {
+                "pipeline": "typed events (encode once)",
+                "us_per_token": measure(typed_pipeline, tokens, args.runs),
+            },
+        ]
+    )
+
+
+if __name__ == "__main__":
+    main()
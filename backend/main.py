@@ -5,6 +5,7 @@ from app.config import DATA_DIR
 
 load_dotenv()
 
+import asyncio
 import logging
 import os
 import json
@@ -14,12 +15,17 @@ import uvicorn
 from app.api.chat import chat_router
 from app.api.chat import config_router
 from app.api.chat import file_upload_router
+from app.api.chat import private_file_router
 from app.api.auth import auth_router
 from app.api.conversation import conversation_router
 from app.api.admin import admin_router
 from app.observability import init_observability
 from app.settings import init_settings
 from app.db import async_mongodb, sync_mongodb
+from app.api.chat.engine.vectordb import qdrant_manager
+from app.api.chat.engine.index import ingestion_version
+from app.services import config_service
+from app.api.chat.summary import title_generator
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -34,10 +40,17 @@ async def lifespan(app: FastAPI):
     await async_mongodb.connect_to_database()
     sync_mongodb.connect_to_database()
     await async_mongodb.database_init()
+    await qdrant_manager.startup()
+    config_service.start_watcher()
+    # The first read of the version is a blocking MongoDB query
+    await asyncio.to_thread(ingestion_version.start_polling)
     yield
+    await config_service.stop_watcher()
+    await title_generator.queue.shutdown()
     # Shutdown: Close the database connection
     sync_mongodb.close_database_connection()
     await async_mongodb.close_database_connection()
+    await qdrant_manager.aclose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -84,6 +97,8 @@ app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(chat_router, prefix="/api/chat", tags=["Chat"])
 app.include_router(config_router, prefix="/api/chat/config", tags=["Chat"])
 app.include_router(file_upload_router, prefix="/api/chat/upload", tags=["Chat"])
+# The private uploads are only served to their owner
+app.include_router(private_file_router, prefix="/api/files/private", tags=["Chat"])
 app.include_router(
     conversation_router, prefix="/api/conversation", tags=["Conversation"]
 )
@@ -0,0 +1,6 @@
+import os
+
+# The settings read at import time, the tests don't connect to MongoDB nor Qdrant
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("JWT_REFRESH_SECRET_KEY", "test-refresh-secret")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
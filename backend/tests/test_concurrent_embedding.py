@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+
+import pytest
+from llama_index.core.embeddings import MockEmbedding
+
+from app.concurrent_embedding import (
+    AdaptiveLimiter,
+    ConcurrentEmbedding,
+    IngestionCacheStats,
+    get_retry_after,
+    is_rate_limit_error,
+)
+from app.ingestion_cache import SQLiteIngestionCache
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+_batches_lock = threading.Lock()
+
+
+def test_rate_limit_halves_the_concurrency():
+    limiter = AdaptiveLimiter(8)
+    with limiter as generation:
+        pass
+    limiter.on_rate_limit(generation, delay=0)
+    assert limiter.limit == 4
+    limiter.on_rate_limit(generation + 1, delay=0)
+    assert limiter.limit == 2
+
+
+def test_requests_in_flight_dont_halve_it_again():
+    limiter = AdaptiveLimiter(8)
+    generations = [limiter.__enter__() for _ in range(3)]
+    for generation in generations:
+        limiter.on_rate_limit(generation, delay=0)
+    assert limiter.limit == 4
+
+
+def test_concurrency_never_drops_below_one():
+    limiter = AdaptiveLimiter(1)
+    limiter.on_rate_limit(0, delay=0)
+    assert limiter.limit == 1
+
+
+def test_concurrency_grows_back_below_the_rate_limited_one():
+    limiter = AdaptiveLimiter(8)
+    limiter.on_rate_limit(0, delay=0)
+    assert limiter.limit == 4
+    for _ in range(100):
+        limiter.on_success()
+    # 8 was rate limited, the limit stops at 7
+    assert limiter.limit == 7
+
+
+def test_additive_increase_needs_as_many_successes_as_the_limit():
+    limiter = AdaptiveLimiter(8)
+    limiter.on_rate_limit(0, delay=0)
+    for _ in range(3):
+        limiter.on_success()
+    assert limiter.limit == 4
+    limiter.on_success()
+    assert limiter.limit == 5
+
+
+def test_limiter_blocks_above_the_limit():
+    limiter = AdaptiveLimiter(1)
+    entered = threading.Event()
+
+    def worker():
+        with limiter:
+            entered.set()
+
+    with limiter:
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert not entered.wait(0.05)
+    assert entered.wait(1)
+    thread.join()
+
+
+def test_rate_limit_pauses_the_next_requests():
+    limiter = AdaptiveLimiter(2)
+    limiter.on_rate_limit(0, delay=0.1)
+    start = time.monotonic()
+    with limiter:
+        pass
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rate_limit_detection():
+    class Response:
+        status_code = 429
+        headers = {"retry-after": "2.5"}
+
+    class HTTPError(Exception):
+        response = Response()
+
+    assert is_rate_limit_error(RateLimitError())
+    assert is_rate_limit_error(HTTPError())
+    assert not is_rate_limit_error(ValueError())
+    assert get_retry_after(HTTPError()) == 2.5
+    assert get_retry_after(RateLimitError()) is None
+
+
+class FlakyEmbedding(MockEmbedding):
+    """
+    Rate limits the first `failures` batches
+    """
+
+    failures: int = 0
+    batches: int = 0
+
+    def _get_text_embeddings(self, texts):
+        with _batches_lock:
+            self.batches += 1
+            failing = self.failures > 0
+            self.failures -= failing
+        if failing:
+            error = RateLimitError()
+            error.response = type(
+                "Response", (), {"headers": {"retry-after": "0.01"}}
+            )()
+            raise error
+        return super()._get_text_embeddings(texts)
+
+
+def test_batches_are_retried_on_rate_limits():
+    embed_model = FlakyEmbedding(embed_dim=4, failures=2)
+    concurrent = ConcurrentEmbedding(embed_model, embed_batch_size=2, max_concurrency=3)
+    embeddings = concurrent.get_text_embedding_batch([f"text {i}" for i in range(7)])
+    assert len(embeddings) == 7
+    assert embed_model.batches == 4 + 2
+
+
+def test_batches_fail_after_the_retries():
+    embed_model = FlakyEmbedding(embed_dim=4, failures=10)
+    concurrent = ConcurrentEmbedding(embed_model, max_concurrency=1, max_retries=2)
+    with pytest.raises(RateLimitError):
+        concurrent.get_text_embedding_batch(["text"])
+    assert embed_model.batches == 3
+
+
+def test_cache_stats_are_accumulated_over_the_calls(tmp_path, caplog):
+    cache = SQLiteIngestionCache(str(tmp_path / "cache.db"), 100, 3600)
+    stats = IngestionCacheStats()
+    for texts in (["a", "b"], ["b", "c", "c"]):
+        concurrent = ConcurrentEmbedding(
+            MockEmbedding(embed_dim=4), cache=cache, cache_stats=stats
+        )
+        with caplog.at_level(logging.INFO, logger="uvicorn"):
+            concurrent.get_text_embedding_batch(texts)
+    # Nothing is logged per call, "c" is embedded once
+    assert "Ingestion cache" not in caplog.text
+    assert (stats.hits, stats.chunks, stats.embedded) == (1, 5, 3)
+
+    with caplog.at_level(logging.INFO, logger="uvicorn"):
+        stats.log()
+    assert "1/5 chunks reused (20% hit ratio), 3 embedded" in caplog.text
@@ -0,0 +1,72 @@
+import pytest
+from llama_index.core.llms import ChatMessage, MessageRole
+
+from app.api.chat.engine.condense import (
+    CondenseCache,
+    get_condense_policy,
+    is_self_contained,
+)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "What is the recommended dose of ibuprofen for adults?",
+        "List the side effects of metformin in elderly patients",
+        "  How do I reset my password on the portal?  ",
+    ],
+)
+def test_self_contained_questions(message):
+    assert is_self_contained(message)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        # Too short to stand on its own
+        "Why?",
+        "and for children",
+        # Starts like a follow-up
+        "And what is the dose for children?",
+        "What about the generic version of the drug?",
+        # References an earlier turn
+        "What is the dose of it for children?",
+        "Can you explain that again in simpler words?",
+        "Are there other drugs with the same effect?",
+        "Tell me MORE about the side effects please",
+    ],
+)
+def test_follow_up_questions(message):
+    assert not is_self_contained(message)
+
+
+def test_pronouns_are_matched_as_whole_words():
+    # "this" in "thistle", "one" in "hormones"
+    assert is_self_contained("Which hormones regulate the growth of thistle plants?")
+
+
+def test_condense_policy(monkeypatch):
+    monkeypatch.delenv("CONDENSE_POLICY", raising=False)
+    assert get_condense_policy() == "always"
+    monkeypatch.setenv("CONDENSE_POLICY", "AUTO")
+    assert get_condense_policy() == "auto"
+    monkeypatch.setenv("CONDENSE_POLICY", "never")
+    with pytest.raises(ValueError):
+        get_condense_policy()
+
+
+def test_condense_cache_key_depends_on_the_conversation_and_history():
+    history = [ChatMessage(role=MessageRole.USER, content="What is aspirin?")]
+    key = CondenseCache.key("c1", history, "And the dose?")
+    assert key == CondenseCache.key("c1", list(history), "And the dose?")
+    assert key != CondenseCache.key("c2", history, "And the dose?")
+    assert key != CondenseCache.key("c1", [], "And the dose?")
+    assert key != CondenseCache.key("c1", history, "And the risks?")
+
+
+def test_condense_cache_round_trip():
+    cache = CondenseCache()
+    key = CondenseCache.key("c1", [], "question")
+    assert cache.get(key) is None
+    cache.set(key, "condensed question")
+    assert cache.get(key) == "condensed question"
@@ -0,0 +1,76 @@
+import pytest
+from llama_index.core.schema import (
+    NodeRelationship,
+    NodeWithScore,
+    RelatedNodeInfo,
+    TextNode,
+)
+from llama_index.core.settings import Settings
+
+from app.api.chat.engine.node_postprocessors import ContextPackerPostprocessor
+
+DOCUMENT = " ".join(f"word{i}" for i in range(200))
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer():
+    tokenizer = Settings._tokenizer
+    Settings.tokenizer = str.split
+    yield
+    Settings._tokenizer = tokenizer
+
+
+def _chunk(start: int, end: int, score: float, doc_id: str = "doc-1") -> NodeWithScore:
+    node = TextNode(text=DOCUMENT[start:end], start_char_idx=start, end_char_idx=end)
+    node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+    return NodeWithScore(node=node, score=score)
+
+
+def _packer(**kwargs) -> ContextPackerPostprocessor:
+    return ContextPackerPostprocessor(
+        token_budget=kwargs.pop("token_budget", 1000), **kwargs
+    )
+
+
+def test_overlapping_chunks_are_merged_without_repeating_the_overlap():
+    [node] = _packer().postprocess_nodes([_chunk(0, 100, 0.5), _chunk(80, 160, 0.9)])
+    assert node.node.text == DOCUMENT[0:160]
+    assert node.score == 0.9
+
+
+def test_adjacent_chunks_are_merged():
+    [node] = _packer().postprocess_nodes([_chunk(0, 100, 0.5), _chunk(100, 160, 0.9)])
+    assert node.node.text == DOCUMENT[0:100] + "\n" + DOCUMENT[100:160]
+
+
+def test_the_skipped_text_is_marked():
+    [node] = _packer(merge_gap=50).postprocess_nodes(
+        [_chunk(0, 100, 0.5), _chunk(130, 200, 0.9)]
+    )
+    assert node.node.text == DOCUMENT[0:100] + "\n…\n" + DOCUMENT[130:200]
+    assert DOCUMENT[100:130] not in node.node.text
+
+
+def test_distant_chunks_and_other_documents_are_not_merged():
+    nodes = _packer(merge_gap=10).postprocess_nodes(
+        [
+            _chunk(0, 100, 0.5),
+            _chunk(300, 400, 0.9),
+            _chunk(100, 200, 0.7, doc_id="doc-2"),
+        ]
+    )
+    assert [node.score for node in nodes] == [0.9, 0.7, 0.5]
+
+
+def test_near_duplicates_are_dropped():
+    nodes = _packer().postprocess_nodes(
+        [_chunk(0, 300, 0.9), _chunk(0, 300, 0.5, doc_id="doc-2")]
+    )
+    assert [node.score for node in nodes] == [0.9]
+
+
+def test_the_most_relevant_chunks_fit_the_budget():
+    nodes = _packer(token_budget=45, merge_gap=0).postprocess_nodes(
+        [_chunk(0, 150, 0.5), _chunk(400, 550, 0.9), _chunk(800, 950, 0.7)]
+    )
+    assert [node.score for node in nodes] == [0.9, 0.7]
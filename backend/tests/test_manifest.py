@@ -0,0 +1,94 @@
+import os
+
+from llama_index.core.schema import Document
+
+from app.api.chat.engine.loaders.manifest import FileManifest
+
+
+def _write(path, text: str):
+    path.write_text(text)
+    return path
+
+
+def _generate(manifest_path: str, files):
+    """
+    Scan the files like generate does and save the manifest with one document per file
+    """
+    manifest = FileManifest.load(manifest_path)
+    changed = manifest.changed_files(files)
+    manifest.add_documents(
+        [
+            Document(id_=f"doc-{path.name}", metadata={"file_path": str(path)})
+            for path in changed
+        ]
+    )
+    manifest.save()
+    return manifest, changed
+
+
+def test_new_files_are_loaded_once(tmp_path):
+    manifest_path = str(tmp_path / "storage" / "manifest.json")
+    files = [_write(tmp_path / "a.txt", "a"), _write(tmp_path / "b.txt", "b")]
+
+    manifest, changed = _generate(manifest_path, files)
+    assert changed == files
+    assert manifest.new == {str(path) for path in files}
+
+    manifest, changed = _generate(manifest_path, files)
+    assert changed == []
+    assert manifest.unchanged == {str(path) for path in files}
+    assert manifest.unchanged_doc_ids() == {"doc-a.txt", "doc-b.txt"}
+
+
+def test_changed_content_is_loaded_again(tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    path = _write(tmp_path / "a.txt", "a")
+    _generate(manifest_path, [path])
+
+    _write(path, "a changed")
+    manifest, changed = _generate(manifest_path, [path])
+    assert changed == [path]
+    assert manifest.updated == {str(path)}
+
+
+def test_touched_files_are_unchanged(tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    path = _write(tmp_path / "a.txt", "a")
+    _generate(manifest_path, [path])
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    manifest, changed = _generate(manifest_path, [path])
+    assert changed == []
+    # The hash matched, the documents of the file are kept with the new mtime
+    assert manifest.entries[str(path)].mtime_ns == stat.st_mtime_ns + 10**9
+    assert manifest.unchanged_doc_ids() == {"doc-a.txt"}
+
+
+def test_deleted_files(tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    a, b = _write(tmp_path / "a.txt", "a"), _write(tmp_path / "b.txt", "b")
+    _generate(manifest_path, [a, b])
+
+    manifest, changed = _generate(manifest_path, [a])
+    assert changed == []
+    assert manifest.deleted == {str(b)}
+
+
+def test_files_missing_from_the_docstore_are_loaded_again(tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    a, b = _write(tmp_path / "a.txt", "a"), _write(tmp_path / "b.txt", "b")
+    _generate(manifest_path, [a, b])
+
+    manifest = FileManifest.load(manifest_path)
+    manifest.discard_missing(lambda doc_id: doc_id != "doc-b.txt")
+    assert manifest.changed_files([a, b]) == [b]
+    assert manifest.new == {str(b)}
+
+
+def test_invalid_manifests_are_ignored(tmp_path):
+    path = tmp_path / "manifest.json"
+    for content in ["not json", '{"version": 99, "files": {}}', '{"version": 1}']:
+        path.write_text(content)
+        assert FileManifest.load(str(path)).previous == {}
+    assert FileManifest.load(str(tmp_path / "missing.json")).previous == {}
@@ -0,0 +1,99 @@
+import qdrant_client
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.api.chat.engine.payload import (
+    FORMAT_KEY,
+    from_compact_payload,
+    get_payload_fields,
+    is_compact_payload,
+    to_compact_payload,
+)
+from app.api.chat.engine.storage_profiles import get_storage_profile
+from app.api.chat.engine.vectordb import RAGQdrantVectorStore
+
+
+def _node(node_id: str, text: str, embedding=None) -> TextNode:
+    node = TextNode(
+        id_=node_id,
+        text=text,
+        metadata={"file_name": "a.pdf", "private": "false", "page_label": "3"},
+        excluded_llm_metadata_keys=["private"],
+        excluded_embed_metadata_keys=["file_name", "private"],
+        start_char_idx=10,
+        end_char_idx=10 + len(text),
+        embedding=embedding,
+    )
+    node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id="doc-1")
+    return node
+
+
+def test_compact_payload_round_trip():
+    node = _node("n1", "The dose is 200 mg.")
+    payload = to_compact_payload(node)
+    assert is_compact_payload(payload)
+    assert "_node_content" not in payload
+
+    restored = from_compact_payload("n1", payload)
+    assert restored.node_id == "n1"
+    assert restored.text == node.text
+    assert restored.metadata == node.metadata
+    assert restored.ref_doc_id == "doc-1"
+    assert restored.excluded_llm_metadata_keys == ["private"]
+    assert restored.excluded_embed_metadata_keys == ["file_name", "private"]
+    assert (restored.start_char_idx, restored.end_char_idx) == (10, 29)
+
+
+def test_compact_payload_without_document():
+    node = TextNode(id_="n1", text="text", metadata={"empty": None})
+    payload = to_compact_payload(node)
+    assert "empty" not in payload
+    restored = from_compact_payload("n1", payload)
+    assert restored.ref_doc_id is None
+    assert restored.metadata == {}
+    assert FORMAT_KEY not in restored.metadata
+
+
+def test_payload_fields(monkeypatch):
+    monkeypatch.delenv("QDRANT_PAYLOAD_FIELDS", raising=False)
+    fields = get_payload_fields()
+    assert {"_format", "text", "_node_content", "file_name", "private"} <= set(fields)
+
+    monkeypatch.setenv("QDRANT_PAYLOAD_FIELDS", "title, ,author")
+    fields = get_payload_fields()
+    assert "title" in fields and "author" in fields
+    assert "file_name" not in fields
+    # The full format keys are always fetched
+    assert "_node_content" in fields
+
+
+def _store(client, compact: bool) -> RAGQdrantVectorStore:
+    return RAGQdrantVectorStore(
+        client=client,
+        collection_name="test-payload",
+        storage_profile=get_storage_profile("default"),
+        compact_payload=compact,
+    )
+
+
+def test_compact_store_reads_both_formats():
+    client = qdrant_client.QdrantClient(location=":memory:")
+    # Points written before and after switching to the compact format
+    _store(client, compact=False).add(
+        [_node("00000000-0000-0000-0000-000000000001", "full point", [1.0, 0.0])]
+    )
+    store = _store(client, compact=True)
+    store.add(
+        [_node("00000000-0000-0000-0000-000000000002", "compact point", [0.9, 0.1])]
+    )
+
+    result = store.query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=2)
+    )
+    assert [node.get_content() for node in result.nodes] == [
+        "full point",
+        "compact point",
+    ]
+    for node in result.nodes:
+        assert node.ref_doc_id == "doc-1"
+        assert node.metadata["file_name"] == "a.pdf"
@@ -0,0 +1,88 @@
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+from app.api.chat.engine.sparse import (
+    reciprocal_rank_fusion,
+    sparse_doc_encoder,
+    sparse_query_encoder,
+    token_index,
+    tokenize,
+)
+
+
+def _result(*node_ids: str) -> VectorStoreQueryResult:
+    return VectorStoreQueryResult(
+        nodes=[TextNode(id_=node_id, text=node_id) for node_id in node_ids],
+        similarities=[1.0] * len(node_ids),
+        ids=list(node_ids),
+    )
+
+
+def _weights(indices, values):
+    return dict(zip(indices, values))
+
+
+def test_tokenize_drops_the_stopwords_and_splits_the_codes():
+    assert tokenize("What is the dose of AB-1234?") == ["dose", "ab", "1234"]
+
+
+def test_token_index_is_stable_and_fits_uint32():
+    assert token_index("dose") == token_index("dose")
+    assert 0 <= token_index("dose") < 2**32
+
+
+def test_query_encoder_is_binary():
+    [indices], [values] = sparse_query_encoder(["dose dose aspirin"])
+    assert sorted(indices) == sorted({token_index("dose"), token_index("aspirin")})
+    assert indices == sorted(indices)
+    assert values == [1.0, 1.0]
+
+
+def test_doc_encoder_saturates_the_term_frequency():
+    [indices], [values] = sparse_doc_encoder(["dose " * 50 + "aspirin"])
+    weights = _weights(indices, values)
+    dose, aspirin = weights[token_index("dose")], weights[token_index("aspirin")]
+    assert dose > aspirin
+    # BM25 bounds the weight of a term by k1 + 1
+    assert dose < 2.2
+
+
+def test_doc_encoder_normalizes_by_the_length(monkeypatch):
+    monkeypatch.setenv("SPARSE_AVG_DOC_LENGTH", "10")
+    indices, values = sparse_doc_encoder(["aspirin", "aspirin " + "filler " * 40])
+    short, long = [
+        _weights(*doc)[token_index("aspirin")] for doc in zip(indices, values)
+    ]
+    assert short > long
+
+
+def test_doc_encoder_of_an_empty_text():
+    assert sparse_doc_encoder(["the of and"]) == ([[]], [[]])
+
+
+def test_rrf_ranks_the_nodes_found_by_both_searches_first():
+    fused = reciprocal_rank_fusion(_result("a", "b", "c"), _result("c", "d"), top_k=4)
+    assert fused.ids[0] == "c"
+    assert set(fused.ids) == {"a", "b", "c", "d"}
+    assert fused.similarities == sorted(fused.similarities, reverse=True)
+    assert [node.node_id for node in fused.nodes] == fused.ids
+
+
+def test_rrf_keeps_the_top_k():
+    fused = reciprocal_rank_fusion(_result("a", "b", "c"), _result("d", "e"), top_k=2)
+    assert len(fused.ids) == 2
+
+
+@pytest.mark.parametrize("alpha, expected", [(1.0, "a"), (0.0, "d")])
+def test_rrf_alpha_weights_the_rankings(alpha, expected):
+    fused = reciprocal_rank_fusion(
+        _result("a", "b"), _result("d", "e"), alpha=alpha, top_k=1
+    )
+    assert fused.ids == [expected]
+
+
+def test_rrf_of_empty_results():
+    empty = VectorStoreQueryResult(nodes=None, similarities=None, ids=None)
+    fused = reciprocal_rank_fusion(empty, empty)
+    assert fused.nodes is None and fused.ids is None
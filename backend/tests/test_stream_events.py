@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import pytest
+
+from app.api.chat.stream_events import (
+    DataEvent,
+    SourcesEvent,
+    SuggestionsEvent,
+    TitleEvent,
+    TokenEvent,
+    coalesce_tokens,
+)
+
+
+async def _events(items, delay: float = 0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+def _collect(events, interval: float, max_bytes: int):
+    async def collect():
+        return [event async for event in coalesce_tokens(events, interval, max_bytes)]
+
+    return asyncio.run(collect())
+
+
+def test_token_event_escapes_the_wire_format():
+    assert TokenEvent('a "b"\nc').encode() == b'0:"a \\"b\\"\\nc"\n'
+
+
+def test_data_event_encoding():
+    payload = SourcesEvent({"nodes": []}).encode().decode()
+    assert payload.startswith("8:") and payload.endswith("\n")
+    assert json.loads(payload[2:]) == [{"type": "sources", "data": {"nodes": []}}]
+
+
+@pytest.mark.parametrize("event_cls", [SourcesEvent, SuggestionsEvent, TitleEvent])
+def test_data_event_from_dict_round_trip(event_cls):
+    event = event_cls(["a", "b"])
+    restored = DataEvent.from_dict(event.to_dict())
+    assert type(restored) is event_cls
+    assert restored.data == ["a", "b"]
+
+
+def test_data_event_from_dict_rejects_unknown_types():
+    with pytest.raises(ValueError):
+        DataEvent.from_dict({"type": "unknown", "data": None})
+
+
+def test_coalesce_sends_the_first_token_right_away():
+    tokens = [TokenEvent(t) for t in ["a", "b", "c", "d"]]
+    events = _collect(_events(tokens), interval=10, max_bytes=0)
+    assert [event.token for event in events] == ["a", "bcd"]
+
+
+def test_coalesce_flushes_on_max_bytes():
+    tokens = [TokenEvent(t) for t in ["a", "bb", "cc", "dd", "e"]]
+    events = _collect(_events(tokens), interval=10, max_bytes=4)
+    assert [event.token for event in events] == ["a", "bbcc", "dde"]
+
+
+def test_coalesce_flushes_on_the_interval():
+    tokens = [TokenEvent(t) for t in ["a", "b", "c"]]
+    events = _collect(_events(tokens, delay=0.05), interval=0.01, max_bytes=0)
+    assert [event.token for event in events] == ["a", "b", "c"]
+
+
+def test_coalesce_keeps_the_order_of_data_events():
+    sources = SourcesEvent([])
+    items = [
+        TokenEvent("a"),
+        TokenEvent("b"),
+        TokenEvent("c"),
+        sources,
+        TokenEvent("d"),
+    ]
+    events = _collect(_events(items), interval=10, max_bytes=0)
+    assert events[0].token == "a"
+    assert events[1].token == "bc"
+    assert events[2] is sources
+    assert events[3].token == "d"
+
+
+def test_coalesce_without_interval_only_flushes_on_max_bytes():
+    tokens = [TokenEvent(t) for t in ["a", "b", "c", "d", "e", "f"]]
+    events = _collect(_events(tokens), interval=0, max_bytes=2)
+    assert [event.token for event in events] == ["a", "bc", "de", "f"]